@@ -18,6 +18,46 @@ Installazione:
 
 Avvio:
     python3 gesture_client.py --host <IP_DEL_PI> --port 5000
+
+    # Canale comandi: auto (UDP se il server lo offre), udp, http
+    python3 gesture_client.py --host <IP_DEL_PI> --channel http
+
+    # Riconoscimento gesti nel main loop come nelle versioni precedenti
+    python3 gesture_client.py --host <IP_DEL_PI> --inference sync
+
+    # Mano e viso: seriale | parallelo | cortocircuito (viso saltato se la
+    # mano è stabile); confronto degli fps sulla webcam locale
+    python3 gesture_client.py --host <IP_DEL_PI> --policy parallelo
+    python3 gesture_client.py --bench-inference 150
+
+    # Stabilizzazione gesti: voto su 9 frame, nuovo gesto tenuto almeno 0.2 s
+    python3 gesture_client.py --host <IP_DEL_PI> --smooth-window 9 --smooth-dwell 0.2
+    python3 gesture_client.py --test-gesti
+
+    # Registra i landmark di una sessione e rigiocali senza webcam
+    python3 gesture_client.py --host <IP_DEL_PI> --record-landmarks sessione.npz
+    python3 gesture_client.py --replay sessione.npz --save-decisions v1.npz
+    python3 gesture_client.py --replay sessione.npz --baseline v1.npz   # dopo una modifica
+
+    # PC lenti: inferenza sul ritaglio attorno alla mano, a 320 px di larghezza
+    python3 gesture_client.py --host <IP_DEL_PI> --roi --infer-width 320
+
+    # Latenza di ogni frame Pi Camera (cattura → finestra) salvata in CSV
+    python3 gesture_client.py --host <IP_DEL_PI> --latency-csv latenza.csv
+
+    # Benchmark del parser MJPEG su una cattura registrata
+    python3 gesture_client.py --host <IP_DEL_PI> --record-stream cattura.mjpeg --secondi 10
+    python3 gesture_client.py --bench-parser cattura.mjpeg
+
+    # Costo del disegno HUD: ridisegno completo contro livelli in cache
+    python3 gesture_client.py --bench-hud 600
+
+    # Decoder QR: pyzbar / OpenCV, frame intero / regioni candidate
+    python3 gesture_client.py --bench-qr 20
+    python3 gesture_client.py --host <IP_DEL_PI> --qr-backend opencv
+
+    # Missione: tappe per testo QR ed eventi visto/perso/rivisto su CSV
+    python3 gesture_client.py --host <IP_DEL_PI> --missioni tappe.json --qr-log eventi.csv
 """
 
 import cv2
@@ -28,21 +68,32 @@ from mediapipe.tasks.python import vision as mp_vision
 import requests
 import urllib.request
 import argparse
+import csv
+import functools
+import importlib.util
+import json
 import threading
+import socket
+import struct
 import time
 import sys
 import os
 import numpy as np
+from abc import ABC, abstractmethod
+from collections import deque
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
 
-# QR code decoder — richiede: pip install pyzbar  (+ libzbar0 su Linux)
+# QR code decoder — pyzbar consigliato: pip install pyzbar  (+ libzbar0 su Linux)
+# Senza pyzbar si usa cv2.QRCodeDetector
 try:
     from pyzbar import pyzbar as _pyzbar
     QR_AVAILABLE = True
 except ImportError:
     _pyzbar = None
     QR_AVAILABLE = False
-    print("[WARN] pyzbar non trovato. QR code disabilitato. "
+    print("[WARN] pyzbar non trovato. QR con cv2.QRCodeDetector. "
           "Installa con: pip install pyzbar")
 
 # ─── Configurazione ────────────────────────────────────────────────────────────
@@ -73,9 +124,22 @@ PITCH_SOGLIA    = 0.055
 # 640×480 garantisce buona qualità per MediaPipe senza eccessivo carico
 DETECT_W, DETECT_H = 640, 480
 
-# Quanto spesso scansionare QR dalla Pi Camera (ogni N frame del main loop)
-# Valore più alto = meno carico CPU, ma QR rilevati con più ritardo
-QR_SCAN_EVERY = 5
+# Scansione QR in background: un frame Pi Camera viene scansionato solo se
+# la sua miniatura (QR_MOTION_W px, grigi) differisce dall'ultimo scansionato
+# di almeno QR_MOTION_SOGLIA livelli medi, o se sono passati QR_RESCAN_S
+# secondi. Un QR resta valido QR_TTL secondi dopo l'ultima lettura riuscita.
+QR_MOTION_W      = 80
+QR_MOTION_SOGLIA = 3.0
+QR_RESCAN_S      = 1.0
+QR_TTL           = 0.6
+
+# Motore QR: i candidati (pattern di posizionamento) si cercano sul frame
+# ridotto a QR_FIND_W px, poi si decodificano solo quei ritagli a piena
+# risoluzione; dopo QR_FULL_EVERY scansioni a vuoto si prova il frame intero
+QR_FIND_W     = 480
+QR_FULL_EVERY = 10
+QR_ROI_MIN    = 200     # lato minimo (px) a cui si ingrandisce un ritaglio candidato
+QR_BACKENDS   = ("auto", "pyzbar", "opencv")
 
 HAND_MODEL_URL = (
     "https://storage.googleapis.com/mediapipe-models/"
@@ -98,6 +162,35 @@ ACTION_COLOR = {
 }
 
 MODI = ["mano", "viso", "entrambi"]
+CANALI = ["auto", "udp", "http"]
+
+# ── Protocollo canale comandi UDP (identico a alphabot_server4.py) ────────────
+UDP_MAGIC    = b"AB"
+UDP_VERSION  = 1
+UDP_CMD, UDP_ACK, UDP_PING, UDP_BATCH, UDP_STEP = 1, 2, 3, 4, 5
+UDP_OK, UDP_INVALID, UDP_STALE = 0, 1, 2
+UDP_PACKET   = struct.Struct("!2sBBIBBd")
+UDP_BATCH_HDR = struct.Struct("!2sBBIBd")
+UDP_SETPOINT = struct.Struct("!BhhH")
+UDP_STEP_PKT = struct.Struct("!2sBBIBBHHHd")
+ACTION_IDS   = {"stop": 0, "avanti": 1, "indietro": 2, "sinistra": 3, "destra": 4}
+
+# Verso delle ruote (sx, dx) per ogni azione, positivo = avanti
+WHEEL_DIR = {"avanti": (1, 1), "indietro": (-1, -1),
+             "sinistra": (-1, 1), "destra": (1, -1), "stop": (0, 0)}
+
+
+def encode_batch(seq: int, setpoints, t_client: float) -> bytes:
+    """
+    Impacchetta una sequenza di setpoint (UDP_BATCH). setpoints è una
+    lista di (azione, speed, durata_s), eseguita dal Pi con timing locale.
+    """
+    body = b"".join(
+        UDP_SETPOINT.pack(ACTION_IDS[a], WHEEL_DIR[a][0] * speed,
+                          WHEEL_DIR[a][1] * speed, int(round(d * 1000)))
+        for a, speed, d in setpoints)
+    return UDP_BATCH_HDR.pack(UDP_MAGIC, UDP_VERSION, UDP_BATCH, seq,
+                              len(setpoints), t_client) + body
 
 
 # ─── Download modelli ─────────────────────────────────────────────────────────
@@ -117,33 +210,210 @@ def ensure_models(mode):
     if mode in ("viso",  "entrambi"): _download(FACE_MODEL_URL, FACE_MODEL_PATH, "face_landmarker")
 
 
+# ─── Modalità di inferenza MediaPipe ──────────────────────────────────────────
+# image: detection completa ad ogni frame, nel main loop (comportamento storico)
+# video: detect_for_video — tra un frame e l'altro i landmark vengono
+#        inseguiti (tracking) e la detection riparte solo se il tracking cede
+# live:  detect_async — come video, ma MediaPipe elabora in background e
+#        consegna il risultato con una callback; i frame che arrivano mentre
+#        il grafo è occupato vengono scartati da MediaPipe stesso
+RUNNING_MODES = {
+    "image": mp_vision.RunningMode.IMAGE,
+    "video": mp_vision.RunningMode.VIDEO,
+    "live":  mp_vision.RunningMode.LIVE_STREAM,
+}
+INFERENZE = ("sync", "video", "live")   # sync = modalità image nel main loop
+
+# Un gesto più vecchio di così (inferenza bloccata o lenta) vale "nessun gesto"
+GESTO_MAX_ETA = 0.5
+
+# Mano e viso in modalità "entrambi":
+# seriale:       uno dopo l'altro sullo stesso frame
+# parallelo:     viso su un secondo thread mentre gira la mano (MediaPipe
+#                rilascia il GIL durante l'inferenza → due core)
+# cortocircuito: come parallelo, ma se la mano dà lo stesso gesto per
+#                MANO_STABILE_K frame di fila il viso non viene eseguito affatto
+#                (la presenza della mano la filtra già MediaPipe con
+#                min_hand_presence_confidence)
+POLITICHE          = ("seriale", "parallelo", "cortocircuito")
+MANO_STABILE_K     = 5
+
+
+class _Recogniser(ABC):
+    """
+    Parte comune di mano e viso: stessa immagine RGB (mp.Image) per tutti i
+    riconoscitori, chiamata giusta per la modalità e ultimo gesto in .action.
+    Le sottoclassi danno _classify() e _landmarks().
+
+    Con roi=True (solo modalità image) dopo la prima detection l'inferenza
+    gira su un ritaglio attorno ai landmark del frame precedente, più
+    ROI_MARGINE; se nel ritaglio non trova più niente ripete subito la
+    ricerca sul frame intero. I gesti usano solo rapporti e confronti tra
+    landmark sullo stesso asse, quindi valgono uguali sul ritaglio.
+    """
+
+    ROI_MARGINE = 0.4      # margine attorno al bounding box, in frazione del lato maggiore
+    ROI_MIN     = 96       # lato minimo del ritaglio (pixel)
+
+    def __init__(self, running_mode: str, on_result=None, roi: bool = False):
+        self._mode      = running_mode
+        self._on_result = on_result
+        self._roi_on    = roi and running_mode == "image"
+        self._roi       = None      # (x0, y0, x1, y1) in pixel del frame intero
+        self._box       = None      # ritaglio usato dall'ultimo risultato (None = intero)
+        self._shape     = None      # forma del frame intero dell'ultimo risultato
+        self.roi_hits   = 0         # frame risolti sul ritaglio
+        self.roi_lost   = 0         # ritagli senza risultato → frame intero
+        self._result    = None
+        self.action: Optional[str] = None
+        self.handedness_score = 0.0  # confidenza destra/sinistra, non di presenza (0 = niente)
+        self.ts_ms      = 0         # timestamp del frame dell'ultimo risultato
+        self.runs       = 0
+        self.ms: Optional[float] = None   # durata media di detect_image (video/image)
+
+    def _callback(self):
+        """result_callback per la modalità live, None nelle altre."""
+        return self._on_async if self._mode == "live" else None
+
+    def detect(self, bgr_frame) -> Optional[str]:
+        return self.detect_rgb(cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB))
+
+    def detect_rgb(self, rgb, ts_ms: int = 0, image=None) -> Optional[str]:
+        """
+        rgb:   frame intero RGB (numpy), condiviso tra mano e viso.
+        image: mp.Image già costruita sullo stesso array, se c'è.
+        """
+        self._shape = rgb.shape
+        if self._roi_on and self._roi is not None:
+            x0, y0, x1, y1 = self._box = self._roi
+            crop   = np.ascontiguousarray(rgb[y0:y1, x0:x1])
+            action = self.detect_image(mp.Image(image_format=mp.ImageFormat.SRGB,
+                                                data=crop), ts_ms)
+            if self._landmarks() is not None:
+                self.roi_hits += 1
+                self._update_roi(rgb.shape, self._roi)
+                return action
+            self.roi_lost += 1
+            self._roi = None
+        self._box = None
+        if image is None:
+            image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb)
+        action = self.detect_image(image, ts_ms)
+        if self._roi_on:
+            self._update_roi(rgb.shape, None)
+        return action
+
+    def _update_roi(self, shape, box):
+        """Nuovo ritaglio dai landmark dell'ultimo risultato (box = ritaglio usato)."""
+        lm = self._landmarks()
+        if lm is None:
+            self._roi = None
+            return
+        fh, fw = shape[:2]
+        bx, by = (box[0], box[1]) if box else (0, 0)
+        bw, bh = (box[2] - box[0], box[3] - box[1]) if box else (fw, fh)
+        xs = [bx + p.x * bw for p in lm]
+        ys = [by + p.y * bh for p in lm]
+        side = max(max(xs) - min(xs), max(ys) - min(ys))
+        half = max(self.ROI_MIN, side * (1 + 2 * self.ROI_MARGINE)) / 2
+        cx, cy = (max(xs) + min(xs)) / 2, (max(ys) + min(ys)) / 2
+        x0, x1 = int(max(0, cx - half)), int(min(fw, cx + half))
+        y0, y1 = int(max(0, cy - half)), int(min(fh, cy + half))
+        self._roi = (x0, y0, x1, y1) if x1 - x0 >= 16 and y1 - y0 >= 16 else None
+
+    @abstractmethod
+    def _classify(self, result) -> Optional[str]:
+        """Gesto di un risultato MediaPipe, None se non riconosciuto."""
+
+    @abstractmethod
+    def _landmarks(self):
+        """Landmark del primo soggetto dell'ultimo risultato, None se assente."""
+
+    def landmarks_xyz(self):
+        """Landmark dell'ultimo risultato come array (K, 3), normalizzati sul frame intero."""
+        lm = self._landmarks()
+        if lm is None:
+            return None
+        pts = np.array([(p.x, p.y, p.z) for p in lm], dtype=np.float32)
+        if self._box is not None:
+            x0, y0, x1, y1 = self._box
+            fh, fw = self._shape[:2]
+            pts[:, 0] = (x0 + pts[:, 0] * (x1 - x0)) / fw
+            pts[:, 1] = (y0 + pts[:, 1] * (y1 - y0)) / fh
+        return pts
+
+    @classmethod
+    def solo_classificazione(cls):
+        """Istanza senza modello MediaPipe, per rigiocare landmark registrati con _classify()."""
+        rec = cls.__new__(cls)
+        _Recogniser.__init__(rec, "image")
+        return rec
+
+    def detect_image(self, image, ts_ms: int = 0) -> Optional[str]:
+        """
+        image: mp.Image RGB già convertita (condivisa tra mano e viso).
+        ts_ms: timestamp crescente, richiesto dalle modalità video e live.
+        In live ritorna l'ultimo gesto noto: il nuovo arriva dalla callback.
+        """
+        self.runs += 1
+        if self._mode == "live":
+            self._det.detect_async(image, ts_ms)
+            return self.action
+        t0 = time.perf_counter()
+        if self._mode == "video":
+            self._result = self._det.detect_for_video(image, ts_ms)
+        else:
+            self._result = self._det.detect(image)
+        self.action = self._classify(self._result)
+        ms = (time.perf_counter() - t0) * 1000.0
+        self.ms = ms if self.ms is None else 0.9 * self.ms + 0.1 * ms
+        return self.action
+
+    def _on_async(self, result, image, ts_ms):
+        self._result = result
+        self.action  = self._classify(result)
+        self.ts_ms   = ts_ms
+        if self._on_result:
+            self._on_result(self)
+
+    def close(self):
+        self._det.close()
+
+
 # ─── Riconoscimento MANO ──────────────────────────────────────────────────────
 
-class HandRecogniser:
+class HandRecogniser(_Recogniser):
     CONNECTIONS = [
         (0,1),(1,2),(2,3),(3,4),(0,5),(5,6),(6,7),(7,8),
         (0,9),(9,10),(10,11),(11,12),(0,13),(13,14),(14,15),(15,16),
         (0,17),(17,18),(18,19),(19,20),(5,9),(9,13),(13,17),
     ]
 
-    def __init__(self):
+    ROI_MARGINE = 0.5      # la mano si sposta più in fretta del viso
+
+    def __init__(self, running_mode="image", on_result=None, roi=False):
+        super().__init__(running_mode, on_result, roi)
         opts = mp_vision.HandLandmarkerOptions(
             base_options=mp_python.BaseOptions(model_asset_path=HAND_MODEL_PATH),
-            running_mode=mp_vision.RunningMode.IMAGE,
+            running_mode=RUNNING_MODES[running_mode],
             num_hands=1,
             min_hand_detection_confidence=0.70,
             min_hand_presence_confidence=0.70,
             min_tracking_confidence=0.60,
+            result_callback=self._callback(),
         )
-        self._det    = mp_vision.HandLandmarker.create_from_options(opts)
-        self._result = None
+        self._det = mp_vision.HandLandmarker.create_from_options(opts)
 
-    def detect(self, bgr_frame) -> Optional[str]:
-        rgb          = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB)
-        self._result = self._det.detect(mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb))
-        if not self._result.hand_landmarks:
+    def _landmarks(self):
+        r = self._result
+        return r.hand_landmarks[0] if r is not None and r.hand_landmarks else None
+
+    def _classify(self, result) -> Optional[str]:
+        if not result.hand_landmarks:
+            self.handedness_score = 0.0
             return None
-        lm        = self._result.hand_landmarks[0]
+        self.handedness_score = result.handedness[0][0].score if result.handedness else 0.0
+        lm        = result.hand_landmarks[0]
         thumb_up  = lm[4].x  < lm[3].x
         index_up  = lm[8].y  < lm[6].y
         middle_up = lm[12].y < lm[10].y
@@ -160,30 +430,41 @@ class HandRecogniser:
 
 # ─── Riconoscimento VISO ──────────────────────────────────────────────────────
 
-class FaceRecogniser:
+class FaceRecogniser(_Recogniser):
     CONTOUR = [10,338,297,332,284,251,389,356,454,323,361,288,
                397,365,379,378,400,377,152,148,176,149,150,136,
                172,58,132,93,234,127,162,21,54,103,67,109,10]
 
-    def __init__(self):
+    ROI_MARGINE = 0.3
+
+    def __init__(self, running_mode="image", on_result=None, roi=False):
+        super().__init__(running_mode, on_result, roi)
         opts = mp_vision.FaceLandmarkerOptions(
             base_options=mp_python.BaseOptions(model_asset_path=FACE_MODEL_PATH),
-            running_mode=mp_vision.RunningMode.IMAGE,
+            running_mode=RUNNING_MODES[running_mode],
             num_faces=1,
             min_face_detection_confidence=0.60,
             min_face_presence_confidence=0.60,
             min_tracking_confidence=0.50,
+            result_callback=self._callback(),
         )
         self._det    = mp_vision.FaceLandmarker.create_from_options(opts)
-        self._result = None
         self._yaw    = 0.0
         self._pitch  = 0.0
 
-    def detect(self, bgr_frame) -> Optional[str]:
-        rgb          = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB)
-        self._result = self._det.detect(mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb))
-        if not self._result.face_landmarks: return None
-        lm       = self._result.face_landmarks[0]
+    def _landmarks(self):
+        r = self._result
+        return r.face_landmarks[0] if r is not None and r.face_landmarks else None
+
+    @classmethod
+    def solo_classificazione(cls):
+        rec = super().solo_classificazione()
+        rec._yaw = rec._pitch = 0.0
+        return rec
+
+    def _classify(self, result) -> Optional[str]:
+        if not result.face_landmarks: return None
+        lm       = result.face_landmarks[0]
         nose     = lm[1]; forehead = lm[10]; chin = lm[152]
         leye     = lm[33]; reye = lm[263]
         l_dist   = abs(nose.x - leye.x); r_dist = abs(nose.x - reye.x)
@@ -197,33 +478,993 @@ class FaceRecogniser:
         return None
 
 
+def scala_inferenza(bgr, width: Optional[int]):
+    """Riduce il frame alla larghezza di inferenza (mai ingrandisce)."""
+    if not width or bgr.shape[1] <= width:
+        return bgr
+    h = int(round(bgr.shape[0] * width / bgr.shape[1]))
+    return cv2.resize(bgr, (width, h), interpolation=cv2.INTER_AREA)
+
+
+# ─── Inferenza asincrona ──────────────────────────────────────────────────────
+
+class GestureInference:
+    """
+    Riconoscimento gesti fuori dal main loop. submit() lascia il frame della
+    webcam in una casella a posto singolo (vince sempre l'ultimo); un thread
+    lo specchia, lo converte in RGB una volta sola per mano e viso e lo passa
+    ai riconoscitori in modalità video o live. latest() ritorna l'ultimo
+    gesto pubblicato: display e invio comandi vanno alla velocità della
+    webcam, indipendentemente da quanto dura l'inferenza.
+    """
+
+    def __init__(self, mode: str, running_mode: str = "video",
+                 policy: str = "cortocircuito", avvia: bool = True,
+                 roi: bool = False, infer_width: Optional[int] = None,
+                 smoother: Optional["GestureSmoother"] = None,
+                 recorder: Optional["LandmarkRecorder"] = None):
+        """
+        mode:         "mano" | "viso" | "entrambi"
+        running_mode: "video" | "live"
+        policy:       una di POLITICHE (conta solo con mano e viso insieme)
+        avvia:        False = nessun thread, i frame si passano a process()
+        roi:          inferenza sul ritaglio attorno all'ultimo risultato. Il
+                      tracking lo fa il ritaglio, quindi i riconoscitori
+                      lavorano in modalità image (il tracking di MediaPipe
+                      non regge un'inquadratura che cambia ad ogni frame)
+        infer_width:  larghezza a cui ridurre il frame prima dell'inferenza
+                      (None = risoluzione della webcam)
+        smoother:     GestureSmoother applicato a ogni frame elaborato
+                      (None = gesto grezzo del singolo frame)
+        recorder:     LandmarkRecorder che salva i landmark di ogni frame
+                      (non in live: i risultati arrivano fuori ordine)
+        """
+        if roi:
+            running_mode = "image"
+        on_result = self._on_async if running_mode == "live" else None
+        self.hand = HandRecogniser(running_mode, on_result, roi) if mode in ("mano", "entrambi") else None
+        self.face = FaceRecogniser(running_mode, on_result, roi) if mode in ("viso", "entrambi") else None
+        self.running_mode = running_mode
+        self.roi          = roi
+        self.infer_width  = infer_width
+        self.policy       = policy
+        self._pool = None
+        if self.hand and self.face and policy != "seriale" and running_mode != "live":
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="viso")
+        self._hand_streak = 0       # frame consecutivi con lo stesso gesto della mano
+        self._hand_prev   = None
+        self.face_skipped = 0
+
+        self._cond     = threading.Condition()
+        self._pending  = None       # (frame BGR, istante di submit)
+        self._gesture  = (None, "", 0.0)   # (azione, sorgente, istante del frame)
+        self._last_ts  = 0
+        self._running  = True
+        self.frames    = 0
+        self.dropped   = 0          # frame sostituiti prima dell'inferenza
+        self.ms: Optional[float]  = None    # durata media (frame → gesto)
+        self.fps: Optional[float] = None    # gesti pubblicati al secondo
+        self._last_pub = None
+        self._last_frame_t = 0.0
+        self._pub_lock = threading.Lock()
+        self._attesi   = {}         # live: ts del frame → {riconoscitore: azione o _ATTESA}
+        self.smoother: Optional["GestureSmoother"] = smoother
+        self.recorder = recorder if running_mode != "live" else None
+        self._source   = ""         # sorgente del gesto stabile
+        self._thread   = None
+        if avvia:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def submit(self, bgr_frame):
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (bgr_frame, time.monotonic())
+            self._cond.notify()
+
+    def latest(self):
+        """(azione, sorgente) dell'ultimo gesto; (None, "") se troppo vecchio."""
+        action, source, t = self._gesture
+        if time.monotonic() - t > GESTO_MAX_ETA:
+            return None, ""
+        return action, source
+
+    def stats(self) -> dict:
+        recs = [rec for rec in (self.hand, self.face) if rec]
+        return {"mode": "roi" if self.roi else self.running_mode,
+                "policy": self.policy,
+                "roi_hits": sum(rec.roi_hits for rec in recs),
+                "roi_lost": sum(rec.roi_lost for rec in recs),
+                "fps": self.fps, "ms": self.ms,
+                "frames": self.frames, "dropped": self.dropped,
+                "face_skipped": self.face_skipped,
+                "hand_ms": self.hand.ms if self.hand else None,
+                "face_ms": self.face.ms if self.face else None}
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        if self._pool:
+            self._pool.shutdown(wait=True)
+        for rec in (self.hand, self.face):
+            if rec:
+                rec.close()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or not self._running)
+                if not self._running:
+                    return
+                bgr, t_submit = self._pending
+                self._pending = None
+            self.process(bgr, t_submit)
+
+    def process(self, bgr, t_submit: float):
+        """Inferenza di un frame nel thread chiamante (il worker o il benchmark)."""
+        bgr = scala_inferenza(bgr, self.infer_width)
+        # Una sola conversione (specchio + RGB) condivisa da mano e viso
+        bgr   = cv2.flip(bgr, 1)
+        rgb   = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb)
+        # MediaPipe vuole timestamp strettamente crescenti (ms)
+        ts = max(int(t_submit * 1000), self._last_ts + 1)
+        self._last_ts = ts
+        self.frames  += 1
+
+        face = self.face
+        if face and self.hand and self.policy == "cortocircuito" \
+                and self._hand_streak >= MANO_STABILE_K:
+            # La mano vince comunque: il viso non serve finché resta stabile
+            face.action = None
+            face = None
+            self.face_skipped += 1
+
+        if self.running_mode == "live":
+            # Registrato prima di detect_async: la callback può arrivare subito
+            with self._pub_lock:
+                self._attesi[ts] = {rec: self._ATTESA for rec in (self.hand, face) if rec}
+
+        if face and self.hand and self._pool:
+            pending = self._pool.submit(face.detect_rgb, rgb, ts, image)
+            self.hand.detect_rgb(rgb, ts, image)
+            pending.result()
+        else:
+            for rec in (self.hand, face):
+                if rec:
+                    rec.detect_rgb(rgb, ts, image)
+
+        hand = self.hand.action if self.hand else None
+        if hand is not None and hand == self._hand_prev:
+            self._hand_streak += 1
+        else:
+            self._hand_streak = int(hand is not None)
+        self._hand_prev = hand
+        if self.recorder:
+            self.recorder.add(t_submit, self.hand, face, bgr)
+        if self.running_mode != "live":     # in live pubblica la callback
+            self._publish(t_submit,
+                          self.hand.action if self.hand else None,
+                          face.action if face else None)
+
+    _ATTESA = object()      # risultato live non ancora arrivato
+
+    def _on_async(self, rec):
+        """
+        Callback live (thread di MediaPipe). Mano e viso rispondono per lo
+        stesso frame da thread diversi e in ordine qualsiasi: il frame si
+        pubblica una volta sola, quando sono arrivati i risultati di tutti i
+        riconoscitori eseguiti. I frame più vecchi ancora incompleti (scartati
+        da MediaPipe sotto carico) vengono lasciati cadere.
+        """
+        with self._pub_lock:
+            attesi = self._attesi.get(rec.ts_ms)
+            if attesi is None or rec not in attesi:
+                return
+            attesi[rec] = rec.action
+            if self._ATTESA in attesi.values():
+                return
+            for ts in [ts for ts in self._attesi if ts <= rec.ts_ms]:
+                del self._attesi[ts]
+        self._publish(rec.ts_ms / 1000.0,      # ts_ms viene da time.monotonic()
+                      attesi.get(self.hand), attesi.get(self.face))
+
+    def _publish(self, t_frame: float, hand: Optional[str], face: Optional[str]):
+        """Un voto per frame, con i gesti di mano e viso dello stesso frame."""
+        # La mano ha la priorità, il viso fa da fallback
+        if hand is not None:   action, source = hand, "mano"
+        elif face is not None: action, source = face, "viso"
+        else:                  action, source = None, ""
+
+        with self._pub_lock:
+            if t_frame <= self._last_frame_t:
+                return              # superato da un frame più recente
+            self._last_frame_t = t_frame
+            if self.smoother:
+                grezzo = action
+                action = self.smoother.update(grezzo, t_frame)
+                if action is None:     source = ""
+                elif action == grezzo: self._source = source
+                else:                  source = self._source
+            self._gesture = (action, source, t_frame)
+        now = time.monotonic()
+        ms  = (now - t_frame) * 1000.0
+        self.ms = ms if self.ms is None else 0.9 * self.ms + 0.1 * ms
+        if self._last_pub is not None and now > self._last_pub:
+            fps = 1.0 / (now - self._last_pub)
+            self.fps = fps if self.fps is None else 0.9 * self.fps + 0.1 * fps
+        self._last_pub = now
+
+
+# ─── Stabilizzazione gesti ────────────────────────────────────────────────────
+
+class GestureSmoother:
+    """
+    Macchina a stati che trasforma il gesto grezzo di ogni frame in un
+    intento stabile, così un frame isolato sbagliato non manda un comando.
+
+    - voto a maggioranza sugli ultimi `window` frame (buffer circolare a
+      dimensione fissa con i conteggi aggiornati in O(1))
+    - isteresi: un nuovo gesto entra con almeno enter × window voti, quello
+      in corso resta finché ne ha almeno exit × window
+    - permanenza minima: il nuovo gesto deve vincere il voto per `dwell`
+      secondi prima di diventare l'intento; i gesti in `immediate` (stop e
+      nessun gesto) non aspettano, per fermare il robot il prima possibile
+    """
+
+    AZIONI = (None, "stop", "avanti", "indietro", "sinistra", "destra")
+    _INDEX = {a: i for i, a in enumerate(AZIONI)}
+
+    def __init__(self, window: int = 7, enter: float = 0.6, exit: float = 0.35,
+                 dwell: float = 0.15, immediate=(None, "stop")):
+        self._n         = max(1, window)
+        self._enter     = max(1, int(round(enter * self._n)))
+        self._exit      = max(1, int(round(exit * self._n)))
+        self._dwell     = dwell
+        self._immediate = {self._INDEX[a] for a in immediate}
+        self._ring      = [0] * self._n              # indici in AZIONI
+        self._counts    = [0] * len(self.AZIONI)
+        self._counts[0] = self._n                    # finestra iniziale: nessun gesto
+        self._pos       = 0
+        self._state     = 0
+        self._cand      = None
+        self._cand_t    = 0.0
+        self.last_raw: Optional[str] = None
+        self.raw_changes = 0       # cambi del gesto grezzo
+        self.changes     = 0       # cambi dell'intento stabile
+
+    @property
+    def action(self) -> Optional[str]:
+        return self.AZIONI[self._state]
+
+    def update(self, raw: Optional[str], t: float) -> Optional[str]:
+        """Aggiunge il gesto grezzo del frame (t in secondi) e ritorna l'intento stabile."""
+        if raw != self.last_raw:
+            self.raw_changes += 1
+            self.last_raw = raw
+        i = self._INDEX.get(raw, 0)
+        self._counts[self._ring[self._pos]] -= 1
+        self._ring[self._pos] = i
+        self._counts[i] += 1
+        self._pos = (self._pos + 1) % self._n
+
+        best = max(range(len(self._counts)), key=self._counts.__getitem__)
+        if best == self._state or (self._counts[self._state] >= self._exit
+                                   and self._counts[best] < self._enter):
+            self._cand = None
+            return self.action
+
+        if self._counts[best] >= self._enter:
+            target = best
+        elif self._counts[self._state] < self._exit:
+            target = 0        # l'intento ha perso il supporto e nessuno ha la maggioranza
+        else:
+            return self.action
+
+        if target != self._cand:
+            self._cand, self._cand_t = target, t
+        if target in self._immediate or t - self._cand_t >= self._dwell:
+            self._state = target
+            self._cand  = None
+            self.changes += 1
+        return self.action
+
+    def stats(self) -> dict:
+        return {"raw_changes": self.raw_changes, "changes": self.changes}
+
+
+def test_gesti() -> bool:
+    """
+    Verifica di GestureSmoother su sequenze tipiche (30 fps): sfarfallio di
+    un frame, cambio netto di gesto, rumore alternato e stop.
+    """
+    def replay(seq, **kw):
+        s, out = GestureSmoother(**kw), []
+        for k, raw in enumerate(seq):
+            out.append(s.update(raw, k / 30.0))
+        return s, out
+
+    ok = True
+    def check(nome, cond, dettaglio):
+        nonlocal ok
+        ok &= cond
+        print(f"  {'OK  ' if cond else 'FAIL'} {nome:<34} {dettaglio}")
+
+    seq = (["avanti"] * 4 + ["indietro"]) * 8               # un frame su 5 sbagliato
+    s, out = replay(seq)
+    check("sfarfallio di un frame", "indietro" not in out and s.changes == 1,
+          f"{s.raw_changes} cambi grezzi → {s.changes} stabili")
+
+    seq = ["avanti"] * 30 + ["destra"] * 30
+    s, out = replay(seq)
+    lag = out.index("destra") - 30 if "destra" in out else -1
+    check("cambio netto", s.changes == 2 and 0 <= lag <= 10,
+          f"destra dopo {lag} frame")
+
+    seq = ["avanti", "destra"] * 30                         # nessuna maggioranza
+    s, out = replay(seq)
+    check("rumore alternato", "destra" not in out and s.changes <= 2,
+          f"{s.raw_changes} cambi grezzi → {s.changes} stabili")
+
+    seq = ["avanti"] * 30 + ["stop"] * 10
+    s, out = replay(seq)
+    lag = out.index("stop") - 30 if "stop" in out else -1
+    check("stop senza permanenza minima", 0 <= lag <= 5, f"stop dopo {lag} frame")
+
+    seq = ["avanti"] * 30 + [None] * 10
+    s, out = replay(seq)
+    check("mano persa → nessun gesto", out[-1] is None, f"ultimo intento {out[-1]}")
+    return ok
+
+
+# ─── Registrazione e replay dei landmark ──────────────────────────────────────
+
+class LandmarkRecorder:
+    """
+    Registra per ogni frame i landmark di mano e viso (normalizzati sul frame
+    intero), la confidenza destra/sinistra della mano, il gesto deciso e, a
+    richiesta, il frame in JPEG. Salva un .npz compresso senza pickle:
+
+      t           (n,)         istante del frame (s, monotonic)
+      hand        (n, 21, 3)   float32, NaN se la mano non c'è
+      handedness  (n,)         float32, confidenza destra/sinistra (non di presenza)
+      face        (n, K, 3)    float32, NaN se il viso non c'è (K=0 senza viso)
+      decisions   (n, 2)       int8, gesto mano / viso come indice di GestureSmoother.AZIONI
+      jpeg, jpeg_off           frame JPEG concatenati e offset (solo con frames=True)
+      info                     JSON con modalità, orientamento e versione del formato
+
+    I frame vanno passati già specchiati, come li vedono i riconoscitori:
+    così landmark e JPEG hanno lo stesso orientamento (info["orientamento"]).
+    """
+
+    VERSION      = 1
+    ORIENTAMENTO = "specchiato"     # cv2.flip(frame, 1), come in inferenza
+
+    def __init__(self, path: str, frames: bool = False, info: Optional[dict] = None):
+        self.path    = path
+        self._frames = frames
+        self._info   = dict(info or {}, version=self.VERSION,
+                            orientamento=self.ORIENTAMENTO)
+        self._lock   = threading.Lock()
+        self._rows   = []        # (t, hand, handedness, face, dec_hand, dec_face, jpeg)
+
+    def add(self, t: float, hand, face, bgr=None):
+        """
+        hand/face: riconoscitori appena eseguiti sul frame (o None se non eseguiti).
+        bgr:       il frame specchiato dato ai riconoscitori.
+        """
+        jpeg = None
+        if self._frames and bgr is not None:
+            ok, buf = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, 80])
+            jpeg = buf.tobytes() if ok else None
+        idx = GestureSmoother._INDEX
+        row = (t,
+               hand.landmarks_xyz() if hand else None,
+               hand.handedness_score if hand else 0.0,
+               face.landmarks_xyz() if face else None,
+               idx.get(hand.action, 0) if hand else 0,
+               idx.get(face.action, 0) if face else 0,
+               jpeg)
+        with self._lock:
+            self._rows.append(row)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def save(self) -> int:
+        with self._lock:
+            rows = list(self._rows)
+        n = len(rows)
+        k_face = next((len(r[3]) for r in rows if r[3] is not None), 0)
+        hand = np.full((n, 21, 3), np.nan, dtype=np.float32)
+        face = np.full((n, k_face, 3), np.nan, dtype=np.float32)
+        for i, r in enumerate(rows):
+            if r[1] is not None: hand[i] = r[1]
+            if r[3] is not None: face[i] = r[3]
+        arrays = {
+            "t":          np.array([r[0] for r in rows], dtype=np.float64),
+            "hand":       hand,
+            "handedness": np.array([r[2] for r in rows], dtype=np.float32),
+            "face":       face,
+            "decisions":  np.array([(r[4], r[5]) for r in rows], dtype=np.int8).reshape(n, 2),
+            "info":       np.array(json.dumps(self._info)),
+        }
+        if self._frames:
+            jpegs = [r[6] or b"" for r in rows]
+            arrays["jpeg"]     = np.frombuffer(b"".join(jpegs), dtype=np.uint8)
+            arrays["jpeg_off"] = np.cumsum([0] + [len(j) for j in jpegs], dtype=np.int64)
+        np.savez_compressed(self.path, **arrays)
+        return n
+
+
+class _Punto:
+    """Landmark ricostruito dalla registrazione (stessi attributi di quelli MediaPipe)."""
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+
+def _risultati(lms, key: str, scores=None):
+    """Finti risultati MediaPipe (hand_landmarks / face_landmarks) da un array (n, K, 3)."""
+    out = []
+    for i, pts in enumerate(lms):
+        if pts.size == 0 or np.isnan(pts[0, 0]):
+            out.append(SimpleNamespace(**{key: [], "handedness": []}))
+            continue
+        punti = [_Punto(float(x), float(y), float(z)) for x, y, z in pts]
+        cat   = [[SimpleNamespace(score=float(scores[i]))]] if scores is not None else []
+        out.append(SimpleNamespace(**{key: [punti], "handedness": cat}))
+    return out
+
+
+def carica_funzione(path: str, nome: str):
+    """
+    Importa il modulo in `path` (che non deve avere effetti all'import)
+    e ne ritorna la funzione `nome`.
+    """
+    modulo = os.path.splitext(os.path.basename(path))[0]
+    spec   = importlib.util.spec_from_file_location(modulo, path)
+    if spec is None:
+        raise ImportError(f"{path} non è un modulo Python")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    fn = getattr(mod, nome, None)
+    if not callable(fn):
+        raise ImportError(f"{nome} non trovata in {path}")
+    return fn
+
+
+# Logica dei gesti del gioco, senza pygame (gioco1.py apre la finestra all'import)
+GIOCO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "..", "gioco", "gesti_mano.py")
+
+
+def replay_landmarks(path: str, baseline: Optional[str] = None,
+                     save_decisions: Optional[str] = None, gioco: str = GIOCO_PATH):
+    """
+    Rigioca una registrazione di LandmarkRecorder attraverso la logica di
+    classificazione (senza MediaPipe né webcam) alla massima velocità:
+    throughput, ritardo della stabilizzazione per gesto e differenze di
+    decisione rispetto alla registrazione o a un --baseline salvato prima.
+    """
+    data  = np.load(path)
+    info  = json.loads(str(data["info"]))
+    t     = data["t"]
+    n     = len(t)
+    azioni = GestureSmoother.AZIONI
+    print(f"Replay {path}: {n} frame, {t[-1] - t[0] if n else 0:.1f} s registrati, "
+          f"modalità {info.get('mode', '?')}, frame {info.get('orientamento', '?')}")
+
+    hand_res = _risultati(data["hand"], "hand_landmarks", data["handedness"])
+    face_res = _risultati(data["face"], "face_landmarks")
+    hand_rec = HandRecogniser.solo_classificazione()
+    face_rec = FaceRecogniser.solo_classificazione()
+    try:
+        closure = carica_funzione(gioco, "calculate_hand_closure")
+    except (OSError, ImportError) as e:
+        print(f"  [WARN] calculate_hand_closure non disponibile: {e}")
+        closure = None
+
+    decisions = np.zeros((n, 2), dtype=np.int8)
+    tempi     = {"mano": 0.0, "viso": 0.0, "chiusura": 0.0}
+    per_gesto = {}                        # azione → [frame, secondi di classificazione]
+    chiusure  = np.full(n, -1, dtype=np.int16)
+    for i in range(n):
+        t0 = time.perf_counter()
+        a_hand = hand_rec._classify(hand_res[i])
+        t1 = time.perf_counter()
+        a_face = face_rec._classify(face_res[i])
+        t2 = time.perf_counter()
+        if closure and hand_res[i].hand_landmarks:
+            chiusure[i] = closure(hand_res[i].hand_landmarks[0])
+        t3 = time.perf_counter()
+        tempi["mano"] += t1 - t0; tempi["viso"] += t2 - t1; tempi["chiusura"] += t3 - t2
+        decisions[i] = (GestureSmoother._INDEX[a_hand], GestureSmoother._INDEX[a_face])
+        g = per_gesto.setdefault(a_hand if a_hand is not None else a_face, [0, 0.0])
+        g[0] += 1
+        g[1] += t2 - t0
+
+    print(f"\n  {'logica':<10} {'frame/s':>10} {'µs/frame':>9}")
+    for nome, s in tempi.items():
+        if nome == "chiusura" and closure is None:
+            continue
+        print(f"  {nome:<10} {n / max(s, 1e-9):>10.0f} {s * 1e6 / max(n, 1):>9.2f}")
+
+    # Ritardo della stabilizzazione: dalla prima comparsa grezza del gesto
+    # (dopo l'intento precedente) al momento in cui diventa l'intento stabile
+    smoother, ritardi, inizio = GestureSmoother(), {}, {}
+    for i in range(n):
+        a_hand, a_face = azioni[decisions[i, 0]], azioni[decisions[i, 1]]
+        raw = a_hand if a_hand is not None else a_face
+        inizio.setdefault(raw, t[i])
+        prima  = smoother.action
+        stable = smoother.update(raw, t[i])
+        if stable != prima:
+            ritardi.setdefault(stable, []).append((t[i] - inizio[stable]) * 1000.0)
+            inizio = {}
+
+    print(f"\n  {'gesto':<10} {'frame':>7} {'µs class.':>10} {'intenti':>8} {'ritardo ms':>11}")
+    for a in azioni:
+        g = per_gesto.get(a)
+        if not g:
+            continue
+        r = ritardi.get(a, [])
+        rit = f"{sum(r) / len(r):>11.0f}" if r else f"{'-':>11}"
+        print(f"  {str(a):<10} {g[0]:>7} {g[1] * 1e6 / g[0]:>10.2f} {len(r):>8} {rit}")
+    print(f"  cambi grezzi {smoother.raw_changes} → intenti stabili {smoother.changes}")
+    if closure is not None and (chiusure >= 0).any():
+        c = chiusure[chiusure >= 0]
+        print(f"  chiusura mano (gioco): media {c.mean():.0f}%  min {c.min()}  max {c.max()}")
+
+    # Differenze di decisione rispetto alla versione di riferimento
+    if baseline:
+        ref, nome_ref = np.load(baseline)["decisions"], baseline
+    else:
+        ref, nome_ref = data["decisions"], "registrazione"
+    if len(ref) != n:
+        print(f"\n  [WARN] {nome_ref} ha {len(ref)} frame invece di {n}: confronto saltato")
+    else:
+        for col, nome in ((0, "mano"), (1, "viso")):
+            diff = np.nonzero(ref[:, col] != decisions[:, col])[0]
+            print(f"\n  Decisioni {nome} diverse da {nome_ref}: {len(diff)}/{n}")
+            coppie = {}
+            for i in diff:
+                coppie.setdefault((azioni[ref[i, col]], azioni[decisions[i, col]]), []).append(i)
+            for (prima, dopo), idx in sorted(coppie.items(), key=lambda kv: -len(kv[1])):
+                print(f"    {str(prima):<9} → {str(dopo):<9} {len(idx):>5}  frame {[int(j) for j in idx[:5]]}")
+
+    if save_decisions:
+        np.savez_compressed(save_decisions, decisions=decisions)
+        print(f"\n[INFO] Decisioni salvate in {save_decisions} (usale con --baseline)")
+
+
+# ─── Canale comandi UDP ───────────────────────────────────────────────────────
+
+class UdpCommandChannel:
+    """
+    Invia i comandi come datagrammi UDP numerati su un socket persistente.
+    send() non aspetta la risposta: gli ACK vengono raccolti da un thread
+    separato che misura il round-trip (ms) di ogni comando. Il canale è
+    vivo solo se è arrivato un ACK negli ultimi ALIVE_SEC: da fermo lo
+    tengono misurato i probe (UDP_PING) di RobotController.
+    """
+
+    ALIVE_SEC = 1.0   # senza ACK da più di così il canale è considerato giù
+    PROBE_SEC = 0.3   # intervallo dei probe: più d'uno per finestra ALIVE_SEC
+
+    def __init__(self, host: str, port: int):
+        self._addr     = (host, port)
+        self._sock     = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.settimeout(0.5)
+        self._seq      = 0
+        self._lock     = threading.Lock()
+        self._last_ack = 0.0
+        self._running  = True
+        self.created   = time.monotonic()
+        self.sent      = 0
+        self.acked     = 0
+        self.stale     = 0
+        self.rtt_ms: Optional[float] = None   # media mobile
+        self.last_rtt_ms: Optional[float] = None
+        self._thread   = threading.Thread(target=self._ack_loop, daemon=True)
+        self._thread.start()
+
+    def _next_seq(self) -> int:
+        with self._lock:
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            return self._seq
+
+    def send(self, action: str, speed: int) -> bool:
+        pkt = UDP_PACKET.pack(UDP_MAGIC, UDP_VERSION, UDP_CMD, self._next_seq(),
+                              ACTION_IDS.get(action, 0), max(0, min(255, speed)),
+                              time.monotonic())
+        return self._sendto(pkt)
+
+    def send_batch(self, setpoints) -> bool:
+        """Spedisce una sequenza (azione, speed, durata_s) in un solo datagramma."""
+        return self._sendto(encode_batch(self._next_seq(), setpoints, time.monotonic()))
+
+    def send_step(self, direction: str, speed: int, durata_ms: int,
+                  pausa_ms: int, count: int = 0) -> bool:
+        """Rotazione a scatti temporizzata dal server (UDP_STEP)."""
+        pkt = UDP_STEP_PKT.pack(UDP_MAGIC, UDP_VERSION, UDP_STEP, self._next_seq(),
+                                ACTION_IDS[direction], max(0, min(255, speed)),
+                                durata_ms, pausa_ms, count, time.monotonic())
+        return self._sendto(pkt)
+
+    def probe(self) -> bool:
+        """UDP_PING: il server risponde con un ACK senza eseguire niente."""
+        pkt = UDP_PACKET.pack(UDP_MAGIC, UDP_VERSION, UDP_PING, self._next_seq(),
+                              0, 0, time.monotonic())
+        try:
+            self._sock.sendto(pkt, self._addr)
+        except OSError:
+            return False
+        return True
+
+    def _sendto(self, pkt: bytes) -> bool:
+        try:
+            self._sock.sendto(pkt, self._addr)
+        except OSError:
+            return False
+        self.sent += 1
+        return self.alive
+
+    @property
+    def alive(self) -> bool:
+        """True solo se il server ha risposto negli ultimi ALIVE_SEC."""
+        return self.acked > 0 and time.monotonic() - self._last_ack < self.ALIVE_SEC
+
+    def close(self):
+        self._running = False
+        self._sock.close()
+
+    def _ack_loop(self):
+        while self._running:
+            try:
+                data = self._sock.recv(512)
+            except socket.timeout:
+                continue
+            except ConnectionError:
+                continue     # ICMP port unreachable (Windows): il server può tornare
+            except OSError:
+                break
+            if len(data) < UDP_PACKET.size:
+                continue
+            magic, ver, typ, seq, act, status, t_sent = UDP_PACKET.unpack_from(data)
+            if magic != UDP_MAGIC or typ != UDP_ACK:
+                continue
+            now = time.monotonic()
+            rtt = (now - t_sent) * 1000.0
+            self.last_rtt_ms = rtt
+            self.rtt_ms = rtt if self.rtt_ms is None else 0.8 * self.rtt_ms + 0.2 * rtt
+            self._last_ack = now
+            self.acked += 1
+            if status == UDP_STALE:
+                self.stale += 1
+
+
 # ─── Robot Controller ─────────────────────────────────────────────────────────
 
 class RobotController:
-    def __init__(self, host, port):
+    """
+    Invio comandi non bloccante. Il main loop deposita il comando in una
+    casella a posto singolo (vince sempre l'ultimo) e un thread dedicato lo
+    spedisce su una connessione keep-alive (requests.Session) o sul canale
+    UDP. I comandi uguali all'ultimo inviato vengono unificati: lo stesso
+    comando viene ripetuto solo ogni KEEPALIVE_SEC per non far scattare il
+    watchdog del server, e solo finché il main loop continua a chiederlo.
+
+    In modalità auto la porta UDP annunciata da /ping è solo candidata: lo
+    stesso thread la sonda con UDP_PING e ci passa al primo ACK. Se poi il
+    canale resta senza ACK per ALIVE_SEC si torna a HTTP (continuando a
+    sondare l'UDP), e il link risulta giù.
+    """
+
+    KEEPALIVE_SEC = 0.5   # metà del watchdog del server (1 s)
+    PING_SEC      = 3.0   # /ping periodico, in un thread suo (timeout 1 s)
+    SEQUENZA      = "sequenza"
+    PASSI         = ("step_sinistra", "step_destra")
+
+    def __init__(self, host, port, channel="auto"):
+        self._host = host
         self._url = f"http://{host}:{port}"
+        self._server_overlay = True
+        self.clock_offset = 0.0      # orologio server − orologio client (s)
+        self._offset_rtt  = None     # RTT del /ping che ha dato la stima migliore
+        self._batch_ok = False
+        self._step_ok  = False
+        self._http_seq = 0
+        # Sessione dei seq HTTP: nuova a ogni avvio, così il server non
+        # scarta come STALE i seq di un client riavviato che riparte da 1
+        self._http_session = os.urandom(4).hex()
+        self._channel = channel
+        self._udp: Optional[UdpCommandChannel] = None       # canale in uso
+        self._udp_cand: Optional[UdpCommandChannel] = None  # in prova (auto)
+        self._last_probe = 0.0
+        if channel == "udp":
+            self._udp = UdpCommandChannel(host, port)
+
+        self._session     = requests.Session()
+        self._cond        = threading.Condition()
+        self._pending     = None    # (azione, speed) in attesa di invio
+        self._last_sent   = None
+        self._last_sent_t = 0.0
+        self._last_req_t  = 0.0     # ultima richiesta del main loop
+        self._link_ok     = True
+        self._running     = True
+        self.sent         = 0
+        self.coalesced    = 0
+        self.errors       = 0
+        self.rejected     = 0       # sequenze HTTP rifiutate dal server (STALE/INVALID)
+        self._http_ms: Optional[float] = None
+        self._connected   = False   # esito dell'ultimo /ping
+        self._stop_ping   = threading.Event()
+        self._sender = threading.Thread(target=self._send_loop, daemon=True)
+        self._sender.start()
+        self._pinger = threading.Thread(target=self._ping_loop, daemon=True,
+                                        name="robot-ping")
+        self._pinger.start()
 
     def _post(self, action, speed) -> bool:
+        """Accoda il comando e ritorna subito lo stato dell'ultimo invio."""
+        return self._enqueue((action, speed))
+
+    def sequenza(self, setpoints) -> bool:
+        """
+        Accoda una manovra [(azione, speed, durata_s), ...] che il server
+        esegue con timing locale. Non viene mai unificata né ripetuta.
+        """
+        return self._enqueue((self.SEQUENZA, tuple(setpoints)), coalesce=False)
+
+    def passi(self, direction, speed, durata, pausa, count=0) -> bool:
+        """
+        Rotazione a scatti eseguita dal server (durate in secondi). Va
+        richiesta ad ogni frame come gli altri comandi: le ripetizioni
+        vengono unificate e diventano il keepalive che tiene vivi i passi.
+        """
+        return self._enqueue((f"step_{direction}",
+                              (speed, int(round(durata * 1000)),
+                               int(round(pausa * 1000)), count)))
+
+    def _enqueue(self, cmd, coalesce=True) -> bool:
+        with self._cond:
+            self._last_req_t = time.monotonic()
+            if not coalesce or self._pending is not None or cmd != self._last_sent:
+                if self._pending is not None:
+                    self.coalesced += 1     # sovrascritto prima dell'invio
+                self._pending = cmd
+                self._cond.notify()
+            else:
+                self.coalesced += 1
+        return self._link_ok
+
+    def _keepalive_wait(self) -> Optional[float]:
+        """Secondi al prossimo keepalive, None se non serve (fermo o inattivo)."""
+        if self._last_sent is None or self._last_sent[0] in ("stop", self.SEQUENZA):
+            return None
+        return max(0.0, self._last_sent_t + self.KEEPALIVE_SEC - time.monotonic())
+
+    def _probe_wait(self) -> Optional[float]:
+        """Secondi al prossimo probe UDP, None se non c'è canale UDP."""
+        if self._udp is None and self._udp_cand is None:
+            return None
+        return max(0.0, self._last_probe + UdpCommandChannel.PROBE_SEC - time.monotonic())
+
+    def _check_udp(self):
+        """Dal thread di invio: promuove/retrocede il canale UDP e lo sonda."""
+        with self._cond:
+            if self._udp_cand is not None and self._udp_cand.alive:
+                self._udp, self._udp_cand = self._udp_cand, None
+                print(f"[INFO] Canale comandi UDP attivo (porta {self._udp._addr[1]})")
+            elif self._udp is not None and not self._udp.alive \
+                    and time.monotonic() - self._udp.created >= UdpCommandChannel.ALIVE_SEC:
+                # Nessun ACK (comandi o probe) negli ultimi ALIVE_SEC: link giù
+                self._link_ok = False
+                if self._channel == "auto":
+                    print(f"[WARN] Nessun ACK UDP da {UdpCommandChannel.ALIVE_SEC:.0f} s "
+                          f"— comandi via HTTP")
+                    self._udp, self._udp_cand = None, self._udp
+            udp = self._udp or self._udp_cand
+        if udp is not None and self._probe_wait() == 0.0:
+            udp.probe()
+            self._last_probe = time.monotonic()
+
+    def _send_loop(self):
+        while True:
+            self._check_udp()
+            with self._cond:
+                if self._pending is None and self._running:
+                    waits = [w for w in (self._keepalive_wait(), self._probe_wait())
+                             if w is not None]
+                    self._cond.wait(timeout=min(waits) if waits else None)
+                if not self._running:
+                    return
+                cmd, self._pending = self._pending, None
+                now = time.monotonic()
+                if cmd is None:
+                    wait = self._keepalive_wait()
+                    if wait is None or wait > 0:
+                        continue
+                    if now - self._last_req_t > self.KEEPALIVE_SEC:
+                        # Il main loop non chiede più il comando (bloccato?):
+                        # niente keepalive, lascia fermare il watchdog
+                        self._last_sent_t = now
+                        continue
+                    cmd = self._last_sent
+                self._last_sent, self._last_sent_t = cmd, now
+            self._send(*cmd)
+
+    def _send(self, action, speed) -> bool:
+        udp = self._udp
+        if action == self.SEQUENZA:
+            ok = udp.send_batch(speed) if udp else self._post_batch_http(speed)
+        elif action in self.PASSI:
+            if udp is not None:
+                ok = udp.send_step(action[len("step_"):], *speed)
+            else:
+                ok = self._post_step_http(action, *speed)
+        elif udp is not None:
+            ok = udp.send(action, speed)
+        else:
+            t0 = time.perf_counter()
+            ok = self._post_http(action, speed)
+            if ok:
+                ms = (time.perf_counter() - t0) * 1000.0
+                self._http_ms = ms if self._http_ms is None else 0.8 * self._http_ms + 0.2 * ms
+        if ok: self.sent   += 1
+        else:  self.errors += 1
+        self._link_ok = ok
+        return ok
+
+    def _post_http(self, action, speed) -> bool:
         try:
-            r = requests.post(f"{self._url}/command",
-                              json={"action": action, "speed": speed}, timeout=0.4)
+            r = self._session.post(f"{self._url}/command",
+                                   json={"action": action, "speed": speed}, timeout=0.4)
             return r.status_code == 200
         except: return False
 
+    def _post_step_http(self, action, speed, durata_ms, pausa_ms, count) -> bool:
+        try:
+            r = self._session.post(f"{self._url}/command",
+                                   json={"action": action, "speed": speed,
+                                         "durata": durata_ms, "pausa": pausa_ms,
+                                         "count": count}, timeout=0.4)
+            return r.status_code == 200
+        except: return False
+
+    def _post_batch_http(self, setpoints) -> bool:
+        self._http_seq = (self._http_seq + 1) & 0xFFFFFFFF
+        try:
+            r = self._session.post(
+                f"{self._url}/command",
+                data=encode_batch(self._http_seq, setpoints, time.monotonic()),
+                headers={"Content-Type": "application/octet-stream",
+                         "X-Command-Session": self._http_session}, timeout=0.4)
+        except: return False
+        # L'esito vero è nell'ACK: lo status HTTP da solo non basta
+        if len(r.content) < UDP_PACKET.size:
+            self.rejected += 1
+            print(f"[WARN] Sequenza {self._http_seq} rifiutata (HTTP {r.status_code})")
+            return False
+        status = UDP_PACKET.unpack_from(r.content)[5]
+        if status != UDP_OK:
+            self.rejected += 1
+            print(f"[WARN] Sequenza {self._http_seq} rifiutata dal server: "
+                  f"{'STALE' if status == UDP_STALE else 'INVALID'}")
+        return status == UDP_OK
+
     def avanti(self):   return self._post("avanti",   SPEED_AVANTI)
     def indietro(self): return self._post("indietro", SPEED_INDIETRO)
     def sinistra(self): return self._post("sinistra", SPEED_ROTAZIONE)
     def destra(self):   return self._post("destra",   SPEED_ROTAZIONE)
     def stop(self):     return self._post("stop",     0)
 
+    @property
+    def connected(self) -> bool:
+        """Esito dell'ultimo /ping, senza aspettare la rete."""
+        return self._connected
+
+    def _ping_loop(self):
+        # Il /ping può durare fino al timeout: mai nel main loop
+        while not self._stop_ping.wait(self.PING_SEC):
+            self.ping()
+
     def ping(self) -> bool:
-        try: return requests.get(f"{self._url}/ping", timeout=1.0).status_code == 200
+        """/ping bloccante: va chiamato dal thread dedicato (o all'avvio)."""
+        self._connected = self._ping()
+        return self._connected
+
+    def _ping(self) -> bool:
+        try:
+            t0 = time.time()
+            r = requests.get(f"{self._url}/ping", timeout=1.0)
+            t1 = time.time()
+            if r.status_code != 200:
+                return False
+            info = r.json()
+            # Offset tra gli orologi (errore ≤ RTT/2): si tiene la stima
+            # del ping più rapido, con un po' di tolleranza per la deriva
+            if "time" in info and (self._offset_rtt is None
+                                   or t1 - t0 <= self._offset_rtt * 1.5):
+                self.clock_offset = info["time"] - (t0 + t1) / 2
+                self._offset_rtt  = min(t1 - t0, self._offset_rtt or t1 - t0)
+            self._server_overlay = info.get("overlay_server", True)
+            self._batch_ok = info.get("batch", False)
+            self._step_ok  = info.get("passi", False)
+            udp_port = info.get("udp_port")
+            with self._cond:
+                if self._channel == "auto" and udp_port \
+                        and self._udp is None and self._udp_cand is None:
+                    # Solo candidato: si passa all'UDP al primo ACK di un probe
+                    self._udp_cand = UdpCommandChannel(self._host, udp_port)
+                    self._cond.notify()
+            return True
         except: return False
 
+    @property
+    def latency_ms(self) -> Optional[float]:
+        """Latenza media per comando: RTT degli ACK UDP o durata della POST."""
+        udp = self._udp
+        return udp.rtt_ms if udp else self._http_ms
+
+    def stats(self) -> dict:
+        return {
+            "channel":    "udp" if self._udp else "http",
+            "latency_ms": self.latency_ms,
+            "sent":       self.sent,
+            "coalesced":  self.coalesced,
+            "errors":     self.errors,
+        }
+
+    def close(self):
+        """Ferma il thread di invio e manda lo stop finale anche via HTTP."""
+        self._stop_ping.set()
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._sender.join(timeout=1.0)
+        if self._udp is not None:
+            self._udp.send("stop", 0)
+        self._post_http("stop", 0)
+        print(f"[INFO] Comandi: {self.sent} inviati, {self.coalesced} unificati, "
+              f"{self.errors} errori, latenza media {self.latency_ms or 0:.1f} ms")
+        for udp in (self._udp, self._udp_cand):
+            if udp is not None:
+                udp.close()
+        self._udp = self._udp_cand = None
+        self._session.close()
+
+    @property
+    def step_ok(self) -> bool:
+        """True se il server esegue da sé la rotazione a scatti."""
+        return self._step_ok
+
+    @property
+    def batch_ok(self) -> bool:
+        """True se il server accetta sequenze di setpoint (UDP_BATCH)."""
+        return self._batch_ok
+
+    @property
+    def server_overlay(self) -> bool:
+        """False se il server è in MJPEG passthrough e la freccia va disegnata qui."""
+        return self._server_overlay
+
 
 # ─── Step Rotation ────────────────────────────────────────────────────────────
 
 class StepRotationManager:
+    """
+    Rotazione a scatti, temporizzata il più vicino possibile ai motori:
+    dal server (passi) se lo supporta, altrimenti un impulso + pausa per
+    ciclo come sequenza di setpoint (UDP_BATCH), e solo coi server più
+    vecchi alternando rotazione e stop da qui.
+    """
     IDLE = "idle"; MOVING = "moving"; PAUSING = "pausing"
 
     def __init__(self):
@@ -235,6 +1476,10 @@ class StepRotationManager:
             if self._state != self.IDLE:
                 robot.stop(); self._state = self.IDLE; self._dir = None
             return self.IDLE
+        if robot.step_ok:
+            return self._update_server(direction, robot, now, elapsed)
+        if robot.batch_ok:
+            return self._update_batch(direction, robot, now, elapsed)
         if direction != self._dir:
             self._dir = direction; self._state = self.MOVING; self._t = now; elapsed = 0.0
             robot.sinistra() if direction == "sinistra" else robot.destra()
@@ -245,23 +1490,216 @@ class StepRotationManager:
             robot.sinistra() if direction == "sinistra" else robot.destra()
         return self._state
 
+    def _update_server(self, direction, robot, now, elapsed) -> str:
+        """
+        Impulsi e pause li temporizza il Pi: qui si chiede solo di
+        continuare a ruotare. Lo stato MOVING/PAUSING restituito è una stima
+        per l'HUD, ricavata dal tempo trascorso dall'inizio della rotazione.
+        """
+        if direction != self._dir:
+            self._dir = direction; self._t = now; elapsed = 0.0
+        robot.passi(direction, SPEED_ROTAZIONE, STEP_DURATA, STEP_PAUSA)
+        phase = elapsed % (STEP_DURATA + STEP_PAUSA)
+        self._state = self.MOVING if phase < STEP_DURATA else self.PAUSING
+        return self._state
+
+    def _update_batch(self, direction, robot, now, elapsed) -> str:
+        """
+        Un ciclo impulso + pausa per sequenza: il Pi ne temporizza i due
+        setpoint, qui si accoda il ciclo successivo quando il precedente
+        è finito (o subito, se cambia direzione).
+        """
+        if direction != self._dir or elapsed >= STEP_DURATA + STEP_PAUSA:
+            self._dir = direction; self._t = now; elapsed = 0.0
+            robot.sequenza([(direction, SPEED_ROTAZIONE, STEP_DURATA),
+                            ("stop", 0, STEP_PAUSA)])
+        self._state = self.MOVING if elapsed < STEP_DURATA else self.PAUSING
+        return self._state
+
+
+# ─── Parser MJPEG ─────────────────────────────────────────────────────────────
+
+class MjpegParser:
+    """
+    Parser incrementale di multipart/x-mixed-replace. Legge con readinto()
+    direttamente in un bytearray preallocato e usa il Content-Length di
+    ogni parte: nessuna concatenazione di chunk e nessuna ricerca di
+    0xFFD8/0xFFD9 dentro il JPEG (le miniature EXIF contengono anche loro
+    SOI/EOI). Senza Content-Length la parte finisce al boundary successivo.
+    """
+
+    HEADER_READ = 256        # byte chiesti alla volta cercando le intestazioni
+    MAX_HEADER  = 8192
+
+    def __init__(self, readinto, boundary: bytes = b"frame", size: int = 256 * 1024):
+        """readinto(memoryview) → byte letti (0 = fine stream), es. resp.raw.readinto."""
+        self._readinto  = readinto
+        self._delim     = b"\r\n--" + boundary
+        self._buf       = bytearray(size)
+        self._start     = 0      # primo byte non ancora consumato
+        self._end       = 0      # fine dei dati letti
+        self.bytes_read = 0
+        self.frames     = 0
+
+    def parts(self):
+        """
+        Generatore di (jpeg, headers). jpeg è una memoryview sul buffer
+        interno, valida solo fino alla richiesta del frame successivo;
+        headers ha i nomi in minuscolo.
+        """
+        while True:
+            # ── Intestazioni della parte ──────────────────────────────────────
+            while True:
+                i = self._buf.find(b"\r\n\r\n", self._start, self._end)
+                if i != -1:
+                    break
+                if self._end - self._start > self.MAX_HEADER:
+                    raise ValueError("intestazione multipart troppo lunga")
+                if not self._fill(self.HEADER_READ):
+                    return
+            headers = self._parse_headers(self._buf[self._start:i])
+            self._start = i + 4
+
+            # ── Corpo ─────────────────────────────────────────────────────────
+            length = headers.get("content-length")
+            if length is not None:
+                n = int(length)
+                while self._end - self._start < n:
+                    if not self._fill(n - (self._end - self._start)):
+                        return
+                body, self._start = self._start, self._start + n
+            else:
+                checked = 0      # byte del corpo già esaminati senza trovare il boundary
+                while True:
+                    j = self._buf.find(self._delim, self._start + checked, self._end)
+                    if j != -1:
+                        break
+                    checked = max(0, self._end - self._start - len(self._delim) + 1)
+                    if not self._fill(self.HEADER_READ * 16):
+                        return
+                n = j - self._start
+                body, self._start = self._start, j + 2   # riparte da "--boundary"
+
+            self.frames += 1
+            yield memoryview(self._buf)[body:body + n], headers
+
+    def _fill(self, n: int) -> bool:
+        """Legge fino a n byte in coda al buffer. False a fine stream."""
+        if self._end + n > len(self._buf):
+            self._make_room(n)
+        got = self._readinto(memoryview(self._buf)[self._end:self._end + n])
+        if not got:
+            return False
+        self._end       += got
+        self.bytes_read += got
+        return True
+
+    def _make_room(self, n: int):
+        pending = self._end - self._start
+        if pending + n > len(self._buf):
+            # Buffer nuovo invece di resize: l'ultimo frame restituito
+            # (memoryview / np.frombuffer) può tenere ancora il vecchio
+            new = bytearray(max(2 * len(self._buf), pending + n))
+            new[:pending] = memoryview(self._buf)[self._start:self._end]
+            self._buf = new
+        else:
+            self._buf[:pending] = self._buf[self._start:self._end]
+        self._start, self._end = 0, pending
+
+    @staticmethod
+    def _parse_headers(block: bytes) -> dict:
+        headers = {}
+        for line in block.split(b"\r\n"):
+            name, sep, value = line.partition(b":")
+            if sep:
+                headers[name.strip().lower().decode("latin-1")] = \
+                    value.strip().decode("latin-1")
+        return headers
+
+
+def bench_parser(path: str, chunk: int = 4096):
+    """
+    Confronta su una cattura registrata (--record-stream) il vecchio metodo
+    (buf += chunk e rfind di SOI/EOI) con MjpegParser.
+    """
+    import io
+    with open(path, "rb") as f:
+        data = f.read()
+    mb = len(data) / 1e6
+
+    t0 = time.perf_counter()
+    parser = MjpegParser(io.BytesIO(data).readinto)
+    exact  = {bytes(jpeg) for jpeg, _ in parser.parts()}
+    t_new  = time.perf_counter() - t0
+
+    t0, buf, legacy = time.perf_counter(), b"", []
+    for k in range(0, len(data), chunk):
+        buf += data[k:k + chunk]
+        last_soi = buf.rfind(b"\xff\xd8")
+        last_eoi = buf.rfind(b"\xff\xd9")
+        if last_soi != -1 and last_eoi != -1 and last_eoi > last_soi:
+            legacy.append(buf[last_soi:last_eoi + 2])
+            buf = b""
+        elif len(buf) > 200_000:
+            buf = buf[-50_000:]
+    t_old = time.perf_counter() - t0
+    wrong = sum(1 for jpg in legacy if jpg not in exact)
+
+    print(f"Cattura {path}: {mb:.1f} MB, {parser.frames} frame (Content-Length)")
+    print(f"  {'metodo':<22} {'frame':>6} {'errati':>7} {'ms/frame':>9} {'MB/s':>8}")
+    print(f"  {'rfind SOI/EOI':<22} {len(legacy):>6} {wrong:>7} "
+          f"{t_old * 1000 / max(len(legacy), 1):>9.3f} {mb / max(t_old, 1e-9):>8.1f}")
+    print(f"  {'MjpegParser':<22} {parser.frames:>6} {0:>7} "
+          f"{t_new * 1000 / max(parser.frames, 1):>9.3f} {mb / max(t_new, 1e-9):>8.1f}")
+
+
+def record_stream(host: str, port: int, path: str, secondi: float):
+    """Salva i byte grezzi di /stream per il benchmark del parser."""
+    resp = requests.get(f"http://{host}:{port}/stream", stream=True, timeout=(5, 5))
+    resp.raise_for_status()
+    fine, n = time.time() + secondi, 0
+    with open(path, "wb") as f:
+        for chunk in resp.iter_content(chunk_size=65536):
+            f.write(chunk)
+            n += len(chunk)
+            if time.time() >= fine:
+                break
+    resp.close()
+    print(f"[INFO] {n / 1e6:.1f} MB di stream salvati in {path}")
+
 
 # ─── Pi Camera Stream Receiver ────────────────────────────────────────────────
 
 class PiCameraReceiver:
     """
     Riceve lo stream MJPEG dalla Pi Camera via HTTP in un thread separato.
-    Espone l'ultimo frame come numpy array BGR pronto per OpenCV.
-    Tiene solo l'ultimo frame per evitare accodamento e lag.
+    Tiene solo l'ultimo JPEG ricevuto, ancora compresso: viene decodificato
+    solo quando il main loop lo chiede con get_frame(), così i frame che
+    arrivano più in fretta di quanto il main loop li consumi non costano
+    una decodifica ciascuno.
     """
 
+    # Decodifica ridotta di libjpeg (scala nella IDCT, molto più rapida di
+    # decodifica piena + resize): fattore → flag di cv2.imdecode
+    REDUCED = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+               (4, cv2.IMREAD_REDUCED_COLOR_4),
+               (2, cv2.IMREAD_REDUCED_COLOR_2))
+
     def __init__(self, host: str, port: int):
-        self._url     = f"http://{host}:{port}/stream"
-        self._frame   = None
-        self._lock    = threading.Lock()
-        self._running = False
-        self._thread  = None
-        self._ok      = False
+        self._url      = f"http://{host}:{port}/stream"
+        self._jpeg     = None       # ultimo JPEG non ancora decodificato
+        self._meta     = None       # FrameMeta del JPEG in attesa
+        self._lock     = threading.Lock()
+        self._running  = False
+        self._thread   = None
+        self._ok       = False
+        self._src_size = None       # (w, h) dei frame del server
+        self.frame_meta: Optional["FrameMeta"] = None   # dell'ultimo get_frame()
+        self.lost        = 0        # buchi di X-Frame-Seq all'arrivo (persi prima del client)
+        self.overwritten = 0        # JPEG ricevuti ma sostituiti prima di get_frame()
+        self.decoded     = 0
+        self._last_seq   = None
+        self.reduction   = 1        # fattore dell'ultima decodifica
 
     def start(self):
         self._running = True
@@ -271,14 +1709,33 @@ class PiCameraReceiver:
     def stop(self):
         self._running = False
 
-    def get_frame(self) -> Optional[np.ndarray]:
+    def get_frame(self, display_size=None) -> Optional[np.ndarray]:
+        """
+        Decodifica e ritorna l'ultimo frame, None se non ne è arrivato uno
+        nuovo. display_size=(w, h): se il frame è almeno 2× più grande viene
+        decodificato già ridotto (1/2, 1/4, 1/8) senza scendere sotto (w, h).
+        """
         with self._lock:
-            if self._frame is None:
-                return None
-            # Scambia il riferimento invece di copiare ogni volta
-            f = self._frame
-            self._frame = None   # reset: il main legge sempre il frame più fresco
-            return f
+            jpeg, meta = self._jpeg, self._meta
+            self._jpeg = None   # reset: il main legge sempre il frame più fresco
+        if jpeg is None:
+            return None
+
+        flag, factor = cv2.IMREAD_COLOR, 1
+        if display_size and self._src_size:
+            sw, sh = self._src_size
+            for f, reduced in self.REDUCED:
+                if sw // f >= display_size[0] and sh // f >= display_size[1]:
+                    flag, factor = reduced, f
+                    break
+        img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flag)
+        if img is None:
+            return None
+        self._src_size  = (img.shape[1] * factor, img.shape[0] * factor)
+        self.reduction  = factor
+        self.decoded   += 1
+        self.frame_meta = meta
+        return img
 
     @property
     def is_ok(self) -> bool:
@@ -301,29 +1758,27 @@ class PiCameraReceiver:
 
                 print("[STREAM] Connesso alla Pi Camera ✓")
                 self._ok = True
-                buf = b""
+                ctype    = resp.headers.get("Content-Type", "")
+                boundary = ctype.partition("boundary=")[2].strip('" ') or "frame"
+                parser   = MjpegParser(resp.raw.readinto, boundary.encode())
 
-                for chunk in resp.iter_content(chunk_size=4096):
+                for jpeg, headers in parser.parts():
                     if not self._running:
                         break
-                    buf += chunk
-
-                    # Estrai solo l'ultimo JPEG completo per evitare lag da accodamento
-                    last_soi = buf.rfind(b"\xff\xd8")
-                    last_eoi = buf.rfind(b"\xff\xd9")
-                    if last_soi != -1 and last_eoi != -1 and last_eoi > last_soi:
-                        jpg = buf[last_soi:last_eoi + 2]
-                        buf = b""   # svuota il buffer: teniamo solo il più recente
-
-                        arr = np.frombuffer(jpg, dtype=np.uint8)
-                        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-                        if img is not None:
-                            with self._lock:
-                                self._frame = img   # sovrascrive direttamente
-
-                    # Evita buffer gonfiato se non arrivano EOI
-                    elif len(buf) > 200_000:
-                        buf = buf[-50_000:]
+                    meta = FrameMeta.from_headers(headers)
+                    if meta.seq is not None:
+                        if self._last_seq is not None and meta.seq > self._last_seq + 1:
+                            self.lost += meta.seq - self._last_seq - 1
+                        self._last_seq = meta.seq   # se cala, server riavviato: ricomincia
+                    # Unica copia: la vista del parser vale solo fino al frame
+                    # successivo. La decodifica la fa get_frame(), se serve.
+                    jpeg = bytes(jpeg)
+                    with self._lock:
+                        if self._jpeg is not None:
+                            self.overwritten += 1
+                        self._jpeg = jpeg   # sovrascrive direttamente
+                        self._meta = meta
+                resp.close()
 
             except requests.exceptions.ConnectionError:
                 print(f"[STREAM] Connessione rifiutata — il server è avviato? Riprovo tra {RETRY_DELAY}s")
@@ -339,45 +1794,573 @@ class PiCameraReceiver:
                 time.sleep(RETRY_DELAY)
 
 
+# ─── Latenza frame (cattura sul Pi → finestra) ────────────────────────────────
+
+class FrameMeta:
+    """Metadati di un frame dello stream: X-Frame-Seq / X-Frame-Time del server."""
+
+    __slots__ = ("seq", "t_capture", "t_received")
+
+    def __init__(self, seq: Optional[int], t_capture: Optional[float]):
+        self.seq        = seq
+        self.t_capture  = t_capture      # orologio del server
+        self.t_received = time.time()    # orologio del client
+
+    @classmethod
+    def from_headers(cls, headers: dict) -> "FrameMeta":
+        """Dalle intestazioni della parte multipart (nomi in minuscolo)."""
+        try:
+            seq = int(headers["x-frame-seq"])
+        except (KeyError, ValueError):
+            seq = None
+        try:
+            t_capture = float(headers["x-frame-time"])
+        except (KeyError, ValueError):
+            t_capture = None
+        return cls(seq, t_capture)
+
+
+class LatencyMonitor:
+    """
+    Latenza glass-to-glass: dall'istante di cattura sul Pi a quando il frame
+    viene mostrato nella finestra. L'orologio del server è riportato su
+    quello del client con l'offset stimato da /ping (RobotController).
+
+    Frame persi (li conta PiCameraReceiver, ognuno una volta sola):
+      stream = buchi nei numeri di sequenza all'arrivo (scartati dalla
+               pipeline del server o saltati perché il viewer era lento)
+      client = ricevuti ma sostituiti da uno più recente prima di get_frame()
+               (quindi mai decodificati)
+    I buchi tra i frame mostrati sono la somma dei due: qui non si contano.
+    """
+
+    BINS     = (33, 66, 100, 150, 200, 300, 500)   # limiti superiori (ms)
+    RECENT   = 300                                 # campioni per p50 / p95
+    MAX_ROWS = 100_000                             # righe tenute per il CSV
+
+    def __init__(self):
+        self.hist         = [0] * (len(self.BINS) + 1)
+        self.samples      = 0
+        self.last_ms: Optional[float] = None
+        self._recent      = deque(maxlen=self.RECENT)
+        self._rows        = deque(maxlen=self.MAX_ROWS)
+        self._last_seq    = None
+
+    def record(self, meta: Optional[FrameMeta], t_shown: float, clock_offset: float):
+        if meta is None or meta.seq is None or meta.t_capture is None:
+            return
+        if self._last_seq is not None and meta.seq <= self._last_seq:
+            self._last_seq = meta.seq              # server riavviato: ricomincia
+            return
+        self._last_seq = meta.seq
+
+        t_capture = meta.t_capture - clock_offset
+        ms = (t_shown - t_capture) * 1000.0
+        self.last_ms  = ms
+        self.samples += 1
+        self._recent.append(ms)
+        i = 0
+        while i < len(self.BINS) and ms > self.BINS[i]:
+            i += 1
+        self.hist[i] += 1
+        self._rows.append((meta.seq, t_capture, meta.t_received, t_shown,
+                           (meta.t_received - t_capture) * 1000.0, ms))
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+    def stats(self, lost: int = 0, overwritten: int = 0) -> dict:
+        return {
+            "last_ms":        self.last_ms,
+            "p50_ms":         self.percentile(50),
+            "p95_ms":         self.percentile(95),
+            "hist":           list(self.hist),
+            "dropped_stream": lost,
+            "dropped_client": overwritten,
+        }
+
+    def to_csv(self, path: str) -> int:
+        """Esporta un frame per riga (tempi sull'orologio del client). Ritorna le righe scritte."""
+        with open(path, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["seq", "t_capture", "t_received", "t_shown",
+                        "network_ms", "glass_to_glass_ms"])
+            for seq, t_cap, t_rx, t_shown, net_ms, ms in self._rows:
+                w.writerow([seq, f"{t_cap:.6f}", f"{t_rx:.6f}", f"{t_shown:.6f}",
+                            f"{net_ms:.2f}", f"{ms:.2f}"])
+        return len(self._rows)
+
+
 # ─── QR Code Decoder ──────────────────────────────────────────────────────────
 
 class QRDecoder:
     """
-    Decodifica QR code da frame BGR usando pyzbar.
-    Restituisce una lista di dict con 'data' (stringa) e 'rect' (x,y,w,h).
-    Funziona su frame della Pi Camera in background rispetto a MediaPipe.
+    Decodifica QR code da frame BGR con pyzbar o cv2.QRCodeDetector, backend
+    intercambiabili ("auto" = pyzbar se installato, altrimenti OpenCV).
+    Con roi=True cerca prima le regioni candidate sul frame ridotto
+    (trova_candidati_qr) e decodifica solo quei ritagli a piena risoluzione;
+    se per QR_FULL_EVERY scansioni di fila non legge nulla, prova il frame
+    intero. Restituisce una lista di dict con 'data' (stringa),
+    'rect' (x,y,w,h) e 'polygon', in coordinate del frame.
     """
 
-    def __init__(self):
-        self._available = QR_AVAILABLE
+    def __init__(self, backend: str = "auto", roi: bool = True):
+        if backend == "auto":
+            backend = "pyzbar" if QR_AVAILABLE else "opencv"
+        self.backend    = backend
+        self.roi        = roi
+        self.candidates = 0                 # ritagli decodificati
+        self.full_scans = 0                 # scansioni del frame intero
+        self._misses    = 0
+        if backend == "pyzbar":
+            self._available = QR_AVAILABLE
+            self._decode    = self._decode_pyzbar
+        else:
+            self._available = hasattr(cv2, "QRCodeDetector")
+            self._decode    = self._decode_opencv
+            self._cv        = cv2.QRCodeDetector() if self._available else None
 
     def decode(self, bgr_frame) -> List[dict]:
         """Ritorna lista di QR trovati nel frame. Lista vuota se nessuno."""
         if not self._available or bgr_frame is None:
             return []
         try:
-            # pyzbar lavora bene su scala di grigi → più veloce
-            gray = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2GRAY)
-            codes = _pyzbar.decode(gray)
-            results = []
-            for code in codes:
-                if code.type == "QRCODE":
-                    text = code.data.decode("utf-8", errors="replace")
-                    rect = code.rect  # pyzbar.Rect(left, top, width, height)
-                    results.append({
-                        "data": text,
-                        "rect": (rect.left, rect.top, rect.width, rect.height),
-                        "polygon": [(p.x, p.y) for p in code.polygon],
-                    })
-            return results
+            # Entrambi i backend lavorano bene su scala di grigi → più veloce
+            gray  = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2GRAY)
+            codes = []
+            if self.roi:
+                for x0, y0, x1, y1 in trova_candidati_qr(gray):
+                    self.candidates += 1
+                    # I QR lontani hanno moduli di 2-3 px: ingranditi si leggono meglio
+                    crop = gray[y0:y1, x0:x1]
+                    k    = min(3.0, max(1.0, QR_ROI_MIN / min(crop.shape)))
+                    if k > 1.0:
+                        crop = cv2.resize(crop, None, fx=k, fy=k,
+                                          interpolation=cv2.INTER_CUBIC)
+                    codes += [(text, [(int(x / k) + x0, int(y / k) + y0) for x, y in poly])
+                              for text, poly in self._decode(crop)]
+                self._misses = 0 if codes else self._misses + 1
+            if not self.roi or self._misses >= QR_FULL_EVERY:
+                self._misses     = 0
+                self.full_scans += 1
+                codes = self._decode(gray)
+            results = {}
+            for text, poly in codes:
+                xs, ys = [p[0] for p in poly], [p[1] for p in poly]
+                results.setdefault(text, {
+                    "data": text,
+                    "rect": (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)),
+                    "polygon": poly,
+                })
+            return list(results.values())
         except Exception:
             return []
 
+    @staticmethod
+    def _decode_pyzbar(gray) -> List[tuple]:
+        return [(code.data.decode("utf-8", errors="replace"),
+                 [(p.x, p.y) for p in code.polygon])
+                for code in _pyzbar.decode(gray) if code.type == "QRCODE"]
+
+    def _decode_opencv(self, gray) -> List[tuple]:
+        ok, texts, points, _ = self._cv.detectAndDecodeMulti(gray)
+        if not ok or points is None:
+            return []
+        return [(text, [(int(x), int(y)) for x, y in pts])
+                for text, pts in zip(texts, points) if text]
+
     @property
     def available(self) -> bool:
         return self._available
 
 
+def trova_candidati_qr(gray) -> List[tuple]:
+    """
+    Regioni (x0, y0, x1, y1) del frame che probabilmente contengono un QR.
+    Sul frame ridotto a QR_FIND_W cerca i pattern di posizionamento (tre
+    quadrati concentrici: un contorno con figlio e nipote), raggruppa quelli
+    vicini e allarga il riquadro: poco se il gruppo ha tutti e tre gli
+    angoli, molto se ne manca qualcuno.
+    """
+    h, w  = gray.shape[:2]
+    s     = min(1.0, QR_FIND_W / w)
+    small = cv2.resize(gray, None, fx=s, fy=s, interpolation=cv2.INTER_AREA) \
+        if s < 1.0 else gray
+    bw    = cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                  cv2.THRESH_BINARY_INV, 31, 7)
+    contours, hier = cv2.findContours(bw, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if hier is None:
+        return []
+    hier = hier[0]
+
+    finder = []                             # (cx, cy, lato, x, y, w, h)
+    for i, (_, _, child, _) in enumerate(hier):
+        if child < 0 or hier[child][2] < 0:
+            continue
+        x, y, cw, ch = cv2.boundingRect(contours[i])
+        if min(cw, ch) < 5 or not 0.6 < cw / ch < 1.6:
+            continue
+        finder.append((x + cw / 2, y + ch / 2, max(cw, ch), x, y, cw, ch))
+
+    # Raggruppa i pattern a distanza compatibile con lo stesso QR
+    gruppi: List[list] = []
+    for f in finder:
+        for g in gruppi:
+            if any(abs(f[0] - o[0]) + abs(f[1] - o[1]) < 10 * max(f[2], o[2]) for o in g):
+                g.append(f)
+                break
+        else:
+            gruppi.append([f])
+
+    boxes = []
+    for g in gruppi:
+        lato = max(f[2] for f in g)
+        m    = lato * (0.7 if len(g) >= 3 else 4.0)
+        x0   = min(f[3] for f in g) - m
+        y0   = min(f[4] for f in g) - m
+        x1   = max(f[3] + f[5] for f in g) + m
+        y1   = max(f[4] + f[6] for f in g) + m
+        boxes.append((max(0, int(x0 / s)), max(0, int(y0 / s)),
+                      min(w, int(x1 / s) + 1), min(h, int(y1 / s) + 1)))
+    return boxes
+
+
+QR_MISSIONI = ("STANZA_1", "STANZA_2", "CARICA", "ARRIVO", "MISSIONE:consegna/7")
+
+
+def fixture_qr(testo: str, lato: int, quality: int, rng, w: int = 640, h: int = 480):
+    """
+    Frame sintetico della Pi Camera con un QR di `lato` px (più piccolo =
+    più lontano), ruotato di qualche grado su uno sfondo con rumore e forme,
+    sfocato come dall'ottica e ricompresso JPEG a `quality`.
+    """
+    img = rng.integers(90, 170, (h // 8, w // 8), dtype=np.uint8)
+    img = cv2.resize(img, (w, h), interpolation=cv2.INTER_CUBIC)
+    for _ in range(6):
+        x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+        cv2.rectangle(img, (x, y), (x + int(rng.integers(20, 120)), y + int(rng.integers(20, 120))),
+                      int(rng.integers(0, 255)), -1)
+
+    qr = cv2.QRCodeEncoder.create().encode(testo)
+    qr = cv2.resize(qr, (lato, lato), interpolation=cv2.INTER_NEAREST)
+    rot = cv2.getRotationMatrix2D((lato / 2, lato / 2), float(rng.uniform(-12, 12)), 1.0)
+    qr   = cv2.warpAffine(qr, rot, (lato, lato), borderValue=255)
+    mask = cv2.warpAffine(np.full((lato, lato), 255, np.uint8), rot, (lato, lato))
+    x, y = int(rng.integers(0, w - lato)), int(rng.integers(0, h - lato))
+    roi  = img[y:y + lato, x:x + lato]
+    np.copyto(roi, qr, where=mask > 0)
+
+    img = cv2.GaussianBlur(img, (3, 3), 0.8)
+    ok, jpg = cv2.imencode(".jpg", cv2.cvtColor(img, cv2.COLOR_GRAY2BGR),
+                           [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(jpg, cv2.IMREAD_COLOR)
+
+
+def bench_qr(n: int = 20, seed: int = 7):
+    """
+    Letture corrette e ms per frame di ogni backend QR, sul frame intero e
+    sulle regioni candidate, su fixture sintetiche di QR di missione a varie
+    distanze (lato del QR) e qualità JPEG: n frame per combinazione.
+    """
+    rng    = np.random.default_rng(seed)
+    lati   = (160, 100, 70, 50)
+    qualita = (85, 65, 45)
+    casi   = []
+    for lato in lati:
+        for q in qualita:
+            for i in range(n):
+                testo = QR_MISSIONI[i % len(QR_MISSIONI)]
+                casi.append((lato, q, testo, fixture_qr(testo, lato, q, rng)))
+    print(f"Benchmark QR: {len(casi)} frame 640x480 "
+          f"(lato QR {'/'.join(map(str, lati))} px, JPEG {'/'.join(map(str, qualita))})\n")
+
+    print(f"  {'decoder':<20} {'ms/frame':>9} {'letti':>7}  "
+          + " ".join(f"{f'{l}px':>6}" for l in lati) + "  "
+          + " ".join(f"{f'q{q}':>5}" for q in qualita))
+    for backend in ("pyzbar", "opencv"):
+        for roi in (False, True):
+            dec = QRDecoder(backend, roi)
+            nome = f"{backend} {'regioni' if roi else 'intero'}"
+            if not dec.available:
+                print(f"  {nome:<20} non disponibile")
+                continue
+            ok, t = {}, 0.0
+            for lato, q, testo, frame in casi:
+                dec._misses = 0             # niente ripiego sul frame intero: si misura il ROI
+                t0 = time.perf_counter()
+                letto = any(r["data"] == testo for r in dec.decode(frame))
+                t += time.perf_counter() - t0
+                for k in (lato, f"q{q}"):
+                    ok[k] = ok.get(k, 0) + letto
+            tot = sum(ok[l] for l in lati)
+            per_lato = " ".join(f"{ok[l] * 100 // (n * len(qualita)):>5}%" for l in lati)
+            per_q    = " ".join(f"{ok[f'q{q}'] * 100 // (n * len(lati)):>4}%" for q in qualita)
+            print(f"  {nome:<20} {t * 1000 / len(casi):>9.2f} {tot * 100 // len(casi):>6}%  "
+                  f"{per_lato}  {per_q}")
+
+
+class QRWorker:
+    """
+    Scansione QR fuori dal main loop. submit() lascia il frame Pi Camera in
+    una casella a posto singolo; il thread lo confronta in miniatura con
+    l'ultimo frame scansionato e, se la scena è ferma, non lo passa a pyzbar:
+    i QR già trovati restano validi. I risultati (con poligono) sono tenuti
+    in cache per QR_TTL secondi, così l'overlay non sfarfalla quando una
+    scansione manca la lettura o tra una scansione e l'altra. La scadenza
+    la applica anche results(), sull'istante dell'ultima lettura: un QR non
+    resta a schermo se i frame smettono di arrivare al worker.
+    """
+
+    def __init__(self, decoder: QRDecoder, soglia: float = QR_MOTION_SOGLIA,
+                 events: Optional["QREventStream"] = None):
+        self.decoder    = decoder
+        self.events     = events            # riceve l'insieme dei QR validi a ogni ciclo
+        self.soglia     = soglia
+        self.scans      = 0
+        self.skipped    = 0                 # frame fermi non scansionati
+        self.dropped    = 0                 # frame sostituiti prima della scansione
+        self.ms         = None              # durata dell'ultima scansione
+        self.latency_ms = None              # submit → risultati dell'ultima scansione
+        self._cond      = threading.Condition()
+        self._pending   = None
+        self._running   = True
+        self._ref       = None              # miniatura dell'ultimo frame scansionato
+        self._t_scan    = 0.0
+        self._cache     = {}                # testo → (qr, ultima lettura)
+        self._found     = []                # QR letti dall'ultima scansione
+        self._results   = []                # [(qr, ultima lettura)], sostituita, mai modificata
+        self._thread    = threading.Thread(target=self._loop, daemon=True,
+                                           name="qr-worker")
+        self._thread.start()
+
+    def submit(self, bgr_frame):
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (bgr_frame, time.monotonic())
+            self._cond.notify()
+
+    def results(self) -> List[dict]:
+        """QR letti da non più di QR_TTL secondi."""
+        now = time.monotonic()
+        return [qr for qr, t_seen in self._results if now - t_seen <= QR_TTL]
+
+    def stats(self) -> dict:
+        return {"scans": self.scans, "skipped": self.skipped, "dropped": self.dropped,
+                "ms": self.ms, "latency_ms": self.latency_ms}
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=1.0)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or not self._running)
+                if not self._running:
+                    return
+                bgr, t_submit = self._pending
+                self._pending = None
+            self.process(bgr, t_submit)
+
+    def process(self, bgr, t_submit: float):
+        now = time.monotonic()
+        h, w = bgr.shape[:2]
+        mini = cv2.resize(bgr, (QR_MOTION_W, max(1, h * QR_MOTION_W // w)),
+                          interpolation=cv2.INTER_AREA)
+        mini = cv2.cvtColor(mini, cv2.COLOR_BGR2GRAY)
+        if self._ref is not None and self._ref.shape == mini.shape \
+                and now - self._t_scan < QR_RESCAN_S \
+                and cv2.absdiff(mini, self._ref).mean() < self.soglia:
+            # Scena ferma: vale ancora quello che ha letto l'ultima scansione
+            self.skipped += 1
+            self._aggiorna(self._found, now)
+            return
+        self._ref, self._t_scan = mini, now
+
+        t0 = time.perf_counter()
+        self._found = self.decoder.decode(bgr)
+        self.ms     = (time.perf_counter() - t0) * 1000
+        self.scans += 1
+        self._aggiorna(self._found, now)
+        self.latency_ms = (time.monotonic() - t_submit) * 1000
+
+    def _aggiorna(self, found: List[dict], now: float):
+        for qr in found:
+            self._cache[qr["data"]] = (qr, now)
+        self._cache   = {k: v for k, v in self._cache.items() if now - v[1] <= QR_TTL}
+        self._results = list(self._cache.values())
+        if self.events:
+            self.events.update({k: v[1] for k, v in self._cache.items()}, time.time())
+
+
+# ─── Missioni QR ──────────────────────────────────────────────────────────────
+
+class Waypoint:
+    """Tappa di missione associata al testo di un QR."""
+
+    __slots__ = ("id", "qr", "nome", "dati")
+
+    def __init__(self, id_: int, qr: str, nome: str, dati: dict):
+        self.id   = id_
+        self.qr   = qr
+        self.nome = nome
+        self.dati = dati
+
+
+class QRMissionRegistry:
+    """
+    Tappe di missione indicizzate per testo del QR: un dict, quindi una
+    ricerca per hash a evento invece di confronti di stringhe a ogni frame.
+    File JSON (lista di oggetti con "qr", oppure oggetto {testo: {...}} o
+    {testo: nome}) o CSV con colonna "qr". "nome" e gli altri campi vanno
+    in Waypoint.nome / Waypoint.dati.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path   = path
+        self._index = {}                    # testo QR → Waypoint
+        if path:
+            self.load(path)
+
+    def load(self, path: str) -> int:
+        if path.lower().endswith(".csv"):
+            with open(path, newline="", encoding="utf-8") as f:
+                voci = list(csv.DictReader(f))
+        else:
+            with open(path, encoding="utf-8") as f:
+                voci = json.load(f)
+            if isinstance(voci, dict):
+                voci = [dict(v, qr=k) if isinstance(v, dict) else {"qr": k, "nome": v}
+                        for k, v in voci.items()]
+        for voce in voci:
+            qr = str(voce.get("qr") or "").strip()
+            if not qr:
+                raise ValueError(f"{path}: tappa senza campo 'qr': {voce}")
+            old  = self._index.get(qr)
+            dati = {k: v for k, v in voce.items() if k not in ("qr", "nome")}
+            self._index[qr] = Waypoint(old.id if old else len(self._index), qr,
+                                       str(voce.get("nome") or qr), dati)
+        return len(self._index)
+
+    def lookup(self, qr: str) -> Optional[Waypoint]:
+        return self._index.get(qr)
+
+    def label(self, qr: str) -> str:
+        """Nome della tappa per l'HUD, il testo del QR se non è in missione."""
+        wp = self._index.get(qr)
+        return wp.nome if wp else qr
+
+    def __len__(self):
+        return len(self._index)
+
+
+class QREvent:
+    """Un evento QR: "visto" (prima volta), "perso" o "rivisto"."""
+
+    __slots__ = ("t", "tipo", "qr", "waypoint")
+
+    def __init__(self, t: float, tipo: str, qr: str, waypoint: Optional[Waypoint]):
+        self.t        = t
+        self.tipo     = tipo
+        self.qr       = qr
+        self.waypoint = waypoint
+
+    def __str__(self):
+        tappa = f"tappa {self.waypoint.id} \"{self.waypoint.nome}\"" if self.waypoint \
+            else "fuori missione"
+        return f"{self.tipo}: {self.qr} → {tappa}"
+
+
+class QREventStream:
+    """
+    Eventi QR senza duplicati, dall'insieme dei QR validi del QRWorker:
+    "visto" alla prima lettura di un testo, "perso" quando scade (QR_TTL),
+    "rivisto" quando torna. La scadenza la controlla anche poll() dal main
+    loop, così "perso" arriva pure se il worker non riceve più frame.
+    Ogni evento va nella coda (drain() dal main loop o dal gioco), alla
+    callback on_event (dal thread del worker o da poll(); non deve chiamare
+    update/poll) e nel log CSV, una riga compatta per evento:
+        t (unix), evento (v/p/r), id tappa, testo QR (solo se fuori missione)
+    """
+
+    CODICI = {"visto": "v", "perso": "p", "rivisto": "r"}
+
+    def __init__(self, registry: QRMissionRegistry, on_event=None,
+                 log_path: Optional[str] = None, maxlen: int = 256):
+        self.registry = registry
+        self.on_event = on_event
+        self.count    = 0
+        self._queue   = deque(maxlen=maxlen)
+        self._active  = frozenset()
+        self._visti   = {}                  # testo attivo → ultima lettura (monotonic)
+        self._first   = {}                  # testo → t della prima lettura
+        self._lock    = threading.Lock()    # update() dal worker, poll() dal main
+        self._log     = None
+        if log_path:
+            nuovo      = not os.path.exists(log_path) or os.path.getsize(log_path) == 0
+            self._log  = open(log_path, "a", newline="", encoding="utf-8")
+            self._csv  = csv.writer(self._log)
+            if nuovo:
+                self._csv.writerow(["t", "evento", "tappa", "qr"])
+
+    def update(self, visti: dict, t: float):
+        """visti: testo → ultima lettura (time.monotonic()) dei QR validi adesso."""
+        with self._lock:
+            self._visti = dict(visti)
+            self._sincronizza(frozenset(visti), t)
+
+    def poll(self, now: Optional[float] = None):
+        """Emette "perso" per i QR non letti da più di QR_TTL secondi."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            vivi = frozenset(qr for qr, t in self._visti.items() if now - t <= QR_TTL)
+            if vivi != self._active:
+                self._sincronizza(vivi, time.time())
+
+    def _sincronizza(self, testi: frozenset, t: float):
+        if self._active == testi:
+            return
+        for qr in testi - self._active:
+            self._emit(t, "rivisto" if qr in self._first else "visto", qr)
+            self._first.setdefault(qr, t)
+        for qr in self._active - testi:
+            self._emit(t, "perso", qr)
+        self._active = testi
+
+    def _emit(self, t: float, tipo: str, qr: str):
+        ev = QREvent(t, tipo, qr, self.registry.lookup(qr))
+        self.count += 1
+        self._queue.append(ev)
+        if self._log:
+            wp = ev.waypoint
+            self._csv.writerow([f"{t:.3f}", self.CODICI[tipo],
+                                wp.id if wp else "", "" if wp else qr])
+            self._log.flush()
+        if self.on_event:
+            self.on_event(ev)
+
+    def drain(self) -> List[QREvent]:
+        """Eventi arrivati dall'ultima chiamata, in ordine."""
+        out = []
+        while self._queue:
+            out.append(self._queue.popleft())
+        return out
+
+    def first_seen(self, qr: str) -> Optional[float]:
+        return self._first.get(qr)
+
+    def close(self):
+        if self._log:
+            self._log.close()
+            self._log = None
+
+
 HAND_GESTURES = [
     ("✊ Pugno / ✋ Palmo", "STOP"),
     ("☝  Solo indice",      "AVANTI"),
@@ -393,39 +2376,23 @@ FACE_GESTURES = [
     ("Testa ferma", "STOP"),
 ]
 
-def build_hud_panel(action, source, connected, mode, step_state,
-                    panel_h, has_picam, qr_texts: List[str], pw=480) -> np.ndarray:
-    """Costruisce il pannello HUD come striscia orizzontale sotto la Pi Camera."""
+MODE_LBL = {"mano": "MANO", "viso": "VISO", "entrambi": "MANO+VISO"}
+
+
+@functools.lru_cache(maxsize=16)
+def _hud_statico(mode, action, panel_h, pw) -> np.ndarray:
+    """
+    Livello statico dell'HUD: sfondo, separatori, riga modalità e tabella
+    gesti. Dipende solo da modo, azione attiva e dimensioni → in LRU.
+    """
     panel  = np.zeros((panel_h, pw, 3), dtype=np.uint8)
     panel[:] = (12, 12, 18)
     x0     = 12
     color  = ACTION_COLOR.get(action, (160,160,160))
 
-    # ── Riga 1: connessione + camera status ───────────────────────────────────
-    c_col = (0,210,80) if connected else (50,50,220)
-    cv2.putText(panel, "● CONNESSO" if connected else "● NON CONNESSO",
-                (x0, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.50, c_col, 1, cv2.LINE_AA)
-    cam_col = (0,180,60) if has_picam else (80,80,80)
-    cam_txt = "PI CAM LIVE" if has_picam else "PI CAM — in attesa..."
-    cv2.putText(panel, cam_txt, (220, 22),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.40, cam_col, 1, cv2.LINE_AA)
-
-    # ── Riga 2: modalità ──────────────────────────────────────────────────────
-    mode_lbl = {"mano":"MANO","viso":"VISO","entrambi":"MANO+VISO"}
-    cv2.putText(panel, f"MODO: {mode_lbl.get(mode,mode)}  [M] cambia  [Q] esci",
+    cv2.putText(panel, f"MODO: {MODE_LBL.get(mode,mode)}  [M] cambia  [Q] esci",
                 (x0, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.38, (130,130,150), 1, cv2.LINE_AA)
-
     cv2.line(panel, (0,48),(pw,48),(50,50,60),1)
-
-    # ── Riga 3: comando corrente (grande, colore azione) ──────────────────────
-    label   = action.upper() if action else "IN ATTESA..."
-    src_lbl = f"[{source}]" if source else ""
-    step_info = ""
-    if action in ("sinistra","destra"):
-        step_info = " ▶" if step_state == "moving" else " ⏸"
-    cv2.putText(panel, f"CMD: {label} {src_lbl}{step_info}",
-                (x0, 78), cv2.FONT_HERSHEY_SIMPLEX, 0.80, color, 2, cv2.LINE_AA)
-
     cv2.line(panel, (0,88),(pw,88),(50,50,60),1)
 
     # ── Gesti (su due colonne per risparmiare spazio verticale) ───────────────
@@ -448,22 +2415,222 @@ def build_hud_panel(action, source, connected, mode, step_state,
         cv2.putText(panel, "VISO (fallback): Su/Giù=AVA/IND  Sx/Dx=SIN/DES",
                     (x0, panel_h - 28),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.29, (80,80,100), 1, cv2.LINE_AA)
-
-    # ── QR Code rilevati ──────────────────────────────────────────────────────
     cv2.line(panel, (0, panel_h - 20),(pw, panel_h - 20),(50,50,60),1)
-    if qr_texts:
-        qr_col = (0, 230, 160)
-        txt    = qr_texts[0]
-        extra  = f"  (+{len(qr_texts)-1} altri)" if len(qr_texts) > 1 else ""
-        label_qr = f"QR: {txt[:70]}{'…' if len(txt)>70 else ''}{extra}"
-        cv2.putText(panel, label_qr, (x0, panel_h - 6),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.36, qr_col, 1, cv2.LINE_AA)
-    else:
-        cv2.putText(panel, "QR: nessuno rilevato", (x0, panel_h - 6),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.32, (60,60,70), 1, cv2.LINE_AA)
-
+    panel.flags.writeable = False       # condiviso dalla cache: solo lettura
     return panel
 
+
+class HudRenderer:
+    """
+    HUD a livelli scritto in un canvas preallocato (Pi Camera sopra, HUD
+    sotto) al posto di np.vstack a ogni frame. Il livello statico viene da
+    _hud_statico(); le strisce dinamiche (connessione, latenze, comando,
+    istogramma, QR) si ridisegnano solo quando cambia il loro testo:
+    prima si ripristina il rettangolo dal livello statico, poi si scrive
+    dentro la sua vista, così il testo non sborda nelle strisce vicine.
+    """
+
+    INF_REFRESH_S = 1.0    # fps/ms dell'inferenza cambiano a ogni frame: si aggiornano al secondo
+
+    def __init__(self, top_h: int, panel_h: int, pw: int):
+        self.canvas  = np.zeros((top_h + panel_h, pw, 3), dtype=np.uint8)
+        self.top     = self.canvas[:top_h]
+        self.panel   = self.canvas[top_h:]
+        self.panel_h = panel_h
+        self.pw      = pw
+        self.redraws = 0                    # strisce ridisegnate
+        self.skipped = 0                    # strisce invariate, non toccate
+        self._static = None
+        self._drawn  = {}                   # striscia → contenuto disegnato
+        self._inf    = (None, 0.0, None)    # (intestazione, istante, testo) dell'inferenza
+        # (y0, y1, x0, x1) di ogni striscia, in coordinate del pannello
+        self._strips = {
+            "stato":      (0, 29, 0, pw),
+            "latenza":    (29, 48, 420, pw),
+            "comando":    (49, 88, 0, pw),
+            "istogramma": (89, panel_h - 21, pw - 180, pw),
+            "qr":         (panel_h - 19, panel_h, 0, pw),
+        }
+
+    def _strip(self, name: str, content) -> Optional[tuple]:
+        """Vista (y0, x0, view) da ridisegnare, o None se il contenuto è invariato."""
+        if self._drawn.get(name) == content:
+            self.skipped += 1
+            return None
+        self._drawn[name] = content
+        self.redraws += 1
+        y0, y1, x0, x1 = self._strips[name]
+        view = self.panel[y0:y1, x0:x1]
+        view[:] = self._static[y0:y1, x0:x1]
+        return y0, x0, view
+
+    @staticmethod
+    def _text(strip, text, org, scale, color, thick=1):
+        y0, x0, view = strip
+        cv2.putText(view, text, (org[0] - x0, org[1] - y0),
+                    cv2.FONT_HERSHEY_SIMPLEX, scale, color, thick, cv2.LINE_AA)
+
+    def render(self, action, source, connected, mode, step_state,
+               has_picam, qr_texts: List[str],
+               cmd_stats: Optional[dict] = None,
+               lat_stats: Optional[dict] = None,
+               inf_stats: Optional[dict] = None) -> np.ndarray:
+        """Aggiorna il pannello HUD nel canvas e lo restituisce (vista, non copia)."""
+        x0, pw, panel_h = 12, self.pw, self.panel_h
+        static = _hud_statico(mode, action, panel_h, pw)
+        if static is not self._static:
+            self._static = static
+            self._drawn.clear()
+            np.copyto(self.panel, static)
+
+        # ── Riga 1: connessione + camera status + canale comandi ──────────────
+        cmd_txt = None
+        if cmd_stats:
+            lat = cmd_stats["latency_ms"]
+            lat_txt = f"{lat:.0f} ms" if lat is not None else "-- ms"
+            cmd_txt = (f"{cmd_stats['channel'].upper()} {lat_txt}  inviati {cmd_stats['sent']}"
+                       f"  unificati {cmd_stats['coalesced']}  errori {cmd_stats['errors']}")
+        s = self._strip("stato", (connected, has_picam, cmd_txt))
+        if s:
+            c_col = (0,210,80) if connected else (50,50,220)
+            self._text(s, "● CONNESSO" if connected else "● NON CONNESSO",
+                       (x0, 22), 0.50, c_col)
+            cam_col = (0,180,60) if has_picam else (80,80,80)
+            cam_txt = "PI CAM LIVE" if has_picam else "PI CAM — in attesa..."
+            self._text(s, cam_txt, (220, 22), 0.40, cam_col)
+            if cmd_txt:
+                self._text(s, cmd_txt, (420, 22), 0.38, (130,130,150))
+
+        # ── Riga 2: latenza frame (la modalità è nel livello statico) ─────────
+        lat_txt = None
+        if lat_stats and lat_stats["last_ms"] is not None:
+            lat_txt = (f"FRAME {lat_stats['last_ms']:.0f} ms  p50 {lat_stats['p50_ms']:.0f}"
+                       f"  p95 {lat_stats['p95_ms']:.0f}  persi {lat_stats['dropped_stream']}"
+                       f" stream / {lat_stats['dropped_client']} client")
+        s = self._strip("latenza", lat_txt)
+        if s and lat_txt:
+            self._text(s, lat_txt, (420, 40), 0.38, (130,130,150))
+
+        # ── Riga 3: comando corrente (grande, colore azione) + inferenza ──────
+        label   = action.upper() if action else "IN ATTESA..."
+        src_lbl = f"[{source}]" if source else ""
+        step_info = ""
+        if action in ("sinistra","destra"):
+            step_info = " ▶" if step_state == "moving" else " ⏸"
+        inf_txt = None
+        if inf_stats and inf_stats["fps"] is not None:
+            testa = f"GESTI {inf_stats['mode'].upper()}/{inf_stats['policy'][:5].upper()}"
+            now   = time.monotonic()
+            if testa != self._inf[0] or now - self._inf[1] >= self.INF_REFRESH_S:
+                self._inf = (testa, now, f"{testa} {inf_stats['fps']:.0f} fps"
+                                         f"  {inf_stats['ms']:.0f} ms")
+            inf_txt = self._inf[2]
+        cmd_line = f"CMD: {label} {src_lbl}{step_info}"
+        s = self._strip("comando", (cmd_line, inf_txt))
+        if s:
+            self._text(s, cmd_line, (x0, 78), 0.80,
+                       ACTION_COLOR.get(action, (160,160,160)), 2)
+            if inf_txt:
+                self._text(s, inf_txt, (pw - 220, 66), 0.34, (130,130,150))
+
+        # ── Istogramma latenza frame (angolo destro, solo se c'è spazio) ──────
+        hist = tuple(lat_stats["hist"]) if lat_stats and pw >= 700 else ()
+        s = self._strip("istogramma", hist)
+        if s and sum(hist):
+            y0, xs, view = s
+            draw_latency_histogram(view, hist, pw - 180 - xs, 96 - y0, 168, 60)
+
+        # ── QR Code rilevati ──────────────────────────────────────────────────
+        if qr_texts:
+            txt   = qr_texts[0]
+            extra = f"  (+{len(qr_texts)-1} altri)" if len(qr_texts) > 1 else ""
+            qr    = (f"QR: {txt[:70]}{'…' if len(txt)>70 else ''}{extra}", 0.36, (0, 230, 160))
+        else:
+            qr    = ("QR: nessuno rilevato", 0.32, (60,60,70))
+        s = self._strip("qr", qr)
+        if s:
+            self._text(s, qr[0], (x0, panel_h - 6), qr[1], qr[2])
+
+        return self.panel
+
+    def stats(self) -> dict:
+        info = _hud_statico.cache_info()
+        return {"redraws": self.redraws, "skipped": self.skipped,
+                "static_hits": info.hits, "static_misses": info.misses}
+
+
+def build_hud_panel(action, source, connected, mode, step_state,
+                    panel_h, has_picam, qr_texts: List[str], pw=480,
+                    cmd_stats: Optional[dict] = None,
+                    lat_stats: Optional[dict] = None,
+                    inf_stats: Optional[dict] = None) -> np.ndarray:
+    """Pannello HUD isolato (nuovo array). Nel main loop si usa HudRenderer."""
+    hud = HudRenderer(0, panel_h, pw)
+    return hud.render(action, source, connected, mode, step_state, has_picam,
+                      qr_texts, cmd_stats, lat_stats, inf_stats)
+
+
+def bench_hud(n: int = 600, pw: int = 860, top_h: int = 645, panel_h: int = 180):
+    """
+    ms per frame della finestra (Pi Camera + HUD) con dati che cambiano come
+    in guida: ridisegno completo + np.vstack a ogni frame contro HudRenderer.
+    """
+    top    = np.full((top_h, pw, 3), 40, dtype=np.uint8)
+    azioni = ["stop", "avanti", "avanti", "sinistra", None]
+    hist   = [0] * (len(LatencyMonitor.BINS) + 1)
+
+    def dati(i):
+        if i % 7 == 0:
+            hist[i % len(hist)] += 1
+        lat = {"last_ms": 60 + i % 13, "p50_ms": 65, "p95_ms": 90, "hist": hist,
+               "dropped_stream": i // 200, "dropped_client": i // 300}
+        cmd = {"channel": "udp", "latency_ms": 4.0 + (i // 30) % 3, "sent": i // 10,
+               "coalesced": i // 40, "errors": 0}
+        inf = {"mode": "video", "policy": "cortocircuito", "fps": 30.0 + (i // 30) % 2,
+               "ms": 18.0}
+        return (azioni[(i // 60) % len(azioni)], "mano", True, "entrambi", "moving",
+                True, ["stanza_3"] if (i // 90) % 2 else [], cmd, lat, inf)
+
+    t0 = time.perf_counter()
+    for i in range(n):
+        _hud_statico.cache_clear()
+        a = dati(i)
+        panel = HudRenderer(0, panel_h, pw).render(*a)
+        np.vstack([top, panel])
+    t_full = (time.perf_counter() - t0) * 1000 / n
+
+    hist[:] = [0] * len(hist)
+    hud = HudRenderer(top_h, panel_h, pw)
+    t0  = time.perf_counter()
+    for i in range(n):
+        hud.top[:] = top
+        hud.render(*dati(i))
+    t_hud = (time.perf_counter() - t0) * 1000 / n
+
+    s = hud.stats()
+    print(f"HUD {pw}x{panel_h} su {n} frame")
+    print(f"  ridisegno completo + vstack : {t_full:6.3f} ms/frame")
+    print(f"  HudRenderer (livelli)       : {t_hud:6.3f} ms/frame  ({t_full / t_hud:.1f}x)")
+    print(f"  strisce ridisegnate {s['redraws']}, invariate {s['skipped']}, "
+          f"livello statico {s['static_misses']} costruiti / {s['static_hits']} da cache")
+
+def draw_latency_histogram(panel, hist: List[int], x, y, w, h):
+    """Barre della distribuzione di latenza, una per fascia di LatencyMonitor.BINS."""
+    labels = [str(b) for b in LatencyMonitor.BINS] + [">"]
+    n      = len(hist)
+    bw     = w // n
+    top    = max(hist)
+    base   = y + h - 12
+    for i, count in enumerate(hist):
+        bh  = int((h - 16) * count / top) if top else 0
+        bx  = x + i * bw
+        col = (0,190,90) if i < 3 else (0,190,220) if i < 5 else (60,80,230)
+        cv2.rectangle(panel, (bx + 1, base - bh), (bx + bw - 2, base), col, -1)
+        cv2.putText(panel, labels[i], (bx, y + h),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.26, (100,100,120), 1, cv2.LINE_AA)
+    cv2.putText(panel, "LATENZA FRAME (ms)", (x, y),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.30, (130,130,155), 1, cv2.LINE_AA)
+
 def build_picam_placeholder(w, h) -> np.ndarray:
     """Frame placeholder mostrato quando lo stream Pi Camera non è disponibile."""
     img = np.zeros((h, w, 3), dtype=np.uint8)
@@ -480,6 +2647,32 @@ def build_picam_placeholder(w, h) -> np.ndarray:
     return img
 
 
+def draw_direction_overlay(frame, action: Optional[str]):
+    """
+    Freccia di direzione al centro del frame Pi Camera. La disegna il
+    client quando il server inoltra l'MJPEG della webcam senza overlay.
+    """
+    if not action:
+        return
+    h, w   = frame.shape[:2]
+    color  = ACTION_COLOR.get(action, (200, 200, 200))
+    cx, cy = w // 2, h // 2
+    s      = min(w, h) // 5
+
+    if action == "avanti":
+        cv2.arrowedLine(frame, (cx, cy+s), (cx, cy-s), color, 6, tipLength=0.3)
+    elif action == "indietro":
+        cv2.arrowedLine(frame, (cx, cy-s), (cx, cy+s), color, 6, tipLength=0.3)
+    elif action == "sinistra":
+        cv2.arrowedLine(frame, (cx+s, cy), (cx-s, cy), color, 6, tipLength=0.3)
+    elif action == "destra":
+        cv2.arrowedLine(frame, (cx-s, cy), (cx+s, cy), color, 6, tipLength=0.3)
+    elif action == "stop":
+        cv2.circle(frame, (cx, cy), s-10, color, 4)
+        cv2.line(frame, (cx-s//2, cy-s//2), (cx+s//2, cy+s//2), color, 4)
+        cv2.line(frame, (cx+s//2, cy-s//2), (cx-s//2, cy+s//2), color, 4)
+
+
 def draw_qr_overlay(frame, qr_results: List[dict], frame_w: int, frame_h: int,
                     orig_w: int, orig_h: int):
     """
@@ -515,6 +2708,139 @@ def draw_qr_overlay(frame, qr_results: List[dict], frame_w: int, frame_h: int,
                     cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0,230,160), 2, cv2.LINE_AA)
 
 
+class DisplayCompositor:
+    """
+    Compone la finestra nel canvas preallocato di HudRenderer senza nuove
+    allocazioni: il frame Pi Camera viene ridimensionato direttamente nella
+    vista superiore (dst=), il placeholder è disegnato una volta sola e, se
+    frame, gesto, QR e HUD sono invariati, compose() non tocca nulla e
+    restituisce False (niente imshow).
+    """
+
+    def __init__(self, w: int, h: int, hud_h: int):
+        self.w, self.h    = w, h
+        self.hud          = HudRenderer(h, hud_h, w)
+        self.canvas       = self.hud.canvas
+        self._placeholder = build_picam_placeholder(w, h)
+        self._src         = None            # frame Pi Camera dell'ultima composizione
+        self._top_key     = None            # (azione, freccia, QR) dell'ultima composizione
+        self.composed     = 0
+        self.skipped      = 0
+
+    def compose(self, pi_src, action, arrow: bool, qr_results: List[dict],
+                orig_size, hud_args: tuple, **hud_stats) -> bool:
+        """
+        pi_src:   ultimo frame Pi Camera (None = placeholder); un nuovo array
+                  è un nuovo frame, lo stesso oggetto è il frame già mostrato
+        arrow:    disegna la freccia di direzione (server in passthrough)
+        hud_args: argomenti posizionali di HudRenderer.render()
+        True se la finestra è cambiata e va rimostrata.
+        """
+        qr_key  = tuple((qr["data"], qr["rect"]) for qr in qr_results)
+        top_key = (action, arrow and pi_src is not None, qr_key, orig_size)
+        top     = pi_src is not self._src or top_key != self._top_key
+        if top:
+            self._src, self._top_key = pi_src, top_key
+            self._draw_top(pi_src, action, top_key[1], qr_results, orig_size)
+
+        redraws = self.hud.redraws
+        self.hud.render(*hud_args, **hud_stats)
+        changed = top or self.hud.redraws != redraws
+        if changed:
+            self.composed += 1
+        else:
+            self.skipped  += 1
+        return changed
+
+    def _draw_top(self, pi_src, action, arrow, qr_results, orig_size):
+        view = self.hud.top
+        if pi_src is None:
+            np.copyto(view, self._placeholder)
+        elif pi_src.shape[:2] == (self.h, self.w):
+            np.copyto(view, pi_src)
+        else:
+            cv2.resize(pi_src, (self.w, self.h), dst=view,
+                       interpolation=cv2.INTER_LINEAR)
+
+        # Freccia di direzione: qui solo se il server è in passthrough
+        if arrow:
+            draw_direction_overlay(view, action or "stop")
+
+        # Overlay QR code sulla Pi Camera
+        if qr_results:
+            draw_qr_overlay(view, qr_results, self.w, self.h, *orig_size)
+
+        # Overlay comando attivo sulla Pi Camera
+        if action:
+            color = ACTION_COLOR.get(action, (200,200,200))
+            label = action.upper()
+            (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 1.2, 3)
+            tx, ty = (self.w - tw) // 2, self.h - 20
+            cv2.putText(view, label, (tx, ty),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0,0,0), 5, cv2.LINE_AA)
+            cv2.putText(view, label, (tx, ty),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.2, color, 3, cv2.LINE_AA)
+
+
+def crea_riconoscitori(mode: str, args, smoother, recorder=None):
+    """(hand_rec, face_rec, None) per "sync", (None, None, GestureInference) altrimenti."""
+    if args.inference == "sync":
+        hand_rec = HandRecogniser(roi=args.roi) if mode in ("mano", "entrambi") else None
+        face_rec = FaceRecogniser(roi=args.roi) if mode in ("viso", "entrambi") else None
+        return hand_rec, face_rec, None
+    return None, None, GestureInference(mode, args.inference, args.policy,
+                                        roi=args.roi, infer_width=args.infer_width,
+                                        smoother=smoother, recorder=recorder)
+
+
+def crea_smoother(args) -> Optional[GestureSmoother]:
+    if args.smooth_window <= 1:
+        return None
+    return GestureSmoother(args.smooth_window, args.smooth_enter,
+                           args.smooth_exit, args.smooth_dwell)
+
+
+def bench_inference(cam: int, n: int = 150):
+    """
+    fps di mano + viso con ogni politica, sugli stessi n frame della webcam
+    locale (registrati prima in memoria). Tieni la mano davanti alla webcam
+    per una parte della registrazione: è lì che il cortocircuito guadagna.
+    """
+    ensure_models("entrambi")
+    cap = cv2.VideoCapture(cam)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH,  DETECT_W)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, DETECT_H)
+    frames = []
+    print(f"Registrazione di {n} frame dalla webcam {cam}...")
+    while len(frames) < n:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        sys.exit(f"[ERRORE] Webcam {cam} non disponibile")
+
+    prove = [(policy, False, None) for policy in POLITICHE]
+    prove += [("cortocircuito", True, None), ("cortocircuito", True, 320)]
+    print(f"  {'politica':<24} {'fps':>6} {'mano ms':>8} {'viso ms':>8} "
+          f"{'viso saltato':>13} {'roi ok/persi':>13}")
+    for policy, roi, width in prove:
+        inf = GestureInference("entrambi", "video", policy, avvia=False,
+                               roi=roi, infer_width=width)
+        inf.process(frames[0], time.monotonic())        # riscaldamento
+        t0 = time.perf_counter()
+        for frame in frames:
+            inf.process(frame, time.monotonic())
+        dt = time.perf_counter() - t0
+        s  = inf.stats()
+        nome = policy + (" +roi" if roi else "") + (f" {width}px" if width else "")
+        print(f"  {nome:<24} {len(frames) / dt:>6.1f} {s['hand_ms'] or 0:>8.1f} "
+              f"{s['face_ms'] or 0:>8.1f} {s['face_skipped']:>8}/{len(frames)} "
+              f"{s['roi_hits']:>7}/{s['roi_lost']}")
+        inf.close()
+
+
 # ─── Main ─────────────────────────────────────────────────────────────────────
 
 def main():
@@ -523,29 +2849,125 @@ def main():
     parser.add_argument("--port",  default=DEFAULT_PORT, type=int)
     parser.add_argument("--cam",   default=CAMERA_INDEX, type=int)
     parser.add_argument("--mode",  default="entrambi", choices=MODI)
+    parser.add_argument("--channel", default="auto", choices=CANALI,
+                        help="Canale comandi: auto = UDP se offerto dal server")
+    parser.add_argument("--inference", default="video", choices=INFERENZE,
+                        help="Riconoscimento gesti: video/live = thread separato con "
+                             "tracking MediaPipe, sync = nel main loop (default video)")
+    parser.add_argument("--qr-motion", default=QR_MOTION_SOGLIA, type=float, metavar="SOGLIA",
+                        help="Differenza media minima (livelli di grigio) perché un frame "
+                             f"venga riscansionato per i QR (default {QR_MOTION_SOGLIA}, 0 = sempre)")
+    parser.add_argument("--qr-backend", default="auto", choices=QR_BACKENDS,
+                        help="Decoder QR (default auto: pyzbar se installato, altrimenti OpenCV)")
+    parser.add_argument("--qr-full", action="store_true",
+                        help="Decodifica i QR sul frame intero invece che sulle regioni candidate")
+    parser.add_argument("--missioni", default=None, metavar="FILE",
+                        help="Tappe di missione per testo QR (JSON o CSV con colonna 'qr')")
+    parser.add_argument("--qr-log", default=None, metavar="FILE",
+                        help="Aggiunge gli eventi QR (visto/perso/rivisto) a FILE CSV")
+    parser.add_argument("--bench-qr", default=None, type=int, metavar="N",
+                        help="Benchmark dei decoder QR su N frame sintetici per caso ed esce")
+    parser.add_argument("--policy", default="cortocircuito", choices=POLITICHE,
+                        help="Mano e viso in modalità entrambi (default cortocircuito)")
+    parser.add_argument("--roi", action="store_true",
+                        help="Inferenza sul ritaglio attorno a mano/viso del frame "
+                             "precedente; frame intero solo quando li perde")
+    parser.add_argument("--infer-width", default=None, type=int, metavar="PX",
+                        help="Larghezza a cui ridurre il frame per MediaPipe "
+                             "(es. 320; default: risoluzione webcam)")
+    parser.add_argument("--smooth-window", default=7, type=int, metavar="N",
+                        help="Frame del voto a maggioranza sui gesti (default 7, 0 = off)")
+    parser.add_argument("--smooth-enter", default=0.6, type=float,
+                        help="Quota di voti perché un nuovo gesto entri (default 0.6)")
+    parser.add_argument("--smooth-exit", default=0.35, type=float,
+                        help="Quota di voti sotto cui il gesto in corso decade (default 0.35)")
+    parser.add_argument("--smooth-dwell", default=0.15, type=float, metavar="SEC",
+                        help="Permanenza minima di un nuovo gesto (default 0.15 s; "
+                             "stop e nessun gesto sono immediati)")
+    parser.add_argument("--test-gesti", action="store_true",
+                        help="Verifica la stabilizzazione gesti su sequenze tipiche ed esce")
+    parser.add_argument("--record-landmarks", default=None, metavar="FILE",
+                        help="Registra i landmark di ogni frame in FILE.npz (per --replay)")
+    parser.add_argument("--record-frames", action="store_true",
+                        help="Con --record-landmarks salva anche i frame in JPEG")
+    parser.add_argument("--replay", default=None, metavar="FILE",
+                        help="Rigioca una registrazione di landmark senza webcam ed esce")
+    parser.add_argument("--baseline", default=None, metavar="FILE",
+                        help="Con --replay: decisioni di riferimento (da --save-decisions)")
+    parser.add_argument("--save-decisions", default=None, metavar="FILE",
+                        help="Con --replay: salva le decisioni di questa versione")
+    parser.add_argument("--bench-inference", default=None, type=int, metavar="N",
+                        help="fps delle politiche mano+viso su N frame della webcam ed esce")
+    parser.add_argument("--latency-csv", default=None, metavar="FILE",
+                        help="All'uscita salva la latenza di ogni frame Pi Camera in CSV")
+    parser.add_argument("--record-stream", default=None, metavar="FILE",
+                        help="Salva i byte grezzi di /stream (per --bench-parser) ed esce")
+    parser.add_argument("--secondi", default=10.0, type=float,
+                        help="Durata di --record-stream (default 10)")
+    parser.add_argument("--bench-hud", default=None, type=int, metavar="N",
+                        help="Misura il disegno dell'HUD su N frame sintetici ed esce")
+    parser.add_argument("--bench-parser", default=None, metavar="FILE",
+                        help="Benchmark del parser MJPEG su una cattura ed esce")
     args = parser.parse_args()
 
+    if args.test_gesti:
+        sys.exit(0 if test_gesti() else 1)
+    if args.replay:
+        replay_landmarks(args.replay, args.baseline, args.save_decisions)
+        return
+    if args.record_landmarks and args.inference == "live":
+        sys.exit("[ERRORE] --record-landmarks richiede --inference video o sync")
+    if args.record_stream:
+        record_stream(args.host, args.port, args.record_stream, args.secondi)
+        return
+    if args.bench_hud:
+        bench_hud(args.bench_hud)
+        return
+    if args.bench_qr:
+        bench_qr(args.bench_qr)
+        return
+    if args.bench_parser:
+        bench_parser(args.bench_parser)
+        return
+    if args.bench_inference:
+        bench_inference(args.cam, args.bench_inference)
+        return
+
     mode = args.mode
     ensure_models(mode)
 
     print("[INFO] Caricamento modelli...")
-    hand_rec = HandRecogniser() if mode in ("mano",  "entrambi") else None
-    face_rec = FaceRecogniser() if mode in ("viso",  "entrambi") else None
-
-    robot   = RobotController(args.host, args.port)
+    recorder = None
+    if args.record_landmarks:
+        recorder = LandmarkRecorder(args.record_landmarks, args.record_frames,
+                                    {"mode": mode, "inference": args.inference,
+                                     "roi": args.roi, "infer_width": args.infer_width})
+    smoother = crea_smoother(args)
+    hand_rec, face_rec, inference = crea_riconoscitori(mode, args, smoother, recorder)
+
+    robot   = RobotController(args.host, args.port, args.channel)
     stepper = StepRotationManager()
-    qr_dec  = QRDecoder()
+    qr_dec  = QRDecoder(args.qr_backend, roi=not args.qr_full)
+
+    missioni  = QRMissionRegistry(args.missioni)
+    qr_events = QREventStream(missioni, log_path=args.qr_log)
+    qr_worker = QRWorker(qr_dec, args.qr_motion, qr_events) if qr_dec.available else None
+    if args.missioni:
+        print(f"[INFO] Missione: {len(missioni)} tappe da {args.missioni}")
 
     if not qr_dec.available:
         print("[INFO] Per abilitare QR: pip install pyzbar  (Linux: sudo apt install libzbar0)")
+    else:
+        print(f"[INFO] QR: backend {qr_dec.backend}, "
+              f"{'frame intero' if args.qr_full else 'regioni candidate'}")
 
     # ── Pi Camera stream receiver (sempre attivo) ─────────────────────────────
     pi_cam = PiCameraReceiver(args.host, args.port)
     pi_cam.start()
+    latency = LatencyMonitor()
     print(f"[INFO] Stream Pi Camera: http://{args.host}:{args.port}/stream")
 
-    connected = robot.ping()
-    last_ping = time.time()
+    connected = robot.ping()    # all'avvio si può aspettare; poi lo aggiorna un thread
 
     # ── Webcam locale (solo per gesture, non mostrata) ────────────────────────
     cap = cv2.VideoCapture(args.cam)
@@ -572,24 +2994,34 @@ def main():
     last_pi_frame: Optional[np.ndarray] = None
     last_pi_orig_size = (640, 480)   # dimensioni originali del frame Pi Camera
     qr_results: List[dict] = []      # ultimi QR trovati
-    qr_scan_counter = 0
+    display = DisplayCompositor(PICAM_W, PICAM_H, HUD_H)
 
     while True:
         ret, raw = cap.read()
         if not ret:
             print("[ERRORE] Lettura webcam fallita"); break
 
-        # Flip orizzontale per effetto specchio naturale
-        detect_frame = cv2.flip(raw, 1)
-
         # ── Riconosci gesto (ogni frame, risoluzione piena per qualità) ───────
-        hand_action = face_action = None
-        if hand_rec: hand_action = hand_rec.detect(detect_frame)
-        if face_rec: face_action = face_rec.detect(detect_frame)
-
-        if hand_action is not None:   action, source = hand_action, "mano"
-        elif face_action is not None: action, source = face_action, "viso"
-        else:                         action, source = None, ""
+        if inference:
+            # Il frame va al thread di inferenza; si usa l'ultimo gesto pronto
+            inference.submit(raw)
+            action, source = inference.latest()
+        else:
+            # Flip orizzontale per effetto specchio naturale
+            detect_frame = cv2.flip(scala_inferenza(raw, args.infer_width), 1)
+            hand_action = face_action = None
+            if hand_rec: hand_action = hand_rec.detect(detect_frame)
+            if face_rec: face_action = face_rec.detect(detect_frame)
+            if recorder:
+                recorder.add(time.monotonic(), hand_rec, face_rec, detect_frame)
+
+            if hand_action is not None:   action, source = hand_action, "mano"
+            elif face_action is not None: action, source = face_action, "viso"
+            else:                         action, source = None, ""
+            if smoother:
+                grezzo = action
+                action = smoother.update(grezzo, time.monotonic())
+                source = source if action == grezzo else ""
 
         # ── Invia comandi ─────────────────────────────────────────────────────
         step_state = "idle"
@@ -602,73 +3034,76 @@ def main():
                 elif action == "indietro": robot.indietro()
                 else:                      robot.stop()
 
-        # ── Ping periodico ────────────────────────────────────────────────────
-        if time.time() - last_ping > 3.0:
-            connected = robot.ping()
-            last_ping = time.time()
+        # ── Stato connessione (/ping in background) ───────────────────────────
+        connected = robot.connected    # il /ping lo fa il thread di RobotController
 
         # ── Recupera frame Pi Camera ──────────────────────────────────────────
-        new_pi = pi_cam.get_frame()
+        new_pi = pi_cam.get_frame((PICAM_W, PICAM_H))
+        shown_meta = pi_cam.frame_meta if new_pi is not None else None
         if new_pi is not None:
             last_pi_frame = new_pi
             last_pi_orig_size = (new_pi.shape[1], new_pi.shape[0])  # (w, h)
         has_picam = pi_cam.is_ok
 
-        # ── Scansione QR (ogni QR_SCAN_EVERY frame, sul frame Pi Camera raw) ──
-        qr_scan_counter += 1
-        if qr_dec.available and last_pi_frame is not None and \
-                qr_scan_counter % QR_SCAN_EVERY == 0:
-            found = qr_dec.decode(last_pi_frame)
-            if found:
-                qr_results = found
-                for qr in found:
-                    print(f"[QR] Rilevato: {qr['data']}")
-            else:
-                qr_results = []
-
-        if last_pi_frame is not None:
-            pi_frame = cv2.resize(last_pi_frame, (PICAM_W, PICAM_H),
-                                  interpolation=cv2.INTER_LINEAR)
-        else:
-            pi_frame = build_picam_placeholder(PICAM_W, PICAM_H)
-
-        # Overlay QR code sulla Pi Camera
-        if qr_results:
-            orig_w, orig_h = last_pi_orig_size
-            draw_qr_overlay(pi_frame, qr_results, PICAM_W, PICAM_H, orig_w, orig_h)
-
-        # Overlay comando attivo sulla Pi Camera
-        if action:
-            color = ACTION_COLOR.get(action, (200,200,200))
-            label = action.upper()
-            (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 1.2, 3)
-            tx, ty = (PICAM_W - tw) // 2, PICAM_H - 20
-            cv2.putText(pi_frame, label, (tx, ty),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0,0,0), 5, cv2.LINE_AA)
-            cv2.putText(pi_frame, label, (tx, ty),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.2, color, 3, cv2.LINE_AA)
-
-        # ── Assembla la finestra: Pi Camera + HUD sotto ───────────────────────
-        qr_texts = [qr["data"] for qr in qr_results]
-        hud = build_hud_panel(action, source, connected, mode,
-                              step_state, HUD_H, has_picam, qr_texts, pw=PICAM_W)
-        canvas = np.vstack([pi_frame, hud])
-
-        cv2.imshow("AlphaBot - Controllo Gesti", canvas)
+        # ── Scansione QR: ogni nuovo frame va al worker, qui solo i risultati ─
+        if qr_worker:
+            if new_pi is not None:
+                qr_worker.submit(new_pi)
+            qr_results = qr_worker.results()
+            qr_events.poll()
+            for ev in qr_events.drain():
+                print(f"[QR] {ev}")
+
+        # ── Assembla la finestra: Pi Camera + HUD sotto, nel canvas fisso ─────
+        qr_texts = [missioni.label(qr["data"]) for qr in qr_results]
+        if display.compose(last_pi_frame, action, not robot.server_overlay,
+                           qr_results, last_pi_orig_size,
+                           (action, source, connected, mode, step_state,
+                            has_picam, qr_texts),
+                           cmd_stats=robot.stats(),
+                           lat_stats=latency.stats(pi_cam.lost, pi_cam.overwritten),
+                           inf_stats=inference.stats() if inference else None):
+            cv2.imshow("AlphaBot - Controllo Gesti", display.canvas)
 
         # ── Tasti ─────────────────────────────────────────────────────────────
         key = cv2.waitKey(1) & 0xFF
+        # Il frame è a schermo dopo waitKey: qui si chiude la misura di latenza
+        latency.record(shown_meta, time.time(), robot.clock_offset)
         if key == ord('q'):
             break
         elif key == ord('m'):
             mode = MODI[(MODI.index(mode)+1) % len(MODI)]
             ensure_models(mode)
-            hand_rec = HandRecogniser() if mode in ("mano","entrambi") else None
-            face_rec = FaceRecogniser() if mode in ("viso","entrambi") else None
+            if inference:
+                inference.close()
+            smoother = crea_smoother(args)
+            hand_rec, face_rec, inference = crea_riconoscitori(mode, args, smoother,
+                                                               recorder)
             print(f"[INFO] Modalità → {mode}")
 
+    if inference:
+        inference.close()
+    if qr_worker:
+        qr_worker.close()
+        qr_events.close()
+        s = qr_worker.stats()
+        print(f"[INFO] QR: {s['scans']} scansioni, {s['skipped']} frame fermi saltati, "
+              f"{s['dropped']} sostituiti, {qr_dec.candidates} regioni candidate, "
+              f"{qr_dec.full_scans} frame interi, {qr_events.count} eventi")
+    if smoother:
+        print(f"[INFO] Gesti: {smoother.raw_changes} cambi grezzi → "
+              f"{smoother.changes} intenti stabili")
+    if recorder:
+        n = recorder.save()
+        print(f"[INFO] Landmark di {n} frame salvati in {recorder.path}")
+    print(f"[INFO] Finestra: {display.composed} composizioni, "
+          f"{display.skipped} cicli invariati saltati")
     robot.stop()
+    robot.close()
     pi_cam.stop()
+    if args.latency_csv:
+        n = latency.to_csv(args.latency_csv)
+        print(f"[INFO] Latenza frame: {n} righe salvate in {args.latency_csv}")
     cap.release()
     cv2.destroyAllWindows()
     print("[INFO] Uscito. Robot fermato.")
@@ -20,12 +20,33 @@ Avvio:
     # Per ridurre il lag dello stream (qualità JPEG, default 70):
     python3 alphabot_server.py --port 5000 --quality 60
 
+    # Webcam con MJPEG nativo: niente decode/encode sul Pi
+    python3 alphabot_server.py --port 5000 --passthrough
+
+    # Watchdog: stop dopo 0.8 s senza comandi (0.5 s per "avanti")
+    python3 alphabot_server.py --watchdog 0.8 --watchdog-azione avanti=0.5
+
+    # Verifica del watchdog sotto carico (GPIO simulati, i motori non si muovono)
+    python3 alphabot_server.py --test-watchdog
+
+    # Server asincrono: un solo event loop per tutti i viewer (pip install uvicorn)
+    python3 alphabot_server.py --port 5000 --asgi --max-viewers 20
+    # Confronto thread vs asgi: vedi stream_bench.py
+
 Endpoints:
   GET  /ping    → stato server + disponibilità camera
   POST /command → invia comando motori  {action, speed}
+                  {action: "step_sinistra"|"step_destra", speed, durata, pausa, count}
+                  → rotazione a scatti temporizzata sul Pi (durate in ms)
   GET  /stop    → stop emergenza
   GET  /stato   → stato corrente robot
   GET  /stream  → MJPEG stream Pi Camera (apribile anche nel browser)
+                  ?quality=40&scale=0.5 → variante più leggera per viewer remoti
+                  ogni parte ha X-Frame-Seq e X-Frame-Time (istante di cattura)
+  GET  /metrics → tempi di encode JPEG per ogni variante dello stream
+  GET  /pipeline → tempi per stadio della pipeline cattura → overlay/encode,
+                  frame catturati, scartati (worker in ritardo) e fuori ordine
+  UDP  :<port>  → canale comandi a bassa latenza (vedi CommandChannel)
 
 NOTE sul riconoscimento QR:
   Il client decodifica i QR code direttamente sui frame ricevuti dallo stream.
@@ -34,32 +55,40 @@ NOTE sul riconoscimento QR:
   e la qualità JPEG >= 65 (valori inferiori degradano i QR code).
 """
 
+import sys
+import json
 import time
+import socket
+import struct
+import asyncio
 import argparse
 import logging
 import threading
-from threading import Timer, Lock
+from threading import Lock, Condition
+from collections import deque
+from typing import Optional
+from urllib.parse import parse_qs
 from flask import Flask, request, jsonify, Response
 
 # ─── GPIO ──────────────────────────────────────────────────────────────────────
+class _MockGPIO:
+    BCM = OUT = HIGH = LOW = 0
+    def setmode(self, *a):    pass
+    def setup(self, *a, **k): pass
+    def output(self, *a):     pass
+    def cleanup(self):        pass
+    class PWM:
+        def __init__(self, p, f): pass
+        def start(self, dc):      pass
+        def ChangeDutyCycle(self, dc): pass
+        def stop(self):           pass
+
 try:
     import RPi.GPIO as GPIO
     ON_PI = True
 except (ImportError, RuntimeError):
     ON_PI = False
     print("[WARN] RPi.GPIO non trovato — modalità simulazione attiva")
-
-    class _MockGPIO:
-        BCM = OUT = HIGH = LOW = 0
-        def setmode(self, *a):    pass
-        def setup(self, *a, **k): pass
-        def output(self, *a):     pass
-        def cleanup(self):        pass
-        class PWM:
-            def __init__(self, p, f): pass
-            def start(self, dc):      pass
-            def ChangeDutyCycle(self, dc): pass
-            def stop(self):           pass
     GPIO = _MockGPIO()
 
 # ─── OpenCV (per webcam USB) ───────────────────────────────────────────────────
@@ -72,11 +101,284 @@ except ImportError:
     print("[WARN] opencv non trovato — streaming disabilitato")
     print("       Installa con: sudo apt install python3-opencv")
 
+# ─── uvicorn (opzionale, per la modalità --asgi) ─────────────────────────────
+try:
+    import uvicorn
+    HAS_UVICORN = True
+except ImportError:
+    HAS_UVICORN = False
+
+# ─── libjpeg-turbo (opzionale, encoder JPEG più veloce) ──────────────────────
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    HAS_TURBOJPEG = True
+except ImportError:
+    HAS_TURBOJPEG = False
+
 # ─── Pin GPIO (BCM) ────────────────────────────────────────────────────────────
 
 AIN1 = 12; AIN2 = 13; PWMA = 6
 BIN1 = 20; BIN2 = 21; PWMB = 26
 
+# ─── Distribuzione frame ai client ───────────────────────────────────────────
+
+class MjpegFrame:
+    """
+    Frame JPEG già impacchettato come parte multipart, pubblicato una volta
+    sola dal thread di cattura e condiviso (mai modificato) da tutti i client.
+    L'header della parte è calcolato qui, non per ogni client: ogni viewer
+    scrive solo i tre buffer di `parts` sul socket, senza concatenazioni
+    né copie del JPEG.
+    """
+
+    __slots__ = ("jpeg", "header")
+
+    BOUNDARY = b"frame"
+    TRAILER  = b"\r\n"
+
+    def __init__(self, jpeg: bytes, headers: dict = None):
+        """headers: intestazioni extra della parte, es. {"X-Robot-Action": "stop"}."""
+        extra = b"".join(f"{k}: {v}\r\n".encode("latin-1")
+                         for k, v in (headers or {}).items())
+        self.jpeg   = jpeg
+        self.header = (b"--" + self.BOUNDARY + b"\r\n"
+                       b"Content-Type: image/jpeg\r\n"
+                       b"Content-Length: %d\r\n" % len(jpeg)
+                       + extra + b"\r\n")
+
+    @property
+    def parts(self):
+        """Buffer da scrivere in sequenza (stile writev)."""
+        return (self.header, self.jpeg, self.TRAILER)
+
+    def __len__(self):
+        return len(self.header) + len(self.jpeg) + len(self.TRAILER)
+
+
+class FrameHub:
+    """
+    Punto di incontro tra il thread di cattura e i client /stream.
+    Ogni frame pubblicato riceve un numero di sequenza crescente: i client
+    dormono sulla Condition finché non esce un frame più nuovo dell'ultimo
+    inviato, quindi a riposo non consumano CPU. Un client lento salta
+    semplicemente i frame intermedi e riceve sempre il più recente.
+    """
+
+    def __init__(self):
+        self._cond      = Condition()
+        self._frame     = None
+        self._seq       = 0
+        self._closed    = False
+        self._listeners = []
+
+    def publish(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq  += 1
+            self._cond.notify_all()
+            for listener in self._listeners:
+                listener(self._seq, frame)
+
+    def subscribe(self, listener):
+        """
+        listener(seq, frame) viene chiamato dal thread di cattura ad ogni
+        publish(): deve solo passare la notifica altrove (es. a un event loop).
+        """
+        with self._cond:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._cond:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def latest(self):
+        """Ritorna (seq, frame) senza attendere."""
+        with self._cond:
+            return self._seq, self._frame
+
+    def wait_next(self, last_seq: int, timeout: float = None):
+        """
+        Attende un frame con sequenza diversa da last_seq.
+        Ritorna (seq, frame); se scade il timeout o l'hub viene chiuso
+        ritorna la sequenza corrente, che può coincidere con last_seq.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._seq != last_seq or self._closed, timeout)
+            return self._seq, self._frame
+
+    def close(self):
+        """Sveglia tutti i client in attesa (es. allo spegnimento)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            for listener in self._listeners:
+                listener(self._seq, None)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+
+# ─── Encoder JPEG ─────────────────────────────────────────────────────────────
+
+class OpenCVEncoder:
+    """Encoder di default: cv2.imencode (sempre disponibile se c'è OpenCV)."""
+
+    name = "opencv"
+
+    def encode(self, frame, quality: int) -> Optional[bytes]:
+        # Unica copia in bytes per frame, condivisa da tutti i client
+        # (WSGI accetta solo bytes, non memoryview)
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buf.tobytes() if ok else None
+
+
+class TurboJpegEncoder:
+    """
+    Encoder libjpeg-turbo tramite PyTurboJPEG (pip install PyTurboJPEG,
+    sudo apt install libturbojpeg0). Sul Pi 3 è sensibilmente più veloce
+    di cv2.imencode e restituisce direttamente bytes.
+    """
+
+    name = "turbojpeg"
+
+    def __init__(self):
+        self._tj = TurboJPEG()
+
+    def encode(self, frame, quality: int) -> Optional[bytes]:
+        return self._tj.encode(frame, quality=quality,
+                               pixel_format=TJPF_BGR,
+                               jpeg_subsample=TJSAMP_420)
+
+
+ENCODERS = ("auto", "opencv", "turbojpeg")
+
+
+def make_encoder(name: str = "auto"):
+    """
+    Crea l'encoder richiesto. "auto" preferisce libjpeg-turbo se presente;
+    se il backend richiesto non è disponibile si ripiega su OpenCV.
+    """
+    if name in ("auto", "turbojpeg") and HAS_TURBOJPEG:
+        try:
+            return TurboJpegEncoder()
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"libjpeg-turbo non utilizzabile ({e}) — uso OpenCV")
+    elif name == "turbojpeg":
+        logger.warning("PyTurboJPEG non installato — uso OpenCV "
+                       "(pip install PyTurboJPEG)")
+    return OpenCVEncoder()
+
+
+# ─── Livelli di qualità dello stream ─────────────────────────────────────────
+
+class StreamTier:
+    """
+    Una variante (qualità JPEG, scala) dello stream. Ogni tier viene
+    codificato una sola volta per frame e condiviso da tutti i client che
+    lo richiedono; tiene anche le metriche del proprio encode.
+    """
+
+    SCALES = (1.0, 0.75, 0.5, 0.25)
+
+    def __init__(self, quality: int, scale: float):
+        self.quality   = quality
+        self.scale     = scale
+        self.hub       = FrameHub()
+        self.viewers   = 0
+        self.frames    = 0
+        self.last_ms   = 0.0
+        self.avg_ms    = 0.0     # media mobile esponenziale
+        self.last_size = 0
+        self.last_seq  = 0       # ultimo frame di cattura pubblicato
+
+    @classmethod
+    def key(cls, quality: int, scale: float):
+        """Normalizza i parametri richiesti: qualità a passi di 5, scala fissa."""
+        quality = max(10, min(95, int(round(quality / 5.0)) * 5))
+        scale   = min(cls.SCALES, key=lambda s: abs(s - scale))
+        return quality, scale
+
+    def record(self, ms: float, size: int):
+        self.frames   += 1
+        self.last_ms   = ms
+        self.avg_ms    = ms if self.frames == 1 else 0.9 * self.avg_ms + 0.1 * ms
+        self.last_size = size
+
+    def metrics(self) -> dict:
+        return {
+            "quality":       self.quality,
+            "scale":         self.scale,
+            "viewers":       self.viewers,
+            "frames":        self.frames,
+            "encode_ms":     round(self.last_ms, 2),
+            "encode_ms_avg": round(self.avg_ms, 2),
+            "frame_bytes":   self.last_size,
+        }
+
+
+# ─── Pipeline cattura → overlay/encode ────────────────────────────────────────
+
+class FrameSlot:
+    """
+    Coda a un solo posto tra due stadi della pipeline. put() non blocca mai:
+    se il frame precedente non è ancora stato preso viene sostituito (e
+    contato come scartato), così lo stadio lento lavora sempre sul frame
+    più recente invece di accumulare ritardo.
+    """
+
+    def __init__(self):
+        self._cond    = Condition()
+        self._item    = None
+        self._closed  = False
+        self.dropped  = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout: float = 1.0):
+        """Prende il frame in attesa; None su timeout o chiusura."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._item is not None or self._closed, timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class StageStats:
+    """Tempi di uno stadio della pipeline: ultimo, media mobile, massimo."""
+
+    __slots__ = ("count", "last_ms", "avg_ms", "max_ms")
+
+    def __init__(self):
+        self.count   = 0
+        self.last_ms = 0.0
+        self.avg_ms  = 0.0
+        self.max_ms  = 0.0
+
+    def record(self, ms: float):
+        self.count  += 1
+        self.last_ms = ms
+        self.avg_ms  = ms if self.count == 1 else 0.9 * self.avg_ms + 0.1 * ms
+        self.max_ms  = max(self.max_ms, ms)
+
+    def metrics(self) -> dict:
+        return {"count":  self.count,
+                "ms":     round(self.last_ms, 2),
+                "ms_avg": round(self.avg_ms, 2),
+                "ms_max": round(self.max_ms, 2)}
+
+
 # ─── Streaming webcam USB ─────────────────────────────────────────────────────
 
 class WebcamStreamer:
@@ -93,83 +395,289 @@ class WebcamStreamer:
         "stop":     (100, 100, 100),
     }
 
-    def __init__(self, cam_index=0, width=640, height=480, fps=30, quality=70):
+    STAGES = ("capture", "queue", "overlay", "encode", "total")
+
+    def __init__(self, cam_index=0, width=640, height=480, fps=30, quality=70,
+                 encoder="auto", max_tiers=4, passthrough=False, workers=2):
         """
-        quality: 65-80 è il range ideale — buona qualità per il QR decoder,
-                 stream fluido senza saturare la rete Wi-Fi del Pi.
+        quality:     65-80 è il range ideale — buona qualità per il QR decoder,
+                     stream fluido senza saturare la rete Wi-Fi del Pi.
+        encoder:     "auto" | "opencv" | "turbojpeg"
+        max_tiers:   numero massimo di varianti (qualità, scala) codificate
+                     in parallelo, compresa quella di default.
+        passthrough: inoltra il JPEG prodotto dalla webcam (MJPEG nativo V4L2)
+                     senza decodifica né ricompressione. La freccia di
+                     direzione la disegna il client; il comando corrente
+                     viaggia nell'header X-Robot-Action di ogni frame.
+        workers:     thread di overlay + encode. La cattura del frame N+1
+                     procede mentre i worker codificano il frame N.
         """
         self._cam_index = cam_index
         self._width     = width
         self._height    = height
         self._fps       = fps
         self._quality   = quality
-        self._frame     = None
-        self._lock      = Lock()
+        self._enc_name  = encoder
+        self._encoder   = None
+        self._max_tiers = max_tiers
+        self._default   = StreamTier(quality, 1.0)
+        self._tiers     = {(quality, 1.0): self._default}
+        self._tiers_lock = Lock()
+        self._passthrough = passthrough
         self._running   = False
         self._action    = "stop"
         self._thread    = None
+        self._workers   = []
+        self._n_workers = max(1, workers)
+        self._slot      = FrameSlot()      # cattura → worker
+        self._pub_lock  = Lock()           # ordine di pubblicazione tra i worker
+        self._stages    = {name: StageStats() for name in self.STAGES}
+        self._captured  = 0
+        self._late      = 0                # frame finiti dopo uno più recente
 
     def start(self):
         if not HAS_CV2:
             logger.warning("OpenCV non disponibile — stream disabilitato")
             return
+        self._encoder = make_encoder(self._enc_name)
         self._running = True
         self._thread  = threading.Thread(target=self._capture_loop, daemon=True)
         self._thread.start()
+        self._workers = [threading.Thread(target=self._encode_loop, daemon=True,
+                                          name=f"encode-{i}")
+                         for i in range(self._n_workers)]
+        for w in self._workers:
+            w.start()
         logger.info(f"Webcam stream avviato (indice={self._cam_index}, "
-                    f"{self._width}x{self._height} @{self._fps}fps)")
+                    f"{self._width}x{self._height} @{self._fps}fps, "
+                    f"encoder={self._encoder.name}, worker={self._n_workers})")
 
     def stop(self):
         self._running = False
+        self._slot.close()
+        with self._tiers_lock:
+            for tier in self._tiers.values():
+                tier.hub.close()
 
     def set_action(self, action: str):
         self._action = action
 
-    # ── Loop di cattura ───────────────────────────────────────────────────────
-
-    def _capture_loop(self):
-        cap = cv2.VideoCapture(self._cam_index)
+    # ── Pipeline: cattura → overlay/encode → pubblicazione ───────────────────
+    #
+    # Il thread di cattura fa solo cap.read() e mette il frame nello slot;
+    # i worker disegnano l'overlay, codificano i tier e pubblicano. Se i
+    # worker sono indietro, lo slot tiene solo il frame più recente.
+
+    def _open_capture(self, passthrough: bool):
+        if passthrough:
+            # Backend V4L2 esplicito: è quello che rispetta CONVERT_RGB=0
+            cap = cv2.VideoCapture(self._cam_index, cv2.CAP_V4L2)
+        else:
+            cap = cv2.VideoCapture(self._cam_index)
         if not cap.isOpened():
-            logger.error(f"Impossibile aprire webcam {self._cam_index}. "
-                         f"Prova --cam 1 o controlla 'ls /dev/video*'")
-            self._running = False
-            return
+            return None
 
+        if passthrough:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
         cap.set(cv2.CAP_PROP_FRAME_WIDTH,  self._width)
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self._height)
         cap.set(cv2.CAP_PROP_FPS,          self._fps)
         cap.set(cv2.CAP_PROP_BUFFERSIZE,   1)   # buffer minimo = latenza minima
+        if passthrough:
+            # read() restituisce il buffer JPEG grezzo invece dell'immagine BGR
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        return cap
+
+    @staticmethod
+    def _is_jpeg(buf) -> bool:
+        """True se read() ha restituito un buffer JPEG grezzo (1×N uint8)."""
+        return (buf is not None and buf.dtype == np.uint8 and buf.size > 4
+                and (buf.ndim == 1 or buf.shape[0] == 1)
+                and buf.flat[0] == 0xFF and buf.flat[1] == 0xD8)
+
+    def _capture_loop(self):
+        cap = self._open_capture(self._passthrough)
+        if cap is not None and self._passthrough:
+            ret, probe = cap.read()
+            if not (ret and self._is_jpeg(probe)):
+                logger.warning("La webcam non fornisce MJPEG nativo — "
+                               "passthrough disattivato, uso decode + encode")
+                cap.release()
+                self._passthrough = False
+                cap = self._open_capture(False)
+        if cap is None:
+            logger.error(f"Impossibile aprire webcam {self._cam_index}. "
+                         f"Prova --cam 1 o controlla 'ls /dev/video*'")
+            self._running = False
+            return
 
         logger.info(f"Webcam aperta: {int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x"
                     f"{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))} "
-                    f"@{int(cap.get(cv2.CAP_PROP_FPS))}fps")
+                    f"@{int(cap.get(cv2.CAP_PROP_FPS))}fps"
+                    f"{' (MJPEG passthrough)' if self._passthrough else ''}")
 
         while self._running:
+            t0 = time.perf_counter()
             ret, frame = cap.read()
             if not ret:
                 logger.warning("Lettura webcam fallita — riprovo...")
                 time.sleep(0.1)
                 continue
-
-            # Sovrapponi freccia e info
-            self._draw_overlay(frame)
-
-            # Comprimi in JPEG
-            ok, buf = cv2.imencode(
-                ".jpg", frame,
-                [cv2.IMWRITE_JPEG_QUALITY, self._quality])
-            if ok:
-                with self._lock:
-                    self._frame = buf.tobytes()
+            t1 = time.perf_counter()
+            self._stages["capture"].record((t1 - t0) * 1000.0)
+            self._captured += 1
+            # Intestazioni della parte MJPEG: istante di cattura (orologio di
+            # sistema, confrontabile col client) e numero del frame
+            headers = {"X-Robot-Action": self._action,
+                       "X-Frame-Seq":    self._captured,
+                       "X-Frame-Time":   f"{time.time():.6f}"}
+            self._slot.put((self._captured, t1, headers, frame))
 
         cap.release()
         logger.info("Webcam rilasciata.")
 
+    def _encode_loop(self):
+        while self._running:
+            item = self._slot.get(timeout=0.5)
+            if item is None:
+                continue
+            seq, t_cap, headers, frame = item
+            t0 = time.perf_counter()
+            self._stages["queue"].record((t0 - t_cap) * 1000.0)
+
+            with self._tiers_lock:
+                tiers = list(self._tiers.values())
+
+            if self._passthrough:
+                self._publish_passthrough(frame, tiers, seq, headers)
+            else:
+                # Sovrapponi freccia e info
+                self._draw_overlay(frame, headers["X-Robot-Action"])
+                t1 = time.perf_counter()
+                self._stages["overlay"].record((t1 - t0) * 1000.0)
+                # Comprimi in JPEG una volta per ogni tier richiesto dai client
+                self._encode_tiers(frame, tiers, seq, headers)
+                self._stages["encode"].record((time.perf_counter() - t1) * 1000.0)
+            self._stages["total"].record((time.perf_counter() - t_cap) * 1000.0)
+
+    def _publish_passthrough(self, raw, tiers, seq: int, headers: dict):
+        """
+        Pubblica il JPEG della webcam così com'è sul tier di default.
+        Solo se qualcuno chiede un tier diverso il frame viene decodificato
+        (una volta) e ricompresso per quei tier.
+        """
+        t0   = time.perf_counter()
+        jpeg = raw.tobytes()
+        self._publish(self._default, seq, (time.perf_counter() - t0) * 1000.0,
+                      MjpegFrame(jpeg, headers))
+
+        others = [t for t in tiers if t is not self._default]
+        if others:
+            t1  = time.perf_counter()
+            img = cv2.imdecode(raw.reshape(-1), cv2.IMREAD_COLOR)
+            if img is not None:
+                self._encode_tiers(img, others, seq, headers)
+            self._stages["encode"].record((time.perf_counter() - t1) * 1000.0)
+
+    def _encode_tiers(self, frame, tiers, seq: int, headers: dict = None):
+        scaled = {1.0: frame}
+        for tier in tiers:
+            img = scaled.get(tier.scale)
+            if img is None:
+                img = cv2.resize(frame, None, fx=tier.scale, fy=tier.scale,
+                                 interpolation=cv2.INTER_AREA)
+                scaled[tier.scale] = img
+            self._encode_tier(img, tier, seq, headers)
+
+    def _encode_tier(self, img, tier: StreamTier, seq: int, headers: dict = None):
+        t0   = time.perf_counter()
+        jpeg = self._encoder.encode(img, tier.quality)
+        if jpeg is None:
+            return
+        self._publish(tier, seq, (time.perf_counter() - t0) * 1000.0,
+                      MjpegFrame(jpeg, headers))
+
+    def _publish(self, tier: StreamTier, seq: int, ms: float, frame: MjpegFrame):
+        """
+        Con più worker un frame può finire dopo uno più recente:
+        in quel caso viene scartato invece di far tornare indietro lo stream.
+        """
+        with self._pub_lock:
+            if seq <= tier.last_seq:
+                self._late += 1
+                return
+            tier.last_seq = seq
+            tier.record(ms, len(frame.jpeg))
+        tier.hub.publish(frame)
+
+    # ── Gestione tier ─────────────────────────────────────────────────────────
+
+    def acquire_tier(self, quality=None, scale=None,
+                     max_viewers: Optional[int] = None) -> Optional[StreamTier]:
+        """
+        Registra un viewer sul tier richiesto, creandolo se serve.
+        Senza parametri (o oltre max_tiers) si usa il tier di default.
+        Con max_viewers il posto è riservato atomicamente: None se sono
+        già tutti occupati.
+        """
+        if quality is None and scale is None:
+            key = (self._default.quality, self._default.scale)
+        else:
+            key = StreamTier.key(self._quality if quality is None else quality,
+                                 1.0 if scale is None else scale)
+        with self._tiers_lock:
+            if max_viewers is not None and \
+                    sum(t.viewers for t in self._tiers.values()) >= max_viewers:
+                return None
+            tier = self._tiers.get(key)
+            if tier is None:
+                if len(self._tiers) >= self._max_tiers:
+                    logger.warning(f"Troppi tier attivi — /stream q={key[0]} "
+                                   f"scala={key[1]} servito col tier di default")
+                    tier = self._default
+                else:
+                    tier = StreamTier(*key)
+                    self._tiers[key] = tier
+            tier.viewers += 1
+            return tier
+
+    def release_tier(self, tier: StreamTier):
+        """Toglie un viewer; un tier non di default senza viewer smette di essere codificato."""
+        with self._tiers_lock:
+            tier.viewers -= 1
+            if tier.viewers <= 0 and tier is not self._default:
+                self._tiers.pop((tier.quality, tier.scale), None)
+                tier.hub.close()
+
+    def metrics(self) -> dict:
+        with self._tiers_lock:
+            tiers = [t.metrics() for t in self._tiers.values()]
+        return {
+            "encoder": self._encoder.name if self._encoder else None,
+            "capture": "passthrough" if self._passthrough else "decode",
+            "tiers":   tiers,
+            "pipeline": self.pipeline_metrics(),
+        }
+
+    def pipeline_metrics(self) -> dict:
+        """
+        Tempi per stadio (ms): capture = attesa di cap.read(), queue = attesa
+        nello slot prima di un worker, overlay, encode = tutti i tier del
+        frame, total = dalla cattura alla pubblicazione.
+        """
+        return {
+            "workers":  self._n_workers,
+            "captured": self._captured,
+            "dropped":  self._slot.dropped,
+            "late":     self._late,
+            "stages":   {name: s.metrics() for name, s in self._stages.items()},
+        }
+
     # ── Overlay direzione ─────────────────────────────────────────────────────
 
-    def _draw_overlay(self, frame):
+    def _draw_overlay(self, frame, action: str = None):
         h, w   = frame.shape[:2]
-        action = self._action
+        action = action or self._action
         color  = self.ACTION_COLOR.get(action, (200, 200, 200))
         cx, cy = w // 2, h // 2
         s      = min(w, h) // 5   # dimensione freccia proporzionale al frame
@@ -200,37 +708,161 @@ class WebcamStreamer:
     # ── MJPEG generator per Flask ─────────────────────────────────────────────
 
     def get_frame(self):
-        with self._lock:
-            return self._frame
+        return self._default.hub.latest()[1]
 
-    def mjpeg_generator(self):
+    def mjpeg_generator(self, tier: StreamTier) -> "MjpegViewer":
         """
-        Genera frames MJPEG il più velocemente possibile.
-        Non usa sleep fisso: aspetta solo il tempo necessario per avere
-        un frame nuovo, riducendo la latenza al minimo.
+        Corpo di /stream per un viewer già registrato con acquire_tier():
+        il posto viene liberato a fine stream o alla chiusura della
+        risposta, anche se il server la chiude prima di iniziare a leggerla.
         """
-        last_frame = None
-        min_delay  = 1.0 / (self._fps * 2)   # polling massimo al doppio degli fps
-        while True:
-            frame = self.get_frame()
-            if frame and frame is not last_frame:
-                last_frame = frame
-                yield (b"--frame\r\n"
-                       b"Content-Type: image/jpeg\r\n"
-                       b"Content-Length: " + str(len(frame)).encode() + b"\r\n"
-                       b"\r\n" + frame + b"\r\n")
-            else:
-                time.sleep(min_delay)
+        return MjpegViewer(self, tier)
 
     @property
     def is_active(self) -> bool:
-        return self._running and self._frame is not None
+        return self._running and self.get_frame() is not None
+
+    @property
+    def viewers(self) -> int:
+        with self._tiers_lock:
+            return sum(t.viewers for t in self._tiers.values())
+
+    @property
+    def overlay_on_server(self) -> bool:
+        """False in passthrough: la freccia va disegnata dal client."""
+        return not self._passthrough
+
+
+class MjpegViewer:
+    """
+    Genera frames MJPEG appena il thread di cattura ne pubblica uno.
+    Nessun polling: il client resta bloccato sulla Condition dell'hub
+    e viene svegliato dal publish(). Se il client è più lento della
+    camera i frame intermedi vengono saltati (si invia sempre l'ultimo).
+    Le parti del frame vengono cedute separatamente: il server le scrive
+    una dopo l'altra sul socket senza ricopiare il JPEG.
+    close() (chiamato dal server WSGI) rilascia il tier una volta sola.
+    """
+
+    def __init__(self, streamer: "WebcamStreamer", tier: StreamTier):
+        self._streamer = streamer
+        self._tier     = tier
+        self._lock     = Lock()
+        self._open     = True
+
+    def __iter__(self):
+        hub, last_seq = self._tier.hub, 0
+        try:
+            while not hub.closed:
+                # Timeout solo per accorgersi dello stop del server
+                seq, frame = hub.wait_next(last_seq, timeout=1.0)
+                if frame is None or seq == last_seq:
+                    continue
+                last_seq = seq
+                yield from frame.parts
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if not self._open:
+                return
+            self._open = False
+        self._streamer.release_tier(self._tier)
+
+
+# ─── Watchdog ──────────────────────────────────────────────────────────────────
+
+class Watchdog:
+    """
+    Un solo thread per tutta la vita del server, con scadenza su
+    time.monotonic(). Ogni comando sposta solo la scadenza (arm): nessun
+    thread creato o cancellato per comando. Il thread viene svegliato solo
+    se la nuova scadenza è più vicina di quella che sta già aspettando.
+    """
+
+    def __init__(self, on_trip, default_sec=1.0, per_azione: dict = None):
+        """
+        per_azione: timeout specifici, es. {"avanti": 0.6}; None come valore
+                    = quell'azione non arma il watchdog (default: "stop").
+        """
+        self._on_trip    = on_trip
+        self._default    = default_sec
+        self._per_azione = {"stop": None}
+        self._per_azione.update(per_azione or {})
+        self._cond       = Condition()
+        self._deadline   = None
+        self._running    = True
+        self.arms        = 0
+        self.trips       = 0
+        self.last_trip   = None   # monotonic dell'ultimo intervento
+        self.last_late_ms = 0.0   # ritardo dell'intervento rispetto alla scadenza
+        self.max_late_ms  = 0.0
+        self._thread     = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def timeout_for(self, azione) -> Optional[float]:
+        return self._per_azione.get(azione, self._default)
+
+    def arm(self, azione=None, min_sec=0.0):
+        """Riarma per il timeout dell'azione (almeno min_sec secondi)."""
+        timeout = self.timeout_for(azione)
+        if timeout is None:
+            self.disarm()
+            return
+        deadline = time.monotonic() + max(timeout, min_sec)
+        with self._cond:
+            self.arms += 1
+            earlier = self._deadline is None or deadline < self._deadline
+            self._deadline = deadline
+            if earlier:
+                self._cond.notify()
+
+    def disarm(self):
+        with self._cond:
+            self._deadline = None
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                if now < self._deadline:
+                    self._cond.wait(self._deadline - now)
+                    continue
+                late_ms = (now - self._deadline) * 1000.0
+                self._deadline    = None
+                self.trips       += 1
+                self.last_trip    = now
+                self.last_late_ms = late_ms
+                self.max_late_ms  = max(self.max_late_ms, late_ms)
+            # Fuori dal lock: on_trip ferma i motori e può prendere altri lock
+            self._on_trip()
+
+    def metrics(self) -> dict:
+        return {
+            "timeout_sec":  self._default,
+            "per_azione":   self._per_azione,
+            "arms":         self.arms,
+            "trips":        self.trips,
+            "last_late_ms": round(self.last_late_ms, 2),
+            "max_late_ms":  round(self.max_late_ms, 2),
+        }
 
 
 # ─── Driver motori ─────────────────────────────────────────────────────────────
 
 class AlphaBot:
-    def __init__(self, pwm_freq=500):
+    def __init__(self, pwm_freq=500, watchdog_sec=1.0, watchdog_azioni=None):
         GPIO.setmode(GPIO.BCM)
         for pin in (AIN1, AIN2, PWMA, BIN1, BIN2, PWMB):
             GPIO.setup(pin, GPIO.OUT)
@@ -240,9 +872,9 @@ class AlphaBot:
         self._pwm_a.start(0)
         self._pwm_b.start(0)
         self._stato           = "stop"
-        self._watchdog_sec    = 1.0
-        self._watchdog: Timer = None
-        self._avvia_watchdog()
+        self._watchdog        = Watchdog(self._watchdog_scattato,
+                                         watchdog_sec, watchdog_azioni)
+        self._motion          = MotionExecutor(self)
 
     def _motore_sx(self, speed, avanti):
         dc = min(100, speed * 100 // 255)
@@ -257,12 +889,33 @@ class AlphaBot:
         self._pwm_b.ChangeDutyCycle(dc)
 
     def stop(self):
+        self._motion.cancel()
+        self._ferma()
+
+    def _ferma(self):
         self._pwm_a.ChangeDutyCycle(0)
         self._pwm_b.ChangeDutyCycle(0)
         for pin in (AIN1, AIN2, BIN1, BIN2):
             GPIO.output(pin, GPIO.LOW)
         self._stato = "stop"
 
+    def motori(self, sx, dx, stato="setpoint", durata=0.0):
+        """
+        Velocità dirette delle due ruote (-255..255, positivo = in avanti
+        per il robot), già compensate per il cablaggio dei motori.
+        Riarma il watchdog per almeno `durata` secondi (None = non lo tocca).
+        """
+        if durata is not None:
+            self._watchdog.arm(stato, durata)
+        if sx == 0 and dx == 0:
+            self._ferma()
+        else:
+            self._motore_sx(min(255, abs(sx)), sx >= 0)
+            self._motore_dx(min(255, abs(dx)), dx < 0)
+        self._stato = stato
+        if camera:
+            camera.set_action(stato)
+
     def avanti(self, speed=180):
         self._motore_sx(speed, False); self._motore_dx(speed, False)
         self._stato = "avanti"
@@ -280,8 +933,9 @@ class AlphaBot:
         self._stato = "destra"
 
     def esegui(self, azione, speed):
-        self._avvia_watchdog()
+        self._motion.cancel()
         azione = azione.lower()
+        self._watchdog.arm(azione)
         if   azione == "avanti":   self.sinistra(speed)
         elif azione == "indietro": self.destra(speed)
         elif azione == "sinistra": self.avanti(speed)
@@ -290,12 +944,28 @@ class AlphaBot:
         if camera:
             camera.set_action(azione)
 
-    def _avvia_watchdog(self):
-        if self._watchdog:
-            self._watchdog.cancel()
-        self._watchdog = Timer(self._watchdog_sec, self._watchdog_scattato)
-        self._watchdog.daemon = True
-        self._watchdog.start()
+    def esegui_sequenza(self, setpoints):
+        """Avvia una sequenza di Setpoint, interrompendo quella in corso."""
+        self._motion.run(setpoints)
+
+    def esegui_passi(self, direzione, speed, durata, pausa, count=0):
+        """
+        Rotazione a scatti temporizzata sul Pi. Lo stesso comando ripetuto
+        (keepalive del client) non riavvia il ciclo: riarma solo il watchdog,
+        che resta l'unico a tenere vivi i passi infiniti (count=0).
+        """
+        self._watchdog.arm(direzione)
+        key = (direzione, speed, durata, pausa, count)
+        if self._motion.is_running(key):
+            return
+        self._motion.run(passi_setpoint(direzione, speed, durata, pausa, count),
+                         rearm=False, key=key)
+
+    def misure_impulsi(self) -> dict:
+        return self._motion.misure()
+
+    def watchdog_metrics(self) -> dict:
+        return self._watchdog.metrics()
 
     def _watchdog_scattato(self):
         logger.warning("[WATCHDOG] Nessun comando — robot fermato")
@@ -305,13 +975,167 @@ class AlphaBot:
 
     def cleanup(self):
         self.stop()
-        if self._watchdog:
-            self._watchdog.cancel()
+        self._motion.close()
+        self._watchdog.close()
         self._pwm_a.stop()
         self._pwm_b.stop()
         GPIO.cleanup()
 
 
+# ─── Sequenze di setpoint ─────────────────────────────────────────────────────
+
+class Setpoint:
+    """Un passo di una sequenza: velocità ruote per una durata."""
+
+    __slots__ = ("azione", "sx", "dx", "durata")
+
+    def __init__(self, azione: str, sx: int, dx: int, durata: float):
+        self.azione = azione
+        self.sx     = sx
+        self.dx     = dx
+        self.durata = durata      # secondi
+
+
+# Verso delle ruote (sx, dx) per ogni azione, positivo = avanti
+WHEEL_DIR = {"avanti": (1, 1), "indietro": (-1, -1),
+             "sinistra": (-1, 1), "destra": (1, -1), "stop": (0, 0)}
+
+
+def passi_setpoint(direzione, speed, durata, pausa, count=0):
+    """
+    Rotazione a scatti: impulso di `durata` s e pausa di `pausa` s,
+    ripetuti `count` volte (0 = finché non arriva un altro comando).
+    """
+    sx, dx = WHEEL_DIR[direzione]
+    n = 0
+    while count == 0 or n < count:
+        yield Setpoint(direzione, sx * speed, dx * speed, durata)
+        yield Setpoint("stop", 0, 0, pausa)
+        n += 1
+
+
+class MotionExecutor:
+    """
+    Esegue sul Pi sequenze di Setpoint con temporizzazione locale: le
+    scadenze sono calcolate tutte dall'istante di partenza, quindi il jitter
+    di rete non entra nella durata dei singoli impulsi e gli errori non si
+    accumulano. Un nuovo comando o uno stop interrompono la sequenza.
+    Alla fine della sequenza i motori vengono fermati.
+
+    L'attesa è ibrida: Condition.wait (interrompibile, niente CPU) fino a
+    SPIN_SEC dalla scadenza, poi busy-wait su perf_counter per la precisione.
+    La durata reale di ogni impulso viene misurata e resa disponibile.
+    """
+
+    SPIN_SEC = 0.002
+
+    def __init__(self, robot):
+        self._robot   = robot
+        self._cond    = Condition()
+        self._queue   = None      # prossima sequenza da eseguire
+        self._gen     = 0         # incrementato da ogni run()/cancel()
+        self._key     = None      # chiave della sequenza in esecuzione
+        self._running = True
+        self._impulsi = deque(maxlen=50)   # (azione, ms richiesti, ms reali)
+        self._thread  = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def run(self, setpoints, rearm=True, key=None):
+        """
+        setpoints: iterabile di Setpoint (anche un generatore infinito).
+        rearm:     se True ogni setpoint riarma il watchdog per la sua durata;
+                   False per le sequenze infinite, che restano vive solo
+                   finché il client continua a mandare comandi.
+        key:       identifica la sequenza per is_running().
+        """
+        with self._cond:
+            self._gen  += 1
+            self._key   = key
+            self._queue = (self._gen, iter(setpoints), rearm)
+            self._cond.notify_all()
+
+    def is_running(self, key) -> bool:
+        with self._cond:
+            return key is not None and self._key == key
+
+    def cancel(self):
+        with self._cond:
+            self._gen  += 1
+            self._key   = None
+            self._queue = None
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._gen    += 1
+            self._cond.notify_all()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or not self._running)
+                if not self._running:
+                    return
+                gen, setpoints, rearm = self._queue
+                self._queue = None
+            self._execute(gen, setpoints, rearm)
+            with self._cond:
+                if self._gen == gen:
+                    self._key = None
+
+    def _execute(self, gen, setpoints, rearm):
+        prev = t_prev = None
+        deadline = time.perf_counter()
+        for sp in setpoints:
+            with self._cond:
+                # Controllo e comando motori sotto lock: dopo cancel()
+                # nessun setpoint vecchio può più toccare i motori
+                if self._gen != gen:
+                    return
+                self._robot.motori(sp.sx, sp.dx, sp.azione,
+                                   sp.durata if rearm else None)
+                now = time.perf_counter()
+            self._misura(prev, t_prev, now)
+            prev, t_prev = sp, now
+            deadline += sp.durata
+            if not self._attendi(deadline, gen):
+                return
+        with self._cond:
+            if self._gen != gen:
+                return
+            self._robot.motori(0, 0, "stop")
+            now = time.perf_counter()
+        self._misura(prev, t_prev, now)
+
+    def _attendi(self, deadline, gen) -> bool:
+        """Attende fino a deadline (perf_counter); False se la sequenza è stata annullata."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._gen != gen,
+                                deadline - self.SPIN_SEC - time.perf_counter())
+            if self._gen != gen:
+                return False
+        while time.perf_counter() < deadline:
+            pass
+        return True
+
+    def _misura(self, sp, t_start, t_end):
+        if sp is not None and (sp.sx or sp.dx):
+            self._impulsi.append((sp.azione, sp.durata * 1000.0,
+                                  (t_end - t_start) * 1000.0))
+
+    def misure(self) -> dict:
+        """Durate reali degli ultimi impulsi motore."""
+        impulsi = list(self._impulsi)
+        errori  = [abs(reale - chiesto) for _, chiesto, reale in impulsi]
+        return {
+            "ultimi_ms":     [round(reale, 2) for _, _, reale in impulsi[-10:]],
+            "richiesti_ms":  [round(chiesto, 2) for _, chiesto, _ in impulsi[-10:]],
+            "errore_medio_ms": round(sum(errori) / len(errori), 3) if errori else None,
+            "errore_max_ms":   round(max(errori), 3) if errori else None,
+        }
+
+
 # ─── Flask ────────────────────────────────────────────────────────────────────
 
 logging.basicConfig(level=logging.INFO,
@@ -321,66 +1145,671 @@ logger = logging.getLogger("alphabot")
 app    = Flask(__name__)
 robot:  AlphaBot       = None
 camera: WebcamStreamer = None
+udp_channel: "CommandChannel" = None
 
 AZIONI_VALIDE = {"avanti", "indietro", "sinistra", "destra", "stop"}
+AZIONI_PASSI  = {"step_sinistra": "sinistra", "step_destra": "destra"}
 
+# Default degli scatti di rotazione (ms), se il client non li specifica,
+# e limiti applicati sia a /command sia ai pacchetti UDP_STEP
+STEP_DURATA_MS = 80
+STEP_PAUSA_MS  = 120
+STEP_MAX_MS    = 2000
 
-@app.route("/ping")
-def ping():
-    return jsonify({
+
+def limita_passi(durata: int, pausa: int, count: int) -> tuple:
+    """Impulso 1..STEP_MAX_MS, pausa 0..STEP_MAX_MS, count ≥ 0 (ms)."""
+    return (max(1, min(STEP_MAX_MS, durata)), max(0, min(STEP_MAX_MS, pausa)),
+            max(0, count))
+
+
+# Parametri dello stream (impostati da main)
+MAX_VIEWERS = 8
+SERVER_MODE = "thread"
+
+STREAM_MIMETYPE = "multipart/x-mixed-replace; boundary=" + MjpegFrame.BOUNDARY.decode()
+STREAM_HEADERS  = {
+    "Cache-Control": "no-cache, no-store, must-revalidate",
+    "Pragma":        "no-cache",
+    "Expires":       "0",
+}
+
+
+# ── Logica degli endpoint (condivisa da Flask e dalla modalità ASGI) ─────────
+
+def info_ping() -> dict:
+    return {
         "status": "ok",
         "on_pi":  ON_PI,
         "camera": HAS_CV2 and camera is not None and camera.is_active,
-    })
+        "overlay_server": camera is None or camera.overlay_on_server,
+        "udp_port": udp_channel.port if udp_channel else None,
+        "batch":    True,
+        "passi":    True,
+        "time":     time.time(),   # per stimare l'offset tra gli orologi
+    }
 
 
-@app.route("/command", methods=["POST"])
-def command():
-    data   = request.get_json(silent=True)
+def _intero(data: dict, nome: str, default: int) -> int:
+    """Campo intero di un comando JSON; ValueError con un messaggio leggibile."""
+    valore = data.get(nome, default)
+    if isinstance(valore, bool):
+        raise ValueError(f"'{nome}' deve essere un intero, non {valore!r}")
+    try:
+        return int(valore)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"'{nome}' deve essere un intero, non {valore!r}") from None
+
+
+def esegui_comando(data) -> tuple:
+    """Comando JSON di /command. Ritorna (risposta, status HTTP)."""
     if not data:
-        return jsonify({"errore": "Nessun JSON"}), 400
+        return {"errore": "Nessun JSON"}, 400
+    if not isinstance(data, dict):
+        return {"errore": "Il comando deve essere un oggetto JSON"}, 400
     azione = str(data.get("action", "stop")).lower()
-    speed  = max(0, min(255, int(data.get("speed", 180))))
+    try:
+        speed = max(0, min(255, _intero(data, "speed", 180)))
+        if azione in AZIONI_PASSI:
+            durata, pausa, count = limita_passi(_intero(data, "durata", STEP_DURATA_MS),
+                                                _intero(data, "pausa",  STEP_PAUSA_MS),
+                                                _intero(data, "count",  0))
+    except ValueError as e:
+        return {"errore": str(e)}, 400
+    if azione in AZIONI_PASSI:
+        robot.esegui_passi(AZIONI_PASSI[azione], speed,
+                           durata / 1000.0, pausa / 1000.0, count)
+        return {"status": "ok", "azione": azione,
+                "impulsi": robot.misure_impulsi()}, 200
     if azione not in AZIONI_VALIDE:
-        return jsonify({"errore": f"Azione '{azione}' non valida"}), 400
+        return {"errore": f"Azione '{azione}' non valida"}, 400
     logger.info(f"► {azione.upper():<10}  vel={speed}")
     robot.esegui(azione, speed)
-    return jsonify({"status": "ok", "azione": azione})
+    return {"status": "ok", "azione": azione}, 200
 
 
-@app.route("/stop")
-def emergency_stop():
+def stop_emergenza() -> dict:
     robot.stop()
     if camera:
         camera.set_action("stop")
     logger.info("⚠ STOP EMERGENZA")
-    return jsonify({"status": "fermato"})
+    return {"status": "fermato"}
+
+
+def info_stato() -> dict:
+    return {"azione_corrente": robot._stato, "on_pi": ON_PI,
+            "impulsi": robot.misure_impulsi()}
+
+
+def info_metrics() -> dict:
+    return {
+        "camera": camera.metrics() if camera else None,
+        "udp":    udp_channel.metrics() if udp_channel else None,
+        "impulsi": robot.misure_impulsi() if robot else None,
+        "watchdog": robot.watchdog_metrics() if robot else None,
+        "server": {
+            "mode":        SERVER_MODE,
+            "threads":     threading.active_count(),
+            "cpu_s":       round(time.process_time(), 3),
+            "viewers":     camera.viewers if camera else 0,
+            "max_viewers": MAX_VIEWERS,
+        },
+    }
+
+
+def info_pipeline():
+    """(risposta, status): 503 senza camera, come /stream."""
+    if camera is None:
+        return {"errore": "Camera non disponibile"}, 503
+    return camera.pipeline_metrics(), 200
+
+
+def riserva_viewer(quality=None, scale=None):
+    """
+    (tier, None) col posto del viewer già riservato, oppure (None, (errore,
+    status)) se la camera manca o i MAX_VIEWERS posti sono occupati.
+    """
+    if not HAS_CV2 or camera is None:
+        return None, ({"errore": "Camera non disponibile"}, 503)
+    tier = camera.acquire_tier(quality, scale, MAX_VIEWERS)
+    if tier is None:
+        return None, ({"errore": f"Troppi viewer ({MAX_VIEWERS} max)"}, 503)
+    return tier, None
+
+
+# ── Route Flask ──────────────────────────────────────────────────────────────
+
+@app.route("/ping")
+def ping():
+    return jsonify(info_ping())
+
+
+@app.route("/command", methods=["POST"])
+def command():
+    if request.mimetype == "application/octet-stream":
+        # Sequenza binaria (stesso formato del datagramma UDP_BATCH)
+        reply, status = udp_channel_handle(request.get_data(), request.remote_addr,
+                                           request.headers.get("X-Command-Session"))
+        return Response(reply, status=status, mimetype="application/octet-stream")
+    risposta, status = esegui_comando(request.get_json(silent=True))
+    return jsonify(risposta), status
+
+
+@app.route("/stop")
+def emergency_stop():
+    return jsonify(stop_emergenza())
 
 
 @app.route("/stato")
 def stato():
-    return jsonify({"azione_corrente": robot._stato, "on_pi": ON_PI})
+    return jsonify(info_stato())
 
 
 @app.route("/stream")
 def stream():
     """MJPEG stream della camera. Apribile anche nel browser."""
-    if not HAS_CV2 or camera is None:
-        return jsonify({"errore": "Camera non disponibile"}), 503
-    resp = Response(
-        camera.mjpeg_generator(),
-        mimetype="multipart/x-mixed-replace; boundary=frame",
-    )
-    resp.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    resp.headers["Pragma"]        = "no-cache"
-    resp.headers["Expires"]       = "0"
+    tier, errore = riserva_viewer(request.args.get("quality", type=int),
+                                  request.args.get("scale",   type=float))
+    if errore:
+        return jsonify(errore[0]), errore[1]
+    resp = Response(camera.mjpeg_generator(tier), mimetype=STREAM_MIMETYPE)
+    for k, v in STREAM_HEADERS.items():
+        resp.headers[k] = v
     return resp
 
 
+@app.route("/metrics")
+def metrics():
+    return jsonify(info_metrics())
+
+
+@app.route("/pipeline")
+def pipeline():
+    risposta, status = info_pipeline()
+    return jsonify(risposta), status
+
+
+# ─── Canale comandi UDP ───────────────────────────────────────────────────────
+#
+# Datagramma (big-endian, 18 byte), uguale per comando e risposta:
+#   magic "AB" | versione u8 | tipo u8 | seq u32 | azione u8 | speed/stato u8 | t_client f64
+# Ogni CMD/PING riceve un ACK con lo stesso seq e t_client: il client misura
+# il round-trip col proprio orologio, senza sincronizzazione.
+#
+# Sequenza di setpoint (UDP_BATCH), per manovre temporizzate sul Pi:
+#   magic "AB" | versione u8 | tipo u8 | seq u32 | n u8 | t_client f64
+#   + n × (azione u8 | vel. sx i16 | vel. dx i16 | durata_ms u16)
+# L'ACK riporta n nel campo azione. Lo stesso payload è accettato anche da
+# POST /command con Content-Type: application/octet-stream; lì i seq sono
+# tenuti per (indirizzo, header X-Command-Session), così un client riavviato
+# con una sessione nuova riparte da seq 1. Risposta: l'ACK, con status 200
+# (OK), 400 (payload malformato o INVALID, senza ACK se illeggibile) o 409 (STALE).
+#
+# Rotazione a scatti (UDP_STEP), equivalente a step_sinistra/step_destra:
+#   magic "AB" | versione u8 | tipo u8 | seq u32 | azione u8 | speed u8
+#   | durata_ms u16 | pausa_ms u16 | count u16 | t_client f64
+
+UDP_MAGIC    = b"AB"
+UDP_VERSION  = 1
+UDP_CMD, UDP_ACK, UDP_PING, UDP_BATCH, UDP_STEP = 1, 2, 3, 4, 5
+UDP_OK, UDP_INVALID, UDP_STALE = 0, 1, 2
+UDP_PACKET   = struct.Struct("!2sBBIBBd")
+UDP_BATCH_HDR = struct.Struct("!2sBBIBd")
+UDP_SETPOINT = struct.Struct("!BhhH")
+UDP_STEP_PKT = struct.Struct("!2sBBIBBHHHd")
+UDP_MAX_DATAGRAM = UDP_BATCH_HDR.size + 255 * UDP_SETPOINT.size
+UDP_REORDER_WINDOW = 1024   # seq più vecchi di così = client riavviato
+UDP_MAX_CLIENTS    = 64     # client/sessioni ricordati, si dimenticano i più vecchi
+HTTP_ACK_STATUS    = {UDP_OK: 200, UDP_INVALID: 400, UDP_STALE: 409}
+
+ACTION_IDS   = {"stop": 0, "avanti": 1, "indietro": 2, "sinistra": 3, "destra": 4}
+ACTION_NAMES = {v: k for k, v in ACTION_IDS.items()}
+
+
+class CommandChannel:
+    """
+    Canale comandi persistente su UDP, affiancato a POST /command.
+    Un solo thread riceve i datagrammi e chiama robot.esegui() senza
+    passare da Flask: niente connessione TCP né parsing JSON per comando.
+    I pacchetti arrivati fuori ordine (seq più vecchio dell'ultimo
+    eseguito) vengono scartati, ma ricevono comunque l'ACK con stato STALE.
+    handle() è chiamato sia dal thread UDP sia dai thread delle richieste
+    HTTP binarie: seq per client e contatori sono protetti da un lock.
+    """
+
+    def __init__(self, host="0.0.0.0", port=5000):
+        self._addr     = (host, port)
+        self._sock     = None
+        self._running  = False
+        self._thread   = None
+        self._last_seq = {}      # indirizzo client → ultimo seq eseguito
+        self._last_cmd = None
+        self._lock     = threading.Lock()
+        self.received  = 0
+        self.stale     = 0
+        self.invalid   = 0
+
+    @property
+    def port(self) -> int:
+        return self._addr[1]
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(self._addr)
+        self._sock.settimeout(1.0)
+        self._running = True
+        self._thread  = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        logger.info(f"Canale comandi UDP su {self._addr[0]}:{self._addr[1]}")
+
+    def stop(self):
+        self._running = False
+        if self._sock:
+            self._sock.close()
+
+    def _loop(self):
+        while self._running:
+            try:
+                data, addr = self._sock.recvfrom(UDP_MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            reply = self.handle(data, addr)
+            if reply:
+                try:
+                    self._sock.sendto(reply, addr)
+                except OSError:
+                    pass
+
+    def handle(self, data: bytes, addr) -> Optional[bytes]:
+        """Elabora un datagramma e ritorna l'ACK da spedire (None = ignora)."""
+        with self._lock:
+            return self._handle(data, addr)
+
+    def _handle(self, data: bytes, addr) -> Optional[bytes]:
+        if len(data) < 4 or data[:2] != UDP_MAGIC or data[2] != UDP_VERSION:
+            self.invalid += 1
+            return None
+        if data[3] == UDP_BATCH:
+            return self._handle_batch(data, addr)
+        if data[3] == UDP_STEP:
+            return self._handle_step(data, addr)
+        if len(data) < UDP_PACKET.size:
+            self.invalid += 1
+            return None
+        magic, ver, typ, seq, act, speed, t_client = UDP_PACKET.unpack_from(data)
+
+        if typ == UDP_PING:
+            status = UDP_OK
+        elif typ == UDP_CMD:
+            self.received += 1
+            azione = ACTION_NAMES.get(act)
+            if azione is None:
+                self.invalid += 1
+                status = UDP_INVALID
+            elif not self._is_newer(addr, seq):
+                self.stale += 1
+                status = UDP_STALE
+            else:
+                if azione != self._last_cmd:
+                    logger.info(f"► {azione.upper():<10}  vel={speed}  (udp)")
+                    self._last_cmd = azione
+                robot.esegui(azione, speed)
+                status = UDP_OK
+        else:
+            self.invalid += 1
+            return None
+        return UDP_PACKET.pack(UDP_MAGIC, UDP_VERSION, UDP_ACK,
+                               seq, act, status, t_client)
+
+    def _handle_batch(self, data: bytes, addr) -> Optional[bytes]:
+        if len(data) < UDP_BATCH_HDR.size:
+            self.invalid += 1
+            return None
+        _, _, _, seq, n, t_client = UDP_BATCH_HDR.unpack_from(data)
+        self.received += 1
+        setpoints = []
+        if len(data) < UDP_BATCH_HDR.size + n * UDP_SETPOINT.size:
+            status = UDP_INVALID
+        else:
+            for act, sx, dx, ms in UDP_SETPOINT.iter_unpack(
+                    data[UDP_BATCH_HDR.size:UDP_BATCH_HDR.size + n * UDP_SETPOINT.size]):
+                setpoints.append(Setpoint(ACTION_NAMES.get(act, "setpoint"),
+                                          max(-255, min(255, sx)),
+                                          max(-255, min(255, dx)),
+                                          ms / 1000.0))
+            status = UDP_OK if self._is_newer(addr, seq) else UDP_STALE
+
+        if status == UDP_OK:
+            logger.info(f"► SEQUENZA   {n} setpoint, "
+                        f"{sum(sp.durata for sp in setpoints) * 1000:.0f} ms")
+            self._last_cmd = None
+            robot.esegui_sequenza(setpoints)
+        elif status == UDP_INVALID:
+            self.invalid += 1
+        else:
+            self.stale += 1
+        return UDP_PACKET.pack(UDP_MAGIC, UDP_VERSION, UDP_ACK,
+                               seq, n, status, t_client)
+
+    def _handle_step(self, data: bytes, addr) -> Optional[bytes]:
+        if len(data) < UDP_STEP_PKT.size:
+            self.invalid += 1
+            return None
+        _, _, _, seq, act, speed, durata, pausa, count, t_client = \
+            UDP_STEP_PKT.unpack_from(data)
+        self.received += 1
+        direzione = ACTION_NAMES.get(act)
+        if direzione not in ("sinistra", "destra") or durata == 0:
+            self.invalid += 1
+            status = UDP_INVALID
+        elif not self._is_newer(addr, seq):
+            self.stale += 1
+            status = UDP_STALE
+        else:
+            durata, pausa, count = limita_passi(durata, pausa, count)
+            cmd = f"step_{direzione}"
+            if cmd != self._last_cmd:
+                logger.info(f"► {cmd.upper():<10}  vel={speed}  "
+                            f"{durata}/{pausa} ms  (udp)")
+                self._last_cmd = cmd
+            robot.esegui_passi(direzione, speed, durata / 1000.0,
+                               pausa / 1000.0, count)
+            status = UDP_OK
+        return UDP_PACKET.pack(UDP_MAGIC, UDP_VERSION, UDP_ACK,
+                               seq, act, status, t_client)
+
+    def _is_newer(self, addr, seq: int) -> bool:
+        last = self._last_seq.get(addr)
+        if last is not None:
+            # Distanza modulo 2^32: tollera il wrap del contatore
+            behind = (last - seq) & 0xFFFFFFFF
+            if behind < UDP_REORDER_WINDOW:
+                return False     # duplicato o fuori ordine
+        # Reinserito in coda: in testa restano i client inattivi da più tempo
+        self._last_seq.pop(addr, None)
+        self._last_seq[addr] = seq
+        if len(self._last_seq) > UDP_MAX_CLIENTS:
+            del self._last_seq[next(iter(self._last_seq))]
+        return True
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "port":     self.port,
+                "received": self.received,
+                "stale":    self.stale,
+                "invalid":  self.invalid,
+                "clients":  len(self._last_seq),
+            }
+
+
+_http_channel = CommandChannel()   # solo parsing, nessun socket
+
+
+def udp_channel_handle(data: bytes, addr, session: Optional[str] = None) -> tuple:
+    """
+    Payload binario ricevuto via HTTP: stesso parser del canale UDP, con i
+    seq tenuti per (indirizzo, sessione). Ritorna (ACK, status HTTP).
+    """
+    reply = (udp_channel or _http_channel).handle(data, (addr, "http", session))
+    if not reply:
+        return b"", 400
+    return reply, HTTP_ACK_STATUS.get(UDP_PACKET.unpack_from(reply)[5], 400)
+
+
+# ─── Modalità asincrona (ASGI) ────────────────────────────────────────────────
+#
+# Stessi endpoint di Flask serviti da un'app ASGI minimale (nessun framework):
+# un solo event loop gestisce tutti i viewer /stream invece di un thread
+# ciascuno. Avvio con --asgi (richiede: pip install uvicorn).
+
+class AsyncFrameFeed:
+    """
+    Ponte FrameHub → asyncio per un viewer. Il thread di cattura chiama
+    on_publish(), che passa il frame all'event loop con call_soon_threadsafe;
+    il viewer attende un asyncio.Event sostituito ad ogni frame.
+    """
+
+    def __init__(self, loop):
+        self._loop  = loop
+        self._event = asyncio.Event()
+        self._seq   = 0
+        self._frame = None
+        self.closed = False
+
+    def on_publish(self, seq, frame):
+        try:
+            self._loop.call_soon_threadsafe(self._set, seq, frame)
+        except RuntimeError:
+            self.closed = True        # event loop già chiuso (spegnimento)
+
+    def _set(self, seq, frame):
+        if frame is None:
+            self.closed = True
+        else:
+            self._seq, self._frame = seq, frame
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait_next(self, last_seq: int, timeout: float):
+        if self._seq == last_seq and not self.closed:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._seq, self._frame
+
+
+ASGI_SEND_TIMEOUT  = 2.0  # un viewer che non smaltisce un frame in 2 s viene chiuso
+ASGI_CLOSE_TIMEOUT = 0.5  # attesa massima per chiudere la risposta di quel viewer
+
+
+async def _asgi_json(send, payload, status=200):
+    body = json.dumps(payload).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _asgi_body(receive) -> bytes:
+    chunks = []
+    while True:
+        msg = await receive()
+        chunks.append(msg.get("body", b""))
+        if not msg.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _asgi_send(send, message, timeout: float) -> bool:
+    """
+    send() con timeout in un task esplicito: allo scadere il task viene
+    cancellato e atteso, così la sua eccezione non resta mai non letta.
+    False se il viewer non ha smaltito il messaggio in tempo.
+    """
+    task = asyncio.ensure_future(send(message))
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if done:
+        task.result()                 # propaga gli errori di send (disconnessione)
+        return True
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return False
+
+
+async def _asgi_stream(scope, receive, send):
+    query = parse_qs(scope.get("query_string", b"").decode())
+    try:
+        quality = int(query["quality"][0]) if "quality" in query else None
+        scale   = float(query["scale"][0]) if "scale" in query else None
+    except ValueError:
+        quality = scale = None
+
+    tier, errore = riserva_viewer(quality, scale)
+    if errore:
+        await _asgi_json(send, *errore)
+        return
+    feed = AsyncFrameFeed(asyncio.get_running_loop())
+    tier.hub.subscribe(feed.on_publish)
+    headers = [(b"content-type", STREAM_MIMETYPE.encode())]
+    headers += [(k.lower().encode(), v.encode()) for k, v in STREAM_HEADERS.items()]
+
+    async def pump():
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        last_seq = 0
+        while not feed.closed:
+            seq, frame = await feed.wait_next(last_seq, timeout=1.0)
+            if frame is None or seq == last_seq:
+                continue
+            last_seq = seq
+            # Backpressure: send() attende che il socket si svuoti; i frame
+            # arrivati nel frattempo vengono saltati (si invia sempre l'ultimo)
+            for part in frame.parts:
+                if not await _asgi_send(send, {"type": "http.response.body", "body": part,
+                                               "more_body": True}, ASGI_SEND_TIMEOUT):
+                    # Parte troncata: si chiude la risposta, il viewer riconnetterà
+                    logger.warning(f"Viewer /stream lento (> {ASGI_SEND_TIMEOUT:.0f} s "
+                                   f"per frame): connessione chiusa")
+                    await _asgi_send(send, {"type": "http.response.body", "body": b"",
+                                            "more_body": False}, ASGI_CLOSE_TIMEOUT)
+                    return
+
+    async def disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks:
+            t.cancel()
+        # Raccoglie anche gli errori (send su socket chiuso) dei task terminati
+        await asyncio.gather(*tasks, return_exceptions=True)
+        tier.hub.unsubscribe(feed.on_publish)
+        camera.release_tier(tier)
+
+
+async def asgi_app(scope, receive, send):
+    """App ASGI con gli stessi endpoint della versione Flask."""
+    if scope["type"] == "lifespan":
+        while True:
+            msg = await receive()
+            if msg["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif msg["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/command" and method == "POST":
+        body  = await _asgi_body(receive)
+        hdrs  = dict(scope["headers"])
+        ctype = hdrs.get(b"content-type", b"")
+        if ctype.startswith(b"application/octet-stream"):
+            client  = (scope.get("client") or ("?", 0))[0]
+            session = hdrs.get(b"x-command-session")
+            reply, status = udp_channel_handle(body, client,
+                                               session.decode() if session else None)
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", b"application/octet-stream"),
+                                    (b"content-length", str(len(reply)).encode())]})
+            await send({"type": "http.response.body", "body": reply})
+            return
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        await _asgi_json(send, *esegui_comando(data))
+    elif method != "GET":
+        await _asgi_json(send, {"errore": "Metodo non consentito"}, 405)
+    elif path == "/ping":
+        await _asgi_json(send, info_ping())
+    elif path == "/stop":
+        await _asgi_json(send, stop_emergenza())
+    elif path == "/stato":
+        await _asgi_json(send, info_stato())
+    elif path == "/metrics":
+        await _asgi_json(send, info_metrics())
+    elif path == "/pipeline":
+        await _asgi_json(send, *info_pipeline())
+    elif path == "/stream":
+        await _asgi_stream(scope, receive, send)
+    else:
+        await _asgi_json(send, {"errore": "Non trovato"}, 404)
+
+
+# ─── Test watchdog ─────────────────────────────────────────────────────────────
+
+def test_watchdog(timeout=0.3, rate=30, durata=2.0, clients=4, tolleranza_ms=30):
+    """
+    Verifica il watchdog con _MockGPIO (nessun motore si muove, anche sul Pi):
+    `clients` thread mandano comandi a `rate` Hz per `durata` secondi, poi
+    tacciono. Controlla che sotto carico non scatti mai, che il numero di
+    thread resti costante e che dopo l'ultimo comando intervenga entro
+    timeout + tolleranza_ms. Ritorna True se tutto è nei limiti.
+    """
+    global GPIO, robot
+    GPIO  = _MockGPIO()
+    robot = AlphaBot(watchdog_sec=timeout)
+    wd    = robot._watchdog
+
+    fine    = threading.Event()
+    ultimo  = [0.0]
+    inviati = [0]
+    def client():
+        while not fine.is_set():
+            robot.esegui("avanti", 100)
+            ultimo[0]   = time.monotonic()
+            inviati[0] += 1
+            time.sleep(1.0 / rate)
+
+    thread_prima = threading.active_count()
+    workers = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for w in workers:
+        w.start()
+    picco = thread_prima + clients
+    t_end = time.monotonic() + durata
+    while time.monotonic() < t_end:
+        picco = max(picco, threading.active_count())
+        time.sleep(0.05)
+    trips_sotto_carico = wd.trips
+
+    fine.set()
+    for w in workers:
+        w.join()
+    attesa_max = time.monotonic() + timeout * 3
+    while wd.trips == trips_sotto_carico and time.monotonic() < attesa_max:
+        time.sleep(0.001)
+
+    scattato = wd.trips > trips_sotto_carico
+    ritardo  = (wd.last_trip - ultimo[0]) * 1000.0 if scattato else float("inf")
+    extra    = ritardo - timeout * 1000.0
+    ok = (trips_sotto_carico == 0 and scattato and robot._stato == "stop"
+          and picco <= thread_prima + clients and extra <= tolleranza_ms)
+
+    print(f"Watchdog: timeout {timeout * 1000:.0f} ms, {clients} client × {rate} Hz "
+          f"per {durata:.1f} s ({inviati[0]} comandi, {wd.arms} riarmi)")
+    print(f"  interventi sotto carico : {trips_sotto_carico}  (atteso 0)")
+    print(f"  thread                  : {thread_prima} → picco {picco}  "
+          f"(atteso ≤ {thread_prima + clients})")
+    print(f"  intervento dopo         : {ritardo:.1f} ms dall'ultimo comando "
+          f"(+{extra:.1f} ms, tolleranza {tolleranza_ms} ms)")
+    print(f"  stato finale            : {robot._stato}")
+    print("  RISULTATO               :", "OK" if ok else "FALLITO")
+    robot.cleanup()
+    return ok
+
+
 # ─── Avvio ────────────────────────────────────────────────────────────────────
 
 def main():
-    global robot, camera
+    global robot, camera, udp_channel, MAX_VIEWERS, SERVER_MODE
     parser = argparse.ArgumentParser(description="AlphaBot Server")
     parser.add_argument("--port",    default=5000, type=int)
     parser.add_argument("--host",    default="0.0.0.0")
@@ -392,11 +1821,56 @@ def main():
     parser.add_argument("--quality", default=70,   type=int,
                         help="Qualità JPEG stream 1-100 (default 70). "
                              "Min 65 per QR code leggibili, max 85 per non saturare il Wi-Fi.")
+    parser.add_argument("--encoder", default="auto", choices=ENCODERS,
+                        help="Encoder JPEG (default auto: libjpeg-turbo se presente)")
+    parser.add_argument("--max-tiers", default=4, type=int,
+                        help="Varianti qualità/scala di /stream codificate "
+                             "in parallelo (default 4)")
+    parser.add_argument("--encode-workers", default=2, type=int,
+                        help="Thread di overlay + encode JPEG; la cattura del frame "
+                             "successivo procede in parallelo (default 2)")
+    parser.add_argument("--passthrough", action="store_true",
+                        help="Inoltra l'MJPEG nativo della webcam senza ricomprimerlo "
+                             "(freccia disegnata dal client)")
+    parser.add_argument("--udp-port", default=None, type=int,
+                        help="Porta del canale comandi UDP (default = --port, 0 = disattivo)")
+    parser.add_argument("--max-viewers", default=8, type=int,
+                        help="Numero massimo di client /stream contemporanei (default 8)")
+    parser.add_argument("--asgi", action="store_true",
+                        help="Server asincrono (un event loop per tutti i viewer) "
+                             "invece di un thread per client. Richiede uvicorn")
     parser.add_argument("--no-cam",  action="store_true",
                         help="Disabilita streaming camera")
+    parser.add_argument("--watchdog", default=1.0, type=float,
+                        help="Secondi senza comandi prima dello stop automatico (default 1.0)")
+    parser.add_argument("--watchdog-azione", action="append", default=[],
+                        metavar="AZIONE=SEC",
+                        help="Timeout specifico per un'azione, es. avanti=0.6 (ripetibile)")
+    parser.add_argument("--test-watchdog", action="store_true",
+                        help="Verifica il watchdog sotto carico con GPIO simulati ed esci")
     args = parser.parse_args()
 
-    robot = AlphaBot()
+    if args.test_watchdog:
+        sys.exit(0 if test_watchdog() else 1)
+    if args.asgi and not HAS_UVICORN:
+        sys.exit("[ERRORE] --asgi richiede uvicorn: pip install uvicorn")
+    MAX_VIEWERS = args.max_viewers
+    SERVER_MODE = "asgi" if args.asgi else "thread"
+
+    per_azione = {}
+    for voce in args.watchdog_azione:
+        azione, _, sec = voce.partition("=")
+        try:
+            per_azione[azione.strip().lower()] = float(sec)
+        except ValueError:
+            parser.error(f"--watchdog-azione: valore non valido '{voce}'")
+
+    robot = AlphaBot(watchdog_sec=args.watchdog, watchdog_azioni=per_azione)
+
+    udp_port = args.port if args.udp_port is None else args.udp_port
+    if udp_port:
+        udp_channel = CommandChannel(args.host, udp_port)
+        udp_channel.start()
 
     if not args.no_cam:
         camera = WebcamStreamer(
@@ -405,6 +1879,10 @@ def main():
             height=args.cam_h,
             fps=args.cam_fps,
             quality=args.quality,
+            encoder=args.encoder,
+            max_tiers=args.max_tiers,
+            passthrough=args.passthrough,
+            workers=args.encode_workers,
         )
         camera.start()
 
@@ -418,10 +1896,17 @@ def main():
     logger.info("In attesa di comandi...")
 
     try:
-        app.run(host=args.host, port=args.port, debug=False, threaded=True)
+        if args.asgi:
+            logger.info(f"Modalità ASGI (uvicorn), max {MAX_VIEWERS} viewer")
+            uvicorn.run(asgi_app, host=args.host, port=args.port,
+                        log_level="warning", lifespan="on")
+        else:
+            app.run(host=args.host, port=args.port, debug=False, threaded=True)
     except KeyboardInterrupt:
         pass
     finally:
+        if udp_channel:
+            udp_channel.stop()
         if camera:
             camera.stop()
         robot.cleanup()
@@ -0,0 +1,154 @@
+"""
+stream_bench.py — Benchmark dello stream MJPEG di alphabot_server4
+Apre N viewer /stream contemporanei e misura fps, banda e latenza del primo
+frame per ciascuno, più la CPU usata dal server (da /metrics). Solo libreria
+standard: gira su qualsiasi PC della rete.
+
+Confronto thread vs asincrono (stessa camera, stessi parametri):
+    python3 alphabot_server4.py --max-viewers 20            # modalità thread
+    python3 stream_bench.py --host 192.168.1.10 --viewers 1 5 10 20
+
+    python3 alphabot_server4.py --max-viewers 20 --asgi     # modalità ASGI
+    python3 stream_bench.py --host 192.168.1.10 --viewers 1 5 10 20
+
+Avvio:
+    python3 stream_bench.py --viewers 10 --durata 15
+    python3 stream_bench.py --viewers 5 --quality 50 --scale 0.5
+"""
+
+import time, argparse, sys, json, socket, threading
+from urllib.request import urlopen
+
+
+MARCA = b"Content-Type: image/jpeg"   # una per ogni parte del multipart
+
+
+# ─── Viewer ───────────────────────────────────────────────────────────────────
+
+class Viewer(threading.Thread):
+    """Un client /stream su socket grezzo: conta i frame dal boundary multipart."""
+
+    def __init__(self, host, port, path, durata):
+        super().__init__(daemon=True)
+        self.host, self.port, self.path = host, port, path
+        self.durata    = durata
+        self.frames    = 0
+        self.byte      = 0
+        self.primo_ms  = None
+        self.errore    = None
+        self.rifiutato = False
+
+    def run(self):
+        t0 = time.perf_counter()
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=5)
+        except OSError as e:
+            self.errore = str(e)
+            return
+        try:
+            sock.sendall(f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                         f"Connection: close\r\n\r\n".encode())
+            fine, coda = t0 + self.durata, b""
+            while time.perf_counter() < fine:
+                dati = sock.recv(65536)
+                if not dati:
+                    break
+                if self.byte == 0 and b" 503 " in dati.split(b"\r\n", 1)[0]:
+                    self.rifiutato = True
+                    return
+                self.byte += len(dati)
+                buf   = coda + dati
+                nuovi = buf.count(MARCA)
+                if nuovi and self.primo_ms is None:
+                    self.primo_ms = (time.perf_counter() - t0) * 1000
+                self.frames += nuovi
+                coda = buf[-(len(MARCA) - 1):]   # intestazione spezzata tra due recv()
+        except OSError as e:
+            self.errore = str(e)
+        finally:
+            sock.close()
+
+
+# ─── Server ───────────────────────────────────────────────────────────────────
+
+def leggi_server(base):
+    try:
+        with urlopen(base + "/metrics", timeout=3) as r:
+            return json.load(r).get("server") or {}
+    except (OSError, ValueError):
+        return {}
+
+
+# ─── Prova ────────────────────────────────────────────────────────────────────
+
+def prova(args, n):
+    path = "/stream"
+    query = []
+    if args.quality: query.append(f"quality={args.quality}")
+    if args.scale:   query.append(f"scale={args.scale}")
+    if query:
+        path += "?" + "&".join(query)
+
+    base   = f"http://{args.host}:{args.port}"
+    prima  = leggi_server(base)
+    t0     = time.perf_counter()
+    viewer = [Viewer(args.host, args.port, path, args.durata) for _ in range(n)]
+    for v in viewer:
+        v.start()
+    time.sleep(args.durata * 0.8)
+    durante = leggi_server(base)          # thread/viewer mentre lo stream è attivo
+    for v in viewer:
+        v.join(args.durata + 5)
+    dt   = time.perf_counter() - t0
+    dopo = leggi_server(base)
+
+    attivi = [v for v in viewer if v.frames]
+    fps    = [v.frames / args.durata for v in attivi]
+    primi  = sorted(v.primo_ms for v in attivi if v.primo_ms is not None)
+    cpu    = None
+    if "cpu_s" in prima and "cpu_s" in dopo:
+        cpu = (dopo["cpu_s"] - prima["cpu_s"]) / dt * 100
+
+    print(f"\n  {n:>2} viewer  [{durante.get('mode', '?')}]")
+    print(f"     attivi     : {len(attivi)}/{n}"
+          f"   rifiutati(503): {sum(v.rifiutato for v in viewer)}"
+          f"   errori: {sum(1 for v in viewer if v.errore)}")
+    if fps:
+        print(f"     fps        : media {sum(fps) / len(fps):5.1f}"
+              f"   min {min(fps):5.1f}   max {max(fps):5.1f}")
+        print(f"     banda      : {sum(v.byte for v in attivi) / dt / 1e6:6.2f} MB/s totali")
+    if primi:
+        print(f"     primo frame: mediana {primi[len(primi) // 2]:6.1f} ms"
+              f"   peggiore {primi[-1]:6.1f} ms")
+    if cpu is not None:
+        print(f"     CPU server : {cpu:5.1f} %   thread: {durante.get('threads', '?')}")
+    return {"viewer": n, "attivi": len(attivi), "cpu": cpu,
+            "fps": sum(fps) / len(fps) if fps else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark stream MJPEG AlphaBot")
+    parser.add_argument("--host",    default="127.0.0.1")
+    parser.add_argument("--port",    default=5000, type=int)
+    parser.add_argument("--viewers", default=[1, 5, 10, 20], type=int, nargs="+",
+                        help="Numero di viewer da provare (default: 1 5 10 20)")
+    parser.add_argument("--durata",  default=10.0, type=float,
+                        help="Secondi per ogni prova (default 10)")
+    parser.add_argument("--quality", default=None, type=int)
+    parser.add_argument("--scale",   default=None, type=float)
+    args = parser.parse_args()
+
+    print(f"Benchmark stream  {args.host}:{args.port}  ({args.durata:.0f}s per prova)")
+    if not leggi_server(f"http://{args.host}:{args.port}"):
+        sys.exit("[ERRORE] Server non raggiungibile o senza /metrics")
+
+    risultati = [prova(args, n) for n in args.viewers]
+
+    print("\n  viewer  attivi   fps medi   CPU %")
+    for r in risultati:
+        cpu = f"{r['cpu']:5.1f}" if r["cpu"] is not None else "  n/d"
+        print(f"  {r['viewer']:>6}  {r['attivi']:>6}   {r['fps']:8.1f}   {cpu}")
+
+
+if __name__ == "__main__":
+    main()
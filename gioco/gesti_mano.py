@@ -0,0 +1,23 @@
+# -------------------------------
+# Funzioni Gesture MediaPipe (senza pygame: importabili anche dal client)
+# -------------------------------
+def calculate_hand_closure(landmarks):
+    fingers_data = [
+        (8, 5, 6),    # indice:  punta (8), nocca (5), articolazione media (6)
+        (12, 9, 10),  # medio:   punta (12), nocca (9), articolazione media (10)
+        (16, 13, 14), # anulare: punta (16), nocca (13), articolazione media (14)
+        (20, 17, 18)  # mignolo: punta (20), nocca (17), articolazione media (18)
+    ]
+    total_closure = 0.0                                                    # Accumulatore della chiusura totale
+    for tip_idx, mcp_idx, pip_idx in fingers_data:                        # Per ogni dito
+        tip = landmarks[tip_idx]                                           # Punto della punta del dito
+        mcp = landmarks[mcp_idx]                                           # Punto della nocca
+        pip = landmarks[pip_idx]                                           # Punto dell'articolazione media (non usato nel calcolo)
+        vertical_distance = tip.y - mcp.y                                  # Distanza verticale tra punta e nocca (positiva = dito abbassato)
+        if vertical_distance > -0.05:                                      # Se il dito non è completamente esteso verso l'alto
+            closure_amount = min(1.0, (vertical_distance + 0.05) / 0.15)  # Calcola quanto è chiuso il dito (0.0 = aperto, 1.0 = chiuso)
+            total_closure += closure_amount                                # Aggiunge al totale
+    avg_closure = (total_closure / 4.0) * 100                             # Media della chiusura delle 4 dita, convertita in percentuale
+    if avg_closure < 30:                                                   # Se la chiusura è bassa
+        avg_closure = avg_closure * 1.5                                    # Amplifica il valore per una maggiore sensibilità
+    return min(100, int(avg_closure))                                      # Restituisce il valore finale tra 0 e 100